@@ -2,21 +2,41 @@
 from flask import Flask
 from flask_cors import CORS
 
+from routes.artifact_routes import artifacts_bp
 from routes.detection_routes import detect_bp
+from routes.environment_routes import environments_bp
 from routes.evaluation_routes import evaluation_bp
+from routes.export_routes import exports_bp
+from routes.event_routes import events_bp
+from routes.job_routes import jobs_bp
+from routes.metrics_routes import metrics_bp
+from routes.sweep_routes import sweeps_bp
 from routes.training_routes import training_bp
 from routes.validation_routes import validation_bp
 from flasgger import Swagger
+from services.environment_service import registry as environment_registry
+from services import metrics_service
 
 
 def create_app():
     app = Flask(__name__)
     swagger = Swagger(app)
     CORS(app)
+    metrics_service.init_app(app)
     app.register_blueprint(training_bp, url_prefix='/api/training')
     app.register_blueprint(detect_bp, url_prefix='/api/detection')
     app.register_blueprint(evaluation_bp, url_prefix='/api/evaluation')
     app.register_blueprint(validation_bp, url_prefix='/api/validation')
+    app.register_blueprint(jobs_bp, url_prefix='/api/jobs')
+    app.register_blueprint(events_bp, url_prefix='/api/events')
+    app.register_blueprint(environments_bp, url_prefix='/api/environments')
+    app.register_blueprint(sweeps_bp, url_prefix='/api/sweeps')
+    app.register_blueprint(artifacts_bp, url_prefix='/api/artifacts')
+    app.register_blueprint(exports_bp, url_prefix='/api/exports')
+    app.register_blueprint(metrics_bp)
+
+    # Resolve the model environments in the background, so the first job does not wait for conda
+    environment_registry.prewarm()
 
     return app
 
@@ -0,0 +1,58 @@
+"""
+Compares two benchmark result files.
+
+    python -m benchmarks.compare before.json after.json [--threshold 10]
+
+Prints every latency (*_ms) and throughput (*_per_s) value of both runs with the
+relative change; changes worse than the threshold (percent) are marked.
+"""
+import argparse
+import json
+
+
+def flatten(data, prefix=""):
+    values = {}
+    for key, value in data.items():
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            values.update(flatten(value, path))
+        elif isinstance(value, (int, float)) and (key.endswith("_ms") or key.endswith("_per_s")):
+            values[path] = value
+    return values
+
+
+def compare(before, after, threshold=10.0):
+    """Returns rows (metric, before, after, change in percent, regression) for the metrics of both reports."""
+    old, new = flatten(before["results"]), flatten(after["results"])
+    rows = []
+    for path in sorted(set(old) & set(new)):
+        change = (new[path] - old[path]) / old[path] * 100 if old[path] else 0.0
+        # Lower latency is better, higher throughput is better
+        worse = change if path.endswith("_ms") else -change
+        rows.append((path, old[path], new[path], round(change, 1), worse > threshold))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compares two benchmark result files.")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Regression threshold in percent.")
+    args = parser.parse_args(argv)
+
+    with open(args.before, "r", encoding="utf-8") as f:
+        before = json.load(f)
+    with open(args.after, "r", encoding="utf-8") as f:
+        after = json.load(f)
+
+    print(f"before: {before.get('commit')} {before.get('time')}")
+    print(f"after:  {after.get('commit')} {after.get('time')}")
+    rows = compare(before, after, args.threshold)
+    width = max((len(row[0]) for row in rows), default=10)
+    for path, old, new, change, regression in rows:
+        print(f"{path:<{width}}  {old:>12.3f}  {new:>12.3f}  {change:+7.1f}%{'  <-- regression' if regression else ''}")
+    return 1 if any(row[4] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,310 @@
+"""
+Benchmarks of the backend hot paths.
+
+Builds a synthetic workspace (model folder with stub train.py/detect.py/val.py,
+runs/train|detect|val trees with 10k experiments, a small dataset), starts the app
+inside it and measures through the Flask test client:
+
+    list        training/detection/validation list endpoints, cold (first request) and warm
+    images      result image serving: original, thumbnail generation, cached thumbnail, 304 revalidation
+    launch      job launch latency: request, spawn to first log line / first result image, total
+    logs        log streaming throughput of a training job followed over SSE
+    concurrent  throughput and latency of mixed read requests with 1..N concurrent clients
+
+Usage (from the backend folder):
+
+    python -m benchmarks.run --output bench.json
+    python -m benchmarks.run --only list,images --train-runs 20000
+    python -m benchmarks.compare before.json after.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARKS = ("list", "images", "launch", "logs", "concurrent")
+
+
+def summarize(durations):
+    """Latency statistics in milliseconds."""
+    ordered = sorted(durations)
+    return {
+        "n": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "p50_ms": round(ordered[len(ordered) // 2] * 1000, 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+def timed(call):
+    started = time.perf_counter()
+    response = call()
+    return time.perf_counter() - started, response
+
+
+def repeat(call, iterations, expected_status=200):
+    durations = []
+    for _ in range(iterations):
+        duration, response = timed(call)
+        if response.status_code != expected_status:
+            raise Exception(f"Unexpected status {response.status_code}: {response.get_data(as_text=True)[:200]}")
+        durations.append(duration)
+    return summarize(durations)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def use_interpreter(python_path):
+    """Points every model environment at the given interpreter (the stubs need no conda environment)."""
+    from services.environment_service import registry
+
+    with registry.lock:
+        for env_name in set(registry.environments.values()):
+            registry.entries[env_name] = {
+                "environment": env_name, "python": python_path, "mtime": os.stat(python_path).st_mtime,
+                "fallback": False, "error": None, "config": None, "resolved_at": time.time(), "resolve_seconds": 0,
+            }
+    # Keep the background prewarm from replacing the entries
+    registry.prewarm_thread = threading.current_thread()
+
+
+def wait_for_job(client, job_id, timeout=300):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f"/api/jobs/{job_id}").get_json()
+        if job["state"] not in ("queued", "running"):
+            return job
+        time.sleep(0.02)
+    raise Exception(f"Job {job_id} did not finish within {timeout}s")
+
+
+def bench_list(client, model, iterations):
+    results = {}
+    for kind, url in (("training", "/api/training/list"), ("detection", "/api/detection/list"),
+                      ("validation", "/api/validation/list")):
+        cold, response = timed(lambda: client.get(f"{url}?model={model}&page=1&page_size=50"))
+        total = response.get_json()["total"]
+        results[kind] = {
+            "runs": total,
+            "cold_ms": round(cold * 1000, 3),
+            "page": repeat(lambda: client.get(f"{url}?model={model}&page=1&page_size=50"), iterations),
+            "page_last": repeat(lambda: client.get(f"{url}?model={model}&page={max(1, total // 50)}&page_size=50"),
+                                iterations),
+            "search": repeat(lambda: client.get(f"{url}?model={model}&page=1&page_size=50&q=exp12"), iterations),
+            "full": repeat(lambda: client.get(f"{url}?model={model}"), max(1, iterations // 10)),
+        }
+    return results
+
+
+def bench_images(client, model, iterations):
+    from services.image_cache_service import DERIVATIVE_DIR
+
+    base = f"/api/detection/image/{model}"
+    original = repeat(lambda: client.get(f"{base}/exp1/img0.jpg"), iterations)
+
+    # A reused workspace still has the derivatives of the previous run
+    shutil.rmtree(DERIVATIVE_DIR, ignore_errors=True)
+    thumbnails = []
+    for i in range(1, min(iterations, 50) + 1):
+        duration, response = timed(lambda: client.get(f"{base}/exp{i}/img1.jpg?w=320&fmt=webp"))
+        if response.status_code == 200:
+            thumbnails.append(duration)
+    cached = repeat(lambda: client.get(f"{base}/exp1/img1.jpg?w=320&fmt=webp"), iterations)
+
+    etag = client.get(f"{base}/exp1/img0.jpg").headers.get("ETag")
+    revalidate = repeat(lambda: client.get(f"{base}/exp1/img0.jpg", headers={"If-None-Match": etag}),
+                        iterations, expected_status=304) if etag else None
+    return {"original": original, "thumbnail_generate": summarize(thumbnails) if thumbnails else None,
+            "thumbnail_cached": cached, "not_modified": revalidate}
+
+
+def bench_launch(client, model, workspace, runs):
+    from services.event_service import bus, experiment_topic
+    from services.log_service import registry as logs
+
+    dataset = os.path.join(workspace, "dataset", "images")
+    training = {"request": [], "first_output": [], "total": []}
+    for _ in range(runs):
+        started = time.perf_counter()
+        response = client.post("/api/training/", json={
+            "model": model, "dataDir": os.path.join(dataset, "train"), "valDir": os.path.join(dataset, "val"),
+            "classList": ["person", "car", "bus"], "epochs": 1, "skipPreflight": True})
+        training["request"].append(time.perf_counter() - started)
+        job_id = response.get_json()["job_id"]
+        log = logs.get(job_id, timeout=30)
+        log.read(0, timeout=30)
+        training["first_output"].append(time.perf_counter() - started)
+        wait_for_job(client, job_id)
+        training["total"].append(time.perf_counter() - started)
+
+    detection = {"request": [], "first_image": [], "total": []}
+    for _ in range(runs):
+        started = time.perf_counter()
+        response = client.post("/api/detection/", data={
+            "model": model, "trainingRun": "exp1", "source": os.path.join(dataset, "val"), "engine": "script"})
+        detection["request"].append(time.perf_counter() - started)
+        body = response.get_json()
+        bus.wait(experiment_topic("detect", model, body["experiment"]), 0, timeout=30, types=("image",))
+        detection["first_image"].append(time.perf_counter() - started)
+        wait_for_job(client, body["job_id"])
+        detection["total"].append(time.perf_counter() - started)
+
+    return {"training": {key: summarize(values) for key, values in training.items()},
+            "detection": {key: summarize(values) for key, values in detection.items()}}
+
+
+def bench_logs(client, model, workspace, epochs, batches):
+    dataset = os.path.join(workspace, "dataset", "images")
+    os.environ["BENCH_BATCHES"] = str(batches)
+    try:
+        started = time.perf_counter()
+        job_id = client.post("/api/training/", json={
+            "model": model, "dataDir": os.path.join(dataset, "train"), "classList": ["person", "car", "bus"],
+            "epochs": epochs, "skipPreflight": True}).get_json()["job_id"]
+        response = client.get(f"/api/training/logs?job_id={job_id}", buffered=False)
+        lines = 0
+        first = None
+        for chunk in response.response:
+            text = chunk.decode() if isinstance(chunk, bytes) else chunk
+            count = text.count("\ndata: ") + text.startswith("data: ")
+            if count and first is None:
+                first = time.perf_counter() - started
+            lines += count
+        elapsed = time.perf_counter() - started
+        response.close()
+    finally:
+        os.environ.pop("BENCH_BATCHES", None)
+    return {"lines": lines, "seconds": round(elapsed, 3), "lines_per_s": round(lines / elapsed, 1),
+            "first_line_ms": round(first * 1000, 3) if first is not None else None}
+
+
+def bench_concurrent(app, model, clients_levels, requests_per_client):
+    urls = [
+        f"/api/training/list?model={model}&page=1&page_size=50",
+        f"/api/detection/list?model={model}&page=3&page_size=50",
+        f"/api/validation/list?model={model}&page=1&page_size=50",
+        f"/api/detection/image/{model}/exp2/img0.jpg",
+        "/api/jobs/?limit=20",
+        "/api/jobs/stats",
+    ]
+    results = {}
+    for level in clients_levels:
+        def worker(index):
+            client = app.test_client()
+            durations = []
+            for i in range(requests_per_client):
+                duration, response = timed(lambda: client.get(urls[(index + i) % len(urls)]))
+                if response.status_code != 200:
+                    raise Exception(f"Unexpected status {response.status_code}")
+                durations.append(duration)
+            return durations
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=level) as pool:
+            durations = [d for result in pool.map(worker, range(level)) for d in result]
+        elapsed = time.perf_counter() - started
+        results[str(level)] = dict(summarize(durations), requests_per_s=round(len(durations) / elapsed, 1))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the backend hot paths.")
+    parser.add_argument("--workspace", help="Workspace folder, a temporary folder by default. "
+                                            "An existing workspace is reused without regenerating it.")
+    parser.add_argument("--output", help="JSON file for the results, printed to stdout by default.")
+    parser.add_argument("--only", help=f"Comma separated subset of {','.join(BENCHMARKS)}.")
+    parser.add_argument("--model", default="yolov5")
+    parser.add_argument("--train-runs", type=int, default=6000)
+    parser.add_argument("--detect-runs", type=int, default=3000)
+    parser.add_argument("--val-runs", type=int, default=1000)
+    parser.add_argument("--images-per-run", type=int, default=4)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--launch-runs", type=int, default=3)
+    parser.add_argument("--log-epochs", type=int, default=20)
+    parser.add_argument("--log-batches", type=int, default=500)
+    parser.add_argument("--clients", default="1,4,16")
+    parser.add_argument("--requests-per-client", type=int, default=50)
+    args = parser.parse_args(argv)
+
+    selected = args.only.split(",") if args.only else list(BENCHMARKS)
+    unknown = set(selected) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    output = os.path.abspath(args.output) if args.output else None
+    workspace = os.path.abspath(args.workspace or tempfile.mkdtemp(prefix="backend-bench-"))
+    os.makedirs(workspace, exist_ok=True)
+    report = {"commit": git_commit(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+              "platform": platform.platform(), "cpu_count": os.cpu_count(), "workspace": workspace,
+              "config": {key: value for key, value in vars(args).items() if key not in ("output", "workspace")},
+              "results": {}}
+
+    # The services resolve run folders against the working directory and keep their state in APP_DATA_DIR
+    sys.path.insert(0, BACKEND_DIR)
+    os.chdir(workspace)
+    os.environ["APP_DATA_DIR"] = os.path.join(workspace, "data")
+    # The stub trainer writes no real weights, an automatic ONNX export would only fail in the background
+    os.environ["AUTO_EXPORT_ONNX"] = "0"
+
+    from benchmarks import synthetic
+
+    if not os.path.isdir(os.path.join(workspace, args.model, "runs")):
+        started = time.perf_counter()
+        tree = synthetic.build_run_tree(workspace, args.train_runs, args.detect_runs, args.val_runs,
+                                        args.images_per_run, args.model)
+        report["workspace_setup"] = dict(tree, seconds=round(time.perf_counter() - started, 3))
+    synthetic.install_stubs(workspace, args.model)
+
+    use_interpreter(sys.executable)
+    from app import create_app
+
+    app = create_app()
+    client = app.test_client()
+
+    # The services print job output, keep stdout for the report
+    with contextlib.redirect_stdout(sys.stderr):
+        for name in selected:
+            print(f"Running {name} benchmark...")
+            started = time.perf_counter()
+            if name == "list":
+                result = bench_list(client, args.model, args.iterations)
+            elif name == "images":
+                result = bench_images(client, args.model, args.iterations)
+            elif name == "launch":
+                result = bench_launch(client, args.model, workspace, args.launch_runs)
+            elif name == "logs":
+                result = bench_logs(client, args.model, workspace, args.log_epochs, args.log_batches)
+            else:
+                levels = [int(level) for level in args.clients.split(",")]
+                result = bench_concurrent(app, args.model, levels, args.requests_per_client)
+            report["results"][name] = result
+            print(f"  done in {time.perf_counter() - started:.1f}s")
+
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""
+Stand-in for YOLOv5 detect.py: copies every source image into the run folder,
+writes labels with confidences (--save-txt --save-conf) and prints the per-image
+lines the backend parses.
+
+Environment:
+    BENCH_LINE_DELAY: seconds per image (default 0)
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import time
+
+parser = argparse.ArgumentParser()
+for option in ("--weights", "--img", "--source", "--conf", "--iou", "--project", "--name"):
+    parser.add_argument(option)
+for flag in ("--exist-ok", "--save-txt", "--save-conf"):
+    parser.add_argument(flag, action="store_true")
+opt = parser.parse_args()
+
+delay = float(os.environ.get("BENCH_LINE_DELAY", 0))
+run_dir = os.path.join(opt.project, opt.name)
+os.makedirs(os.path.join(run_dir, "labels"), exist_ok=True)
+images = sorted(name for name in os.listdir(opt.source) if name.lower().endswith((".jpg", ".jpeg", ".png")))
+rng = random.Random(0)
+for index, name in enumerate(images, 1):
+    path = os.path.abspath(os.path.join(opt.source, name))
+    shutil.copyfile(path, os.path.join(run_dir, name))
+    if opt.save_txt:
+        with open(os.path.join(run_dir, "labels", os.path.splitext(name)[0] + ".txt"), "w") as f:
+            for _ in range(rng.randint(1, 8)):
+                f.write(f"{rng.randint(0, 2)} {rng.random():.4f} {rng.random():.4f} {rng.random() / 4:.4f} "
+                        f"{rng.random() / 4:.4f} {rng.random():.4f}\n")
+    sys.stdout.write(f"image {index}/{len(images)} {path}: 480x640 2 persons, 1 bus, 4.2ms\n")
+    sys.stdout.flush()
+    if delay:
+        time.sleep(delay)
+sys.stdout.write(f"Results saved to {run_dir}\n")
@@ -0,0 +1,63 @@
+"""
+Stand-in for YOLOv5 train.py: prints the trainer's progress bar and validation
+output at a configurable rate and writes the run folder (opt.yaml, results.csv,
+weights) like the real trainer. No torch needed.
+
+Environment:
+    BENCH_BATCHES: progress bar updates per epoch (default 50)
+    BENCH_LINE_DELAY: seconds between output lines (default 0, as fast as possible)
+"""
+import argparse
+import os
+import sys
+import time
+
+parser = argparse.ArgumentParser()
+for option in ("--img", "--batch", "--epochs", "--weights", "--data", "--project", "--name", "--workers", "--resume"):
+    parser.add_argument(option)
+parser.add_argument("--exist-ok", action="store_true")
+opt = parser.parse_args()
+
+batches = int(os.environ.get("BENCH_BATCHES", 50))
+delay = float(os.environ.get("BENCH_LINE_DELAY", 0))
+epochs = int(opt.epochs or 3)
+
+project = opt.project or os.path.join("runs", "train")
+name = opt.name
+if not name:
+    number = 1
+    while os.path.exists(os.path.join(project, f"exp{number}")):
+        number += 1
+    name = f"exp{number}"
+run_dir = os.path.join(project, name)
+os.makedirs(os.path.join(run_dir, "weights"), exist_ok=True)
+with open(os.path.join(run_dir, "opt.yaml"), "w") as f:
+    f.write(f"imgsz: {opt.img}\nbatch_size: {opt.batch}\nepochs: {epochs}\ndata: {opt.data}\n")
+with open(os.path.join(run_dir, "results.csv"), "w") as f:
+    f.write("               epoch,      train/box_loss,      train/obj_loss,      train/cls_loss,   metrics/precision,"
+            "      metrics/recall,     metrics/mAP_0.5,metrics/mAP_0.5:0.95\n")
+
+out = sys.stdout
+out.write(f"Logging results to {run_dir}\n")
+out.write("      Epoch    GPU_mem   box_loss   obj_loss   cls_loss  Instances       Size\n")
+for epoch in range(epochs):
+    for batch in range(1, batches + 1):
+        percent = batch * 100 // batches
+        # tqdm redraws the bar with carriage returns, the backend splits them into lines
+        out.write(f"\r      {epoch}/{epochs - 1}      0G     0.1127    0.06877    0.03617         92        640: "
+                  f"{percent:3d}%|####      | {batch}/{batches} [00:05<00:06,  1.74it/s]")
+        out.flush()
+        if delay:
+            time.sleep(delay)
+    out.write("\n                 Class     Images  Instances          P          R      mAP50   mAP50-95\n")
+    map50_95 = 0.3 + 0.4 * (epoch + 1) / epochs
+    out.write(f"                   all        128        929      0.735      0.624      {map50_95 * 1.5:.3f}      {map50_95:.3f}\n")
+    out.flush()
+    with open(os.path.join(run_dir, "results.csv"), "a") as f:
+        f.write(f"{epoch}, 0.1, 0.06, 0.03, 0.735, 0.624, {map50_95 * 1.5:.4f}, {map50_95:.4f}\n")
+    with open(os.path.join(run_dir, "weights", "last.pt"), "wb") as f:
+        f.write(b"stub checkpoint")
+
+os.replace(os.path.join(run_dir, "weights", "last.pt"), os.path.join(run_dir, "weights", "best.pt"))
+out.write(f"{epochs} epochs completed in 0.001 hours.\n")
+out.write(f"Results saved to {run_dir}\n")
@@ -0,0 +1,100 @@
+"""Generates a synthetic backend workspace: model folders with stub scripts, run trees and a dataset."""
+import io
+import json
+import os
+import shutil
+
+STUB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stubs")
+MODEL = "yolov5"
+CLASSES = ["person", "car", "bus"]
+
+
+def make_jpeg(width=640, height=480, seed=0):
+    """Returns the bytes of a JPEG with some structure, so thumbnails cost what they cost on real photos."""
+    from PIL import Image, ImageDraw
+
+    image = Image.new("RGB", (width, height), ((seed * 37) % 256, (seed * 91) % 256, 120))
+    draw = ImageDraw.Draw(image)
+    for i in range(24):
+        x, y = (seed * 13 + i * 53) % width, (seed * 7 + i * 31) % height
+        draw.rectangle([x, y, x + 40 + i * 3, y + 30 + i * 2], fill=((i * 47) % 256, (i * 19) % 256, (i * 83) % 256))
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def _write(path, data):
+    with open(path, "wb" if isinstance(data, bytes) else "w") as f:
+        f.write(data)
+
+
+def install_stubs(root, model=MODEL):
+    """Copies the stub train.py/detect.py/val.py into <root>/<model>."""
+    model_dir = os.path.join(root, model)
+    os.makedirs(model_dir, exist_ok=True)
+    for name in ("train.py", "detect.py", "val.py"):
+        shutil.copyfile(os.path.join(STUB_DIR, name), os.path.join(model_dir, name))
+
+
+def build_dataset(root, images=64):
+    """Creates dataset/images/{train,val} with YOLO labels and its dataset YAML; returns the YAML path."""
+    jpeg = make_jpeg()
+    for split in ("train", "val"):
+        image_dir = os.path.join(root, "dataset", "images", split)
+        label_dir = os.path.join(root, "dataset", "labels", split)
+        os.makedirs(image_dir, exist_ok=True)
+        os.makedirs(label_dir, exist_ok=True)
+        for i in range(images):
+            _write(os.path.join(image_dir, f"{i:05d}.jpg"), jpeg)
+            _write(os.path.join(label_dir, f"{i:05d}.txt"), f"{i % len(CLASSES)} 0.5 0.5 0.2 0.3\n1 0.3 0.3 0.1 0.1\n")
+    yaml_path = os.path.join(root, "yaml", "dataset.yaml")
+    os.makedirs(os.path.dirname(yaml_path), exist_ok=True)
+    _write(yaml_path, f"train: {os.path.join(root, 'dataset', 'images', 'train')}\n"
+                      f"val: {os.path.join(root, 'dataset', 'images', 'val')}\n"
+                      f"nc: {len(CLASSES)}\nnames: {json.dumps(CLASSES)}\n")
+    return yaml_path
+
+
+def build_run_tree(root, train_runs=6000, detect_runs=3000, val_runs=1000, images_per_run=4, model=MODEL):
+    """
+    Creates runs/train|detect|val of a model with the given number of experiments.
+
+    Training runs get opt.yaml, results.csv and weights/best.pt, detection runs
+    result images with labels, validation runs results.json.
+
+    Returns:
+        dict: Number of created runs and files.
+    """
+    yaml_path = build_dataset(root)
+    base = os.path.join(root, model, "runs")
+    files = 0
+
+    opt = f"imgsz: 640\nbatch_size: 16\nepochs: 3\ndata: {yaml_path}\n"
+    results = ("epoch, metrics/precision, metrics/recall, metrics/mAP_0.5, metrics/mAP_0.5:0.95\n"
+               "0, 0.5, 0.4, 0.45, 0.3\n1, 0.6, 0.5, 0.55, 0.35\n2, 0.7, 0.6, 0.65, 0.4\n")
+    for i in range(1, train_runs + 1):
+        run_dir = os.path.join(base, "train", f"exp{i}")
+        os.makedirs(os.path.join(run_dir, "weights"))
+        _write(os.path.join(run_dir, "opt.yaml"), opt)
+        _write(os.path.join(run_dir, "results.csv"), results)
+        _write(os.path.join(run_dir, "weights", "best.pt"), b"stub weights")
+        files += 3
+
+    jpegs = [make_jpeg(seed=seed) for seed in range(images_per_run)]
+    for i in range(1, detect_runs + 1):
+        run_dir = os.path.join(base, "detect", f"exp{i}")
+        os.makedirs(os.path.join(run_dir, "labels"))
+        for j, jpeg in enumerate(jpegs):
+            _write(os.path.join(run_dir, f"img{j}.jpg"), jpeg)
+            _write(os.path.join(run_dir, "labels", f"img{j}.txt"), "0 0.5 0.5 0.2 0.3 0.9\n2 0.2 0.2 0.1 0.1 0.4\n")
+            files += 2
+
+    metrics = json.dumps({"precision": 0.7, "recall": 0.6, "mAP_0.5": 0.65, "mAP_0.5:0.95": 0.4})
+    for i in range(1, val_runs + 1):
+        run_dir = os.path.join(base, "val", f"exp{i}")
+        os.makedirs(run_dir)
+        _write(os.path.join(run_dir, "results.json"), metrics)
+        files += 1
+
+    return {"train_runs": train_runs, "detect_runs": detect_runs, "val_runs": val_runs,
+            "experiments": train_runs + detect_runs + val_runs, "files": files}
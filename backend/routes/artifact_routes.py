@@ -0,0 +1,67 @@
+import os
+
+from flasgger import swag_from
+from flask import Blueprint, request, jsonify, Response
+
+from services.artifact_service import get_manifest, send_artifact, stream_archive
+from services.output_service import read_run_log
+
+artifacts_bp = Blueprint('artifacts_bp', __name__)
+current_dir = os.path.dirname(os.path.abspath(__file__))
+yaml_path = os.path.join(current_dir, 'docs', 'artifact_api.yaml')
+
+
+@artifacts_bp.route("/<model>/<kind>/<exp>/manifest", methods=["GET"])
+@swag_from(yaml_path)
+def artifact_manifest(model, kind, exp):
+    """Returns the files of a run with their sizes and SHA-256 hashes."""
+    try:
+        manifest = get_manifest(model, kind, exp)
+    except FileNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+    if request.if_none_match.contains(manifest["etag"]):
+        return Response(status=304, headers={"ETag": f'"{manifest["etag"]}"'})
+    response = jsonify(manifest)
+    response.set_etag(manifest["etag"])
+    return response
+
+@artifacts_bp.route("/<model>/<kind>/<exp>/archive", methods=["GET"])
+@swag_from(yaml_path)
+def artifact_archive(model, kind, exp):
+    """Streams a run or the files matching include/exclude as a ZIP or tar archive."""
+    try:
+        chunks, mimetype, download_name, count, total_bytes = stream_archive(
+            model, kind, exp, request.args.get("format", "zip"),
+            request.args.get("include"), request.args.get("exclude"))
+    except FileNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+    return Response(chunks, mimetype=mimetype, headers={
+        "Content-Disposition": f'attachment; filename="{download_name}"',
+        "X-Archive-Files": str(count),
+        "X-Archive-Source-Bytes": str(total_bytes),
+        "X-Accel-Buffering": "no",
+    })
+
+@artifacts_bp.route("/<model>/<kind>/<exp>/file/<path:filename>", methods=["GET"])
+@swag_from(yaml_path)
+def artifact_file(model, kind, exp, filename):
+    """Returns one file of a run (optionally resized, see send_result_file)."""
+    return send_artifact(model, kind, exp, filename, request.args)
+
+@artifacts_bp.route("/<model>/<kind>/<exp>/log", methods=["GET"])
+@swag_from(yaml_path)
+def artifact_log(model, kind, exp):
+    """Returns a range of lines of the output log the run's script wrote (output.log.gz)."""
+    try:
+        tail = request.args.get("tail")
+        result = read_run_log(model, kind, exp, int(request.args.get("offset", 0)),
+                              int(request.args.get("limit", 1000)), int(tail) if tail else None)
+    except FileNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(result), 200
@@ -1,6 +1,16 @@
+import json
 import os
-from flask import Blueprint, request, jsonify, send_from_directory
-from services.detection_service import run_detection_logic, get_latest_images_logic, get_detection_list, get_detection
+import shutil
+
+from flask import Blueprint, request, jsonify, Response
+from services.detection_service import run_detection_logic, get_latest_images_logic, get_detection_list, \
+    get_detection, run_batch_detection, save_uploaded_images
+from services.artifact_service import send_artifact
+from services.detection_cache_service import cache_stats
+from services.inference_service import get_engine_status
+from services.metrics_service import track_stream
+from services.prediction_store_service import query_run
+from services.catalog_service import list_query_from_args
 from flasgger import swag_from
 
 detect_bp = Blueprint('detect_bp', __name__)
@@ -13,15 +23,69 @@ yaml_path = os.path.join(current_dir, 'docs', 'detection_api.yaml')
 def start_detection():
     """Starts the detection process"""
     try:
-        experiment, command = run_detection_logic(request.form)
+        experiment, command, job_id = run_detection_logic(request.form)
         return jsonify({
             "message": "Detection initiated",
             "experiment": experiment,
-            "command": command
+            "command": command,
+            "job_id": job_id
         }), 202
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
+@detect_bp.route("/batch", methods=["POST"])
+@swag_from(yaml_path)
+def batch_detection():
+    """
+    Runs detection on many images in one request and streams the detections as NDJSON.
+
+    Accepts either multipart form data with the files in "images", or JSON/form data
+    with a list of server-side image paths in "paths". Other parameters: model,
+    trainingRun, img_size, conf, iou, batch_size, render and cache.
+    """
+    data = request.get_json(silent=True) or request.form
+    model = data.get("model")
+    training_run = data.get("trainingRun")
+    if not (model and training_run):
+        return jsonify({"error": "Parameters model and trainingRun are required"}), 400
+
+    upload_dir = None
+    uploaded_names = {}
+    files = request.files.getlist("images")
+    if files:
+        upload_dir, paths = save_uploaded_images(files)
+        uploaded_names = {path: file.filename for path, file in zip(paths, files)}
+    elif isinstance(data.get("paths"), list):
+        paths = data.get("paths")
+    else:
+        paths = request.form.getlist("paths")
+
+    render = str(data.get("render", "false")).lower() in ("1", "true", "yes")
+    cache = str(data.get("cache", "true")).lower() not in ("0", "false", "no")
+    try:
+        # The inference worker stays locked until its response is complete, so the response is
+        # read fully before streaming and a slow client cannot hold up other requests to the worker
+        records = list(run_batch_detection(model, training_run, paths, int(data.get("img_size", 640)),
+                                           float(data.get("conf", 0.25)), float(data.get("iou", 0.45)),
+                                           int(data.get("batch_size", 16)), render, cache))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+    finally:
+        if upload_dir:
+            shutil.rmtree(upload_dir, ignore_errors=True)
+
+    def to_line(record):
+        # Uploaded images are reported under their original name, not the temporary path
+        if record.get("path") in uploaded_names:
+            record["name"] = uploaded_names[record.pop("path")]
+        return json.dumps(record) + "\n"
+
+    def generate():
+        for record in records:
+            yield to_line(record)
+
+    return Response(track_stream("detection_batch", generate()), mimetype="application/x-ndjson")
+
 @detect_bp.route("/get", methods=["GET"])
 @swag_from("docs/detection_api.yaml")
 def detection():
@@ -47,7 +111,7 @@ def list_detection_runs():
         return jsonify({"error": "Model parameter is required"}), 400
 
     try:
-        runs = get_detection_list(model)
+        runs = get_detection_list(model, **list_query_from_args(request.args))
         return jsonify(runs)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -61,16 +125,18 @@ def get_latest_images():
     Query Parameters:
       - experiment: (required) the experiment ID.
       - model: (optional) model name.
+      - wait: (optional) seconds to wait for the first result image, defaults to 0.
     """
     experiment = request.args.get("experiment")
     model = request.args.get("model")
+    wait = min(request.args.get("wait", 0, type=float), 30)
     if not experiment:
         return jsonify({"error": "Experiment parameter is required"}), 400
     if not model:
         return jsonify({"error": "Model parameter is required"}), 400
 
     try:
-        result = get_latest_images_logic(model, experiment)
+        result = get_latest_images_logic(model, experiment, wait)
         return jsonify(result)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -78,6 +144,44 @@ def get_latest_images():
 @detect_bp.route("/image/<model>/<exp_folder>/<filename>", methods=["GET"])
 @swag_from(yaml_path)
 def get_detection_image(model, exp_folder, filename):
-    """Returns a specific detected image file"""
-    base_dir = os.path.join(os.getcwd(), model, "runs", "detect", exp_folder)
-    return send_from_directory(base_dir, filename)
+    """Returns a specific detected image file (optionally resized, see send_result_file)"""
+    return send_artifact(model, "detect", exp_folder, filename, request.args)
+
+@detect_bp.route("/rethreshold", methods=["GET"])
+@swag_from(yaml_path)
+def rethreshold():
+    """
+    Applies new conf/iou thresholds to the stored predictions of a run and returns the
+    resulting counts (and optionally metrics) without running the model again.
+    """
+    model = request.args.get("model")
+    experiment = request.args.get("experiment")
+    if not (model and experiment):
+        return jsonify({"error": "Parameters model and experiment are required"}), 400
+    classes = request.args.get("classes")
+    try:
+        result = query_run(
+            model, experiment,
+            kind=request.args.get("kind", "detect"),
+            conf=request.args.get("conf", 0.25, type=float),
+            iou=request.args.get("iou", type=float),
+            classes=[int(c) for c in classes.split(",")] if classes else None,
+            agnostic=request.args.get("agnostic", "").lower() == "true",
+            metrics=request.args.get("metrics", "").lower() == "true",
+            source=request.args.get("source"),
+            image=request.args.get("image"),
+        )
+        return jsonify(result), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@detect_bp.route("/engine", methods=["GET"])
+@swag_from(yaml_path)
+def engine_status():
+    """Returns the state of the warm inference workers and their model caches."""
+    try:
+        return jsonify(dict(get_engine_status(), result_cache=cache_stats()))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
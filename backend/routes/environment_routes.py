@@ -0,0 +1,35 @@
+import os
+
+from flasgger import swag_from
+from flask import Blueprint, request, jsonify
+
+from services.environment_service import registry
+
+environments_bp = Blueprint('environments_bp', __name__)
+current_dir = os.path.dirname(os.path.abspath(__file__))
+yaml_path = os.path.join(current_dir, 'docs', 'environment_api.yaml')
+
+
+@environments_bp.route("/", methods=["GET"])
+@swag_from(yaml_path)
+def list_environments():
+    """Returns the resolved interpreter and torch/thread configuration of every model environment."""
+    return jsonify(registry.status()), 200
+
+@environments_bp.route("/refresh", methods=["POST"])
+@swag_from(yaml_path)
+def refresh_environments():
+    """
+    Drops the cached environments and resolves them again.
+
+    Query Parameters:
+      - model: (optional) only invalidate the environment of this model; it is resolved by its next job.
+    """
+    model = request.args.get("model")
+    try:
+        if model:
+            registry.invalidate(model)
+            return jsonify(registry.status()), 200
+        return jsonify(registry.refresh()), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
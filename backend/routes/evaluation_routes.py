@@ -1,6 +1,6 @@
-import os
-from flask import Blueprint, request, jsonify, send_from_directory
+from flask import Blueprint, request, jsonify
 from services.evaluation_service import get_evaluation_data
+from services.artifact_service import send_artifact
 
 evaluation_bp = Blueprint('evaluation_bp', __name__)
 
@@ -23,7 +23,4 @@ def evaluation():
 @evaluation_bp.route("/file/<model>/<exp>/<filename>", methods=["GET"])
 def get_evaluation_file(model, exp, filename):
     """Vrátí konkrétní soubor s výsledky hodnocení"""
-    base_path = os.path.join(os.getcwd(), model, "runs", "train", exp)
-    if not os.path.exists(os.path.join(base_path, filename)):
-        return jsonify({"error": f"File {filename} not found in experiment {exp}"}), 404
-    return send_from_directory(base_path, filename)
+    return send_artifact(model, "train", exp, filename, request.args)
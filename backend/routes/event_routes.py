@@ -0,0 +1,57 @@
+import json
+import os
+
+from flasgger import swag_from
+from flask import Blueprint, request, jsonify, Response
+
+from services.event_service import bus
+from services.metrics_service import track_stream
+from services.server_service import HEARTBEAT_SECONDS, RETRY_MILLISECONDS
+
+events_bp = Blueprint('events_bp', __name__)
+current_dir = os.path.dirname(os.path.abspath(__file__))
+yaml_path = os.path.join(current_dir, 'docs', 'event_api.yaml')
+
+# Longest time a long-poll request or one SSE wait may block
+MAX_WAIT = 30
+
+
+@events_bp.route("/poll/<path:topic>", methods=["GET"])
+@swag_from(yaml_path)
+def poll_events(topic):
+    """
+    Long-poll for events of a topic (e.g. detect/yolov5/exp3 or job/<job_id>).
+
+    Query Parameters:
+      - after: (optional) id of the last event the client has seen, defaults to 0.
+      - timeout: (optional) seconds to wait for a new event, defaults to 25.
+    """
+    after = request.args.get("after", 0, type=int)
+    timeout = min(request.args.get("timeout", 25, type=float), MAX_WAIT)
+    events = bus.wait(topic, after, timeout)
+    last = events[-1]["id"] if events else after
+    return jsonify({"events": events, "last": last, "completed": bus.is_completed(topic)}), 200
+
+@events_bp.route("/stream/<path:topic>", methods=["GET"])
+@swag_from(yaml_path)
+def stream_events(topic):
+    """
+    Streams events of a topic as Server-Sent Events. The stream ends after the
+    "completed" event; reconnecting clients continue from Last-Event-ID.
+    """
+    after = request.headers.get("Last-Event-ID", type=int) or request.args.get("after", 0, type=int)
+
+    def generate(last):
+        yield f"retry: {RETRY_MILLISECONDS}\n\n"
+        while True:
+            events = bus.wait(topic, last, HEARTBEAT_SECONDS)
+            if not events:
+                yield ": keep-alive\n\n"
+                continue
+            for event in events:
+                last = event["id"]
+                yield f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+                if event["type"] == "completed":
+                    return
+
+    return Response(track_stream("events", generate(after)), mimetype="text/event-stream")
@@ -0,0 +1,69 @@
+import os
+
+from flasgger import swag_from
+from flask import Blueprint, request, jsonify
+
+from services.export_service import get_export, get_quantization, start_export
+from services.quantization_service import start_quantization
+
+exports_bp = Blueprint('exports_bp', __name__)
+current_dir = os.path.dirname(os.path.abspath(__file__))
+yaml_path = os.path.join(current_dir, 'docs', 'export_api.yaml')
+
+
+@exports_bp.route("/", methods=["POST"])
+@swag_from(yaml_path)
+def export_run():
+    """Exports the best.pt of a training run to an optimized ONNX model (cached by the weights hash)."""
+    data = request.get_json(silent=True) or {}
+    model = data.get("model")
+    training_run = data.get("trainingRun")
+    if not (model and training_run):
+        return jsonify({"error": "Missing required parameters"}), 400
+    try:
+        result = start_export(model, training_run, data.get("imgSize"), bool(data.get("force", False)),
+                              data.get("priority", 0))
+        return jsonify(result), 200 if result["cached"] else 202
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+@exports_bp.route("/<model>/<training_run>", methods=["GET"])
+@swag_from(yaml_path)
+def export_detail(model, training_run):
+    """Returns the ONNX export of the run's current weights with its parity check."""
+    try:
+        export = get_export(model, training_run)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 404
+    if export is None:
+        return jsonify({"error": f"Training run {training_run} has no ONNX export"}), 404
+    return jsonify(export), 200
+
+@exports_bp.route("/quantize", methods=["POST"])
+@swag_from(yaml_path)
+def quantize_run():
+    """Quantizes the ONNX export of a training run to INT8, published only within the mAP tolerance."""
+    data = request.get_json(silent=True) or {}
+    model = data.get("model")
+    training_run = data.get("trainingRun")
+    if not (model and training_run):
+        return jsonify({"error": "Missing required parameters"}), 400
+    try:
+        result = start_quantization(model, training_run, data.get("method", "static"), data.get("tolerance"),
+                                    data.get("calibrationImages"), bool(data.get("force", False)),
+                                    data.get("priority", 0))
+        return jsonify(result), 200 if result["cached"] else 202
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+@exports_bp.route("/<model>/<training_run>/quantization", methods=["GET"])
+@swag_from(yaml_path)
+def quantization_detail(model, training_run):
+    """Returns the quantization report (accuracy delta, latency, speedup, published) of a training run."""
+    try:
+        report = get_quantization(model, training_run)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 404
+    if report is None:
+        return jsonify({"error": f"Training run {training_run} was not quantized"}), 404
+    return jsonify(report), 200
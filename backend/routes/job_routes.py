@@ -0,0 +1,54 @@
+import os
+
+from flasgger import swag_from
+from flask import Blueprint, request, jsonify
+
+from services.job_service import scheduler
+
+jobs_bp = Blueprint('jobs_bp', __name__)
+current_dir = os.path.dirname(os.path.abspath(__file__))
+yaml_path = os.path.join(current_dir, 'docs', 'job_api.yaml')
+
+
+@jobs_bp.route("/", methods=["GET"])
+@swag_from(yaml_path)
+def list_jobs():
+    """
+    Returns the most recent jobs.
+
+    Query Parameters:
+      - kind: (optional) training, detection or validation.
+      - state: (optional) queued, running, succeeded, failed or cancelled.
+      - limit: (optional) maximum number of jobs, defaults to 100.
+    """
+    kind = request.args.get("kind")
+    state = request.args.get("state")
+    limit = request.args.get("limit", 100, type=int)
+    try:
+        return jsonify(scheduler.list_jobs(kind, state, limit)), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@jobs_bp.route("/stats", methods=["GET"])
+@swag_from(yaml_path)
+def job_stats():
+    """Returns concurrency limits, running and queued job counts per job kind."""
+    return jsonify(scheduler.stats()), 200
+
+@jobs_bp.route("/<job_id>", methods=["GET"])
+@swag_from(yaml_path)
+def get_job(job_id):
+    """Returns the state of a single job."""
+    job = scheduler.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Job {job_id} not found"}), 404
+    return jsonify(job), 200
+
+@jobs_bp.route("/<job_id>/cancel", methods=["POST"])
+@swag_from(yaml_path)
+def cancel_job(job_id):
+    """Cancels a queued job or terminates a running one."""
+    try:
+        return jsonify(scheduler.cancel(job_id)), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
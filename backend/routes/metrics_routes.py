@@ -0,0 +1,17 @@
+import os
+
+from flasgger import swag_from
+from flask import Blueprint, Response
+
+from services.metrics_service import render_metrics
+
+metrics_bp = Blueprint('metrics_bp', __name__)
+current_dir = os.path.dirname(os.path.abspath(__file__))
+yaml_path = os.path.join(current_dir, 'docs', 'metrics_api.yaml')
+
+
+@metrics_bp.route("/metrics", methods=["GET"])
+@swag_from(yaml_path)
+def metrics():
+    """Returns request, job, subprocess, stream and filesystem scan metrics in the Prometheus text format."""
+    return Response(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
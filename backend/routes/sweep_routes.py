@@ -0,0 +1,50 @@
+import os
+
+from flasgger import swag_from
+from flask import Blueprint, request, jsonify
+
+from services.sweep_service import cancel_sweep, create_sweep, get_sweep, list_sweeps
+
+sweeps_bp = Blueprint('sweeps_bp', __name__)
+current_dir = os.path.dirname(os.path.abspath(__file__))
+yaml_path = os.path.join(current_dir, 'docs', 'sweep_api.yaml')
+
+
+@sweeps_bp.route("/", methods=["POST"])
+@swag_from(yaml_path)
+def start_sweep():
+    """Expands a grid or random search space into training trials and queues them."""
+    data = request.get_json(silent=True) or {}
+    try:
+        return jsonify(create_sweep(data)), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@sweeps_bp.route("/", methods=["GET"])
+@swag_from(yaml_path)
+def sweeps_list():
+    """Returns the most recent sweeps."""
+    try:
+        return jsonify(list_sweeps(request.args.get("limit", 50, type=int))), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@sweeps_bp.route("/<sweep_id>", methods=["GET"])
+@swag_from(yaml_path)
+def sweep_detail(sweep_id):
+    """Returns a sweep, its trials and the leaderboard."""
+    sweep = get_sweep(sweep_id)
+    if sweep is None:
+        return jsonify({"error": f"Sweep {sweep_id} not found"}), 404
+    return jsonify(sweep), 200
+
+@sweeps_bp.route("/<sweep_id>/cancel", methods=["POST"])
+@swag_from(yaml_path)
+def sweep_cancel(sweep_id):
+    """Cancels the queued and running trials of a sweep."""
+    try:
+        return jsonify(cancel_sweep(sweep_id)), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
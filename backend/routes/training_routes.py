@@ -1,9 +1,16 @@
 import os
 
 from flasgger import swag_from
-from flask import Blueprint, request, jsonify, Response, send_from_directory
-from services.training_service import run_training_logic, stop_training_logic, get_training_runs_logic, log_queue, \
-    get_training_run_data, get_evaluation_data
+from flask import Blueprint, request, jsonify, Response
+from services.training_service import run_training_logic, stop_training_logic, get_training_runs_logic, \
+    get_training_run_data, get_evaluation_data, pause_training_logic, resume_training_logic
+from services.catalog_service import list_query_from_args
+from services.dataset_service import preflight_dataset
+from services.artifact_service import send_artifact
+from services.job_service import scheduler
+from services.log_service import follow_log
+from services.metrics_service import track_stream
+from services.training_metrics_service import get_training_metrics
 
 training_bp = Blueprint('training_bp', __name__)
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -21,23 +28,65 @@ def start_training():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@training_bp.route("/preflight", methods=["POST"])
+@swag_from(yaml_path)
+def dataset_preflight():
+    """Checks the training and validation dataset (images, labels, class ids) without starting a run."""
+    data = request.get_json(silent=True) or {}
+    if not data.get("dataDir"):
+        return jsonify({"error": "dataDir is required"}), 400
+    try:
+        report = preflight_dataset(data["dataDir"], data.get("valDir"), data.get("classList"))
+        return jsonify(report), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @training_bp.route("/stop", methods=["POST"])
 @swag_from(yaml_path)
 def stop_training():
     """Stops the currently running training process."""
+    data = request.get_json(silent=True) or {}
+    job_id = data.get("job_id") or request.args.get("job_id")
     try:
-        result = stop_training_logic()
+        result = stop_training_logic(job_id)
         return jsonify(result), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@training_bp.route("/pause", methods=["POST"])
+@swag_from(yaml_path)
+def pause_training():
+    """Pauses a training job at the end of its current epoch, keeping last.pt for resuming."""
+    data = request.get_json(silent=True) or {}
+    job_id = data.get("job_id") or request.args.get("job_id")
+    immediate = str(data.get("immediate", request.args.get("immediate", "false"))).lower() in ("1", "true", "yes")
+    try:
+        result = pause_training_logic(job_id, immediate)
+        return jsonify(result), 202
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+@training_bp.route("/resume", methods=["POST"])
+@swag_from(yaml_path)
+def resume_training():
+    """Continues a paused training job from its last checkpoint."""
+    data = request.get_json(silent=True) or {}
+    job_id = data.get("job_id") or request.args.get("job_id")
+    if not job_id:
+        return jsonify({"error": "job_id is required"}), 400
+    try:
+        result = resume_training_logic(job_id, data.get("priority"))
+        return jsonify(result), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
 @training_bp.route("/list", methods=["GET"])
 @swag_from(yaml_path)
 def list_training_runs():
     """Returns a list of training runs for a specified model."""
     model = request.args.get("model", "yolov5")
     try:
-        runs = get_training_runs_logic(model)
+        runs = get_training_runs_logic(model, **list_query_from_args(request.args))
         return jsonify(runs), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -45,11 +94,28 @@ def list_training_runs():
 @training_bp.route("/logs", methods=["GET"])
 @swag_from(yaml_path)
 def stream_logs():
-    def generate():
-        while True:
-            line = log_queue.get()  # Blokující vyčítání nové zprávy
-            yield f"data: {line}\n\n"
-    return Response(generate(), mimetype="text/event-stream")
+    """
+    Streams training log lines as Server-Sent Events. Any number of clients can
+    follow the same job; reconnecting clients resume after Last-Event-ID.
+    Without job_id the newest training job is followed.
+    """
+    job_id = request.args.get("job_id")
+    if job_id and scheduler.get(job_id) is None:
+        return jsonify({"error": f"Job {job_id} not found"}), 404
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("lastEventId")
+    return Response(track_stream("training_logs", follow_log("training", job_id, last_event_id)),
+                    mimetype="text/event-stream")
+
+@training_bp.route("/metrics", methods=["GET"])
+@swag_from(yaml_path)
+def training_metrics():
+    """Returns parsed per-epoch metrics (losses, P/R/mAP, throughput) of a training job."""
+    job_id = request.args.get("job_id")
+    max_points = request.args.get("max_points", type=int)
+    try:
+        return jsonify(get_training_metrics(job_id, max_points)), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 404
 
 @training_bp.route("/getData", methods=["GET"])
 @swag_from(yaml_path)
@@ -88,7 +154,4 @@ def get_evaluation():
 @swag_from(yaml_path)
 def get_evaluation_file(model, exp, filename):
     """Returns a specific file from the evaluation results."""
-    base_path = os.path.join(os.getcwd(), model, "runs", "train", exp)
-    if not os.path.exists(os.path.join(base_path, filename)):
-        return jsonify({"error": f"File {filename} not found in experiment {exp}"}), 404
-    return send_from_directory(base_path, filename)
\ No newline at end of file
+    return send_artifact(model, "train", exp, filename, request.args)
\ No newline at end of file
@@ -1,10 +1,13 @@
 import os
 
 from flasgger import swag_from
-from flask import Blueprint, request, jsonify, send_from_directory
+from flask import Blueprint, request, jsonify
 
 from services.validation_service import start_validation, list_validation_runs, get_latest_validation_images, \
     get_validation_details, get_validation_runs
+from services.catalog_service import list_query_from_args
+from services.evaluation_service import evaluate_run
+from services.artifact_service import send_artifact
 
 validation_bp = Blueprint('validation_bp', __name__)
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -24,9 +27,10 @@ def start_validation_route():
       - iou: IOU threshold (e.g., 0.5).
       - trainingRun: Identifier for the training run.
       - model: Model name.
+      - backend: "pytorch" (default), "onnx" or "int8".
 
     Returns:
-      JSON with the experiment ID.
+      JSON with the experiment ID and the job ID.
     """
     data = request.json
     source = data.get("source")
@@ -40,8 +44,10 @@ def start_validation_route():
         return jsonify({"error": "Missing required parameters"}), 400
 
     try:
-        experiment = start_validation(source, train_run, img_size, conf, iou, model)
-        return jsonify({"experiment": experiment}), 200
+        experiment, job_id = start_validation(source, train_run, img_size, conf, iou, model,
+                                              priority=data.get("priority", 0),
+                                              backend=data.get("backend", "pytorch"))
+        return jsonify({"experiment": experiment, "job_id": job_id}), 200
     except Exception as e:
         return jsonify({"error": f"Validation start failed: {str(e)}"}), 500
 
@@ -89,6 +95,31 @@ def validation_details():
 
 
 
+@validation_bp.route("/metrics", methods=["GET"])
+@swag_from(yaml_path)
+def validation_metrics():
+    """
+    Computes mAP, PR/F1 curves and the confusion matrix of a run from its stored predictions.
+
+    Query Parameters:
+      - model: Model name (required).
+      - experiment: Experiment identifier (required).
+      - kind: (optional) val (default) or detect.
+      - source: (optional) dataset with the ground truth, defaults to the dataset of the run.
+      - refresh: (optional) true to ignore the cached result.
+    """
+    model = request.args.get("model")
+    experiment = request.args.get("experiment")
+    if not (model and experiment):
+        return jsonify({"error": "Parameters model and experiment are required"}), 400
+    try:
+        result = evaluate_run(model, experiment, request.args.get("kind", "val"), request.args.get("source"),
+                              refresh=request.args.get("refresh", "").lower() == "true")
+        return jsonify(result), 200
+    except Exception as e:
+        return jsonify({"error": f"Error evaluating run: {str(e)}"}), 500
+
+
 @validation_bp.route("/list", methods=["GET"])
 @swag_from(yaml_path)
 def validation_runs_list():
@@ -100,7 +131,7 @@ def validation_runs_list():
         """
     model = request.args.get("model", "yolov5")
     try:
-        runs = get_validation_runs(model)
+        runs = get_validation_runs(model, **list_query_from_args(request.args))
         return jsonify(runs)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -108,8 +139,5 @@ def validation_runs_list():
 @validation_bp.route("/file/<model>/<exp>/<filename>", methods=["GET"])
 @swag_from(yaml_path)
 def get_validation_file(model, exp, filename):
-    """todo neudělat jedno api, kde bude parametr se složkou train/val/eval"""
-    base_path = os.path.join(os.getcwd(), model, "runs", "val", exp)
-    if not os.path.exists(os.path.join(base_path, filename)):
-        return jsonify({"error": f"File {filename} not found in experiment {exp}"}), 404
-    return send_from_directory(base_path, filename)
\ No newline at end of file
+    """Returns a specific file of a validation run (all run kinds: /api/artifacts)."""
+    return send_artifact(model, "val", exp, filename, request.args)
\ No newline at end of file
@@ -0,0 +1,71 @@
+"""
+Production entry point of the backend (app.py runs the Flask development server).
+
+    python serve.py [--server auto|gevent|waitress|werkzeug] [--host 127.0.0.1] [--port 5000]
+
+gevent (used by "auto" when installed) serves every request in a greenlet and patches
+threading, so SSE log/event streams and long-polls wait on cooperative condition
+variables: hundreds of idle watchers cost a few KB each instead of an OS thread.
+waitress and werkzeug serve requests in a bounded pool of OS threads, where every
+open stream occupies one thread.
+"""
+import argparse
+import importlib.util
+import os
+import signal
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Runs the backend with a production WSGI server.")
+    parser.add_argument("--server", default=os.environ.get("SERVER", "auto"),
+                        choices=("auto", "gevent", "waitress", "werkzeug"))
+    parser.add_argument("--host", default=os.environ.get("HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 5000)))
+    parser.add_argument("--max-connections", type=int, default=int(os.environ.get("MAX_CONNECTIONS", 1000)),
+                        help="gevent: concurrent connections (idle streams included).")
+    parser.add_argument("--threads", type=int, default=int(os.environ.get("SERVER_THREADS", 32)),
+                        help="waitress: worker threads, every open stream holds one.")
+    return parser.parse_args(argv)
+
+
+def resolve_server(name):
+    if name != "auto":
+        return name
+    for candidate in ("gevent", "waitress"):
+        if importlib.util.find_spec(candidate) is not None:
+            return candidate
+    return "werkzeug"
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    server = resolve_server(args.server)
+    if server == "gevent":
+        # Must happen before the app (and with it threading, subprocess, socket) is imported
+        from gevent import monkey
+        monkey.patch_all()
+
+    from app import create_app
+
+    app = create_app()
+    print(f"Serving on http://{args.host}:{args.port} with {server}")
+
+    if server == "gevent":
+        import gevent
+        from gevent.pool import Pool
+        from gevent.pywsgi import WSGIServer
+
+        http_server = WSGIServer((args.host, args.port), app, spawn=Pool(args.max_connections))
+        # Stop accepting connections, give running requests a moment, then close the streams
+        gevent.signal_handler(signal.SIGTERM, http_server.stop, 5)
+        http_server.serve_forever()
+    elif server == "waitress":
+        from waitress import serve
+
+        serve(app, host=args.host, port=args.port, threads=args.threads)
+    else:
+        app.run(host=args.host, port=args.port, threaded=True, debug=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+import fnmatch
+import hashlib
+import json
+import os
+import tarfile
+import threading
+import time
+import zipfile
+import zlib
+
+from flask import jsonify
+from werkzeug.security import safe_join
+
+from services.catalog_service import RUN_KINDS
+from services.db import DATA_DIR
+from services.image_cache_service import send_result_file
+from services.metrics_service import FILESYSTEM_SCAN
+from services.server_service import run_blocking
+
+MANIFEST_DIR = os.path.join(DATA_DIR, "artifacts")
+ARCHIVE_FORMATS = {
+    "zip": ("application/zip", "zip"),
+    "tar": ("application/x-tar", "tar"),
+    "tar.gz": ("application/gzip", "tar.gz"),
+}
+CHUNK_SIZE = 1024 * 1024
+# Already compressed formats are stored as they are, everything else is deflated
+STORED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.gif', '.mp4', '.avi', '.mov', '.mkv', '.pt', '.pth',
+                     '.onnx', '.zip', '.gz', '.npy')
+# Added to an archive that lacks files or has truncated ones, lists what went wrong
+ARCHIVE_ERRORS_FILE = "ARCHIVE_ERRORS.txt"
+
+_manifest_locks = {}
+_manifest_locks_guard = threading.Lock()
+
+
+def artifact_dir(model, kind, experiment):
+    """
+    Returns the folder of a run.
+
+    Raises:
+        Exception: If the kind is unknown, the path leaves the runs folder or the run does not exist.
+    """
+    if kind not in RUN_KINDS:
+        raise Exception(f"Unknown run kind '{kind}', expected one of {', '.join(RUN_KINDS)}")
+    path = safe_join(os.getcwd(), model, "runs", kind, experiment)
+    if path is None or not os.path.isdir(path):
+        raise FileNotFoundError(f"Run {model}/{kind}/{experiment} not found")
+    return path
+
+
+def send_artifact(model, kind, experiment, filename, args, not_found_message=None):
+    """Sends one file of a run (see image_cache_service.send_result_file for caching and derivatives)."""
+    not_found_message = not_found_message or f"File {filename} not found in experiment {experiment}"
+    run_dir = safe_join(os.getcwd(), model, "runs", kind, experiment) if kind in RUN_KINDS else None
+    if run_dir is None:
+        return jsonify({"error": not_found_message}), 404
+    return send_result_file(run_dir, filename, args, not_found_message)
+
+
+def _walk(run_dir):
+    """
+    Yields (relative posix path, absolute path, stat) of all files below run_dir, sorted by path.
+    Symlinks are skipped, so an export never reads files from outside the run folder.
+    """
+    files = []
+    stack = [run_dir]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    relative = os.path.relpath(entry.path, run_dir).replace(os.sep, "/")
+                    files.append((relative, entry.path, entry.stat(follow_symlinks=False)))
+    return sorted(files)
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _scan(run_dir, previous):
+    """Lists the files of a run, hashing only files whose mtime or size differ from the previous manifest."""
+    files = []
+    hashed = 0
+    for relative, path, stat in _walk(run_dir):
+        key = [stat.st_mtime_ns, stat.st_size]
+        cached = previous.get(relative)
+        if cached is not None and cached["key"] == key:
+            files.append(cached)
+            continue
+        try:
+            digest = _sha256(path)
+        except OSError:
+            continue
+        hashed += 1
+        files.append({"path": relative, "size": stat.st_size, "mtime": stat.st_mtime, "sha256": digest, "key": key})
+    return files, hashed
+
+
+def _manifest_path(run_dir):
+    key = hashlib.sha1(os.path.abspath(run_dir).encode("utf-8")).hexdigest()
+    return os.path.join(MANIFEST_DIR, f"{key}.json")
+
+
+def _manifest_lock(path):
+    with _manifest_locks_guard:
+        return _manifest_locks.setdefault(path, threading.Lock())
+
+
+def get_manifest(model, kind, experiment):
+    """
+    Returns the manifest of a run: every file with its size, mtime and SHA-256.
+
+    The manifest is kept in data/artifacts/<hash of the run folder>.json; files whose
+    mtime and size did not change are not hashed again, so for a finished run only
+    the folder listing is repeated.
+
+    Returns:
+        dict: model, kind, experiment, files, file count, total_bytes, hashed (files
+              hashed by this call) and etag (changes whenever any file changes).
+    """
+    run_dir = artifact_dir(model, kind, experiment)
+    manifest_path = _manifest_path(run_dir)
+    with _manifest_lock(manifest_path):
+        previous = {}
+        if os.path.exists(manifest_path):
+            try:
+                with open(manifest_path, "r", encoding="utf-8") as f:
+                    previous = {item["path"]: item for item in json.load(f)["files"]}
+            except (OSError, ValueError, KeyError):
+                previous = {}
+
+        started = time.perf_counter()
+        with FILESYSTEM_SCAN.time(scan="artifacts"):
+            files, hashed = run_blocking(_scan, run_dir, previous)
+        if hashed or len(files) != len(previous):
+            os.makedirs(MANIFEST_DIR, exist_ok=True)
+            tmp_path = f"{manifest_path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"run_dir": run_dir, "files": files}, f, separators=(",", ":"))
+            os.replace(tmp_path, manifest_path)
+
+    etag = hashlib.sha1("".join(f"{item['path']}:{item['sha256']};" for item in files).encode("utf-8")).hexdigest()
+    return {
+        "model": model,
+        "kind": kind,
+        "experiment": experiment,
+        "files": [{k: v for k, v in item.items() if k != "key"} for item in files],
+        "count": len(files),
+        "total_bytes": sum(item["size"] for item in files),
+        "hashed": hashed,
+        "seconds": round(time.perf_counter() - started, 3),
+        "etag": etag,
+    }
+
+
+def _split_patterns(value):
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(",")
+    return [pattern.strip() for pattern in value if pattern.strip()]
+
+
+def select_files(run_dir, include=None, exclude=None):
+    """
+    Files of a run matching the include patterns (all files without patterns) and none of
+    the exclude patterns. Patterns are shell globs matched against the relative path and
+    the file name, e.g. "*.png", "weights/best.pt", "labels/*".
+    """
+    include, exclude = _split_patterns(include), _split_patterns(exclude)
+
+    def matches(relative, patterns):
+        name = relative.rsplit("/", 1)[-1]
+        return any(fnmatch.fnmatch(relative, p) or fnmatch.fnmatch(name, p) for p in patterns)
+
+    return [(relative, path, stat) for relative, path, stat in _walk(run_dir)
+            if (not include or matches(relative, include)) and not matches(relative, exclude)]
+
+
+class _StreamBuffer:
+    """Write-only file object collecting what zipfile writes, drained by the generator after every chunk."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _read_chunks(f, size=None):
+    """Yields the content of an open file; with size exactly that many bytes (zero padded if the file shrank)."""
+    remaining = size
+    while remaining is None or remaining > 0:
+        chunk = f.read(CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        if remaining is not None:
+            remaining -= len(chunk)
+        yield chunk
+    if remaining:
+        yield b"\0" * remaining
+
+
+def _errors_text(problems):
+    return ("\n".join(problems) + "\n").encode("utf-8")
+
+
+def stream_zip(files, prefix):
+    """
+    Yields a ZIP archive of files (relative path, path, stat) built on the fly (no seeking, no temporary file).
+
+    Files that can not be opened are left out. A file that fails while it is read can not be
+    taken back, its entry ends with the bytes read so far. Both are listed in ARCHIVE_ERRORS_FILE.
+    """
+    buffer = _StreamBuffer()
+    problems = []
+    with zipfile.ZipFile(buffer, "w", allowZip64=True) as archive:
+        for relative, path, stat in files:
+            try:
+                source = open(path, "rb")
+            except OSError as e:
+                print(f"Skipping {path} in archive: {e}")
+                problems.append(f"{relative}: left out, {e}")
+                continue
+            info = zipfile.ZipInfo(f"{prefix}/{relative}", time.localtime(max(stat.st_mtime, 315532800))[:6])
+            info.compress_type = zipfile.ZIP_STORED if relative.lower().endswith(STORED_EXTENSIONS) \
+                else zipfile.ZIP_DEFLATED
+            info.external_attr = 0o644 << 16
+            with source:
+                read = 0
+                try:
+                    with archive.open(info, "w", force_zip64=stat.st_size > 2 ** 31) as entry:
+                        for chunk in _read_chunks(source):
+                            entry.write(chunk)
+                            read += len(chunk)
+                            yield buffer.drain()
+                except OSError as e:
+                    print(f"File {path} became unreadable while archiving, its entry is truncated: {e}")
+                    problems.append(f"{relative}: truncated after {read} of {stat.st_size} bytes, {e}")
+            yield buffer.drain()
+        if problems:
+            archive.writestr(f"{prefix}/{ARCHIVE_ERRORS_FILE}", _errors_text(problems))
+    yield buffer.drain()
+
+
+def stream_tar(files, prefix):
+    """
+    Yields an uncompressed tar archive of files built on the fly.
+
+    Files that can not be opened are left out; a file that fails while it is read is zero
+    padded to the size in its header. Both are listed in ARCHIVE_ERRORS_FILE.
+    """
+    written = 0
+    problems = []
+
+    def header(name, size, mtime):
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = int(mtime)
+        info.mode = 0o644
+        return info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+
+    for relative, path, stat in files:
+        try:
+            source = open(path, "rb")
+        except OSError as e:
+            print(f"Skipping {path} in archive: {e}")
+            problems.append(f"{relative}: left out, {e}")
+            continue
+        with source:
+            data = header(f"{prefix}/{relative}", stat.st_size, stat.st_mtime)
+            yield data
+            written += len(data)
+            sent = 0
+            try:
+                for chunk in _read_chunks(source, stat.st_size):
+                    yield chunk
+                    sent += len(chunk)
+            except OSError as e:
+                # The header promised stat.st_size bytes, keep the archive readable
+                print(f"File {path} became unreadable while archiving: {e}")
+                problems.append(f"{relative}: zero padded after {sent} of {stat.st_size} bytes, {e}")
+                yield b"\0" * (stat.st_size - sent)
+        written += stat.st_size
+        padding = -stat.st_size % tarfile.BLOCKSIZE
+        if padding:
+            yield b"\0" * padding
+            written += padding
+    if problems:
+        data = _errors_text(problems)
+        for part in (header(f"{prefix}/{ARCHIVE_ERRORS_FILE}", len(data), time.time()), data,
+                     b"\0" * (-len(data) % tarfile.BLOCKSIZE)):
+            yield part
+            written += len(part)
+    end = tarfile.BLOCKSIZE * 2
+    end += -(written + end) % tarfile.RECORDSIZE
+    yield b"\0" * end
+
+
+def _gzip(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_archive(model, kind, experiment, archive_format="zip", include=None, exclude=None):
+    """
+    Streams a run (or the files matching include/exclude) as a ZIP, tar or tar.gz archive.
+
+    Returns:
+        tuple: (chunk generator, mimetype, download file name, number of files, total bytes of the files)
+
+    Raises:
+        Exception: If the format is unknown or the run does not exist.
+    """
+    if archive_format not in ARCHIVE_FORMATS:
+        raise ValueError(f"Unknown archive format '{archive_format}', expected one of {', '.join(ARCHIVE_FORMATS)}")
+    run_dir = artifact_dir(model, kind, experiment)
+    files = select_files(run_dir, include, exclude)
+    prefix = f"{model}_{kind}_{experiment}"
+    if archive_format == "zip":
+        chunks = stream_zip(files, prefix)
+    elif archive_format == "tar":
+        chunks = stream_tar(files, prefix)
+    else:
+        chunks = _gzip(stream_tar(files, prefix))
+    mimetype, extension = ARCHIVE_FORMATS[archive_format]
+    return (chunk for chunk in chunks if chunk), mimetype, f"{prefix}.{extension}", len(files), \
+        sum(stat.st_size for _, _, stat in files)
@@ -0,0 +1,283 @@
+import datetime
+import json
+import os
+import re
+import threading
+import time
+
+from services.db import connect, ensure_schema
+from services.metrics_service import FILESYSTEM_SCAN
+
+RUN_KINDS = ("train", "detect", "val")
+
+# Runs younger than this are re-checked for late artifacts (best.pt, results.json)
+PENDING_WINDOW = 24 * 3600
+# Minimum interval between two re-checks of pending runs of one model/kind
+PENDING_RECHECK_INTERVAL = 5
+
+SORT_COLUMNS = {
+    "timestamp": "created_at",
+    "modified": "modified_at",
+    "name": "number",
+}
+
+CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    model TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    number INTEGER NOT NULL DEFAULT 0,
+    path TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    modified_at REAL NOT NULL,
+    has_weights INTEGER NOT NULL DEFAULT 0,
+    metrics TEXT,
+    PRIMARY KEY (model, kind, name)
+);
+CREATE INDEX IF NOT EXISTS runs_created ON runs (model, kind, created_at);
+CREATE INDEX IF NOT EXISTS runs_number ON runs (model, kind, number);
+CREATE TABLE IF NOT EXISTS run_dirs (
+    model TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    mtime REAL NOT NULL,
+    PRIMARY KEY (model, kind)
+);
+"""
+
+_lock = threading.Lock()
+_dir_mtimes = {}
+_pending_checked = {}
+
+
+def run_base_dir(model, kind):
+    return os.path.join(os.getcwd(), model, "runs", kind)
+
+
+def _run_number(name):
+    match = re.search(r"(\d+)$", name)
+    return int(match.group(1)) if match else (1 if name == "exp" else 0)
+
+
+def _load_metrics(path):
+    results_file = os.path.join(path, "results.json")
+    if not os.path.exists(results_file):
+        return None
+    try:
+        with open(results_file, "r") as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+
+def _describe_run(model, kind, name):
+    """Stats a single run folder. Returns None if it is not a folder (anymore)."""
+    path = os.path.join(run_base_dir(model, kind), name)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    if not os.path.isdir(path):
+        return None
+    has_weights = kind == "train" and os.path.exists(os.path.join(path, "weights", "best.pt"))
+    metrics = _load_metrics(path) if kind == "val" else None
+    return (model, kind, name, _run_number(name), path, stat.st_ctime, stat.st_mtime,
+            int(has_weights), json.dumps(metrics) if metrics is not None else None)
+
+
+def _upsert(conn, rows):
+    conn.executemany(
+        "INSERT OR REPLACE INTO runs (model, kind, name, number, path, created_at, modified_at, has_weights, metrics) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+    )
+
+
+def reconcile(model, kind, force=False):
+    """
+    Brings the catalog of runs/<kind> of a model in sync with the filesystem.
+
+    The folder listing is only read when the mtime of runs/<kind> changed (a run was
+    added or removed), and only new runs are stat'ed. Recent runs that still miss
+    their artifacts (best.pt, results.json) are re-checked at most every few seconds.
+
+    Args:
+        model (str): Model name (e.g., "yolov5").
+        kind (str): "train", "detect" or "val".
+        force (bool, optional): Re-read the folder, re-stat every run and re-check all pending runs
+                                regardless of mtimes and age.
+    """
+    ensure_schema("catalog", CATALOG_SCHEMA)
+    base_dir = run_base_dir(model, kind)
+    key = (model, kind)
+    with _lock:
+        try:
+            mtime = os.stat(base_dir).st_mtime
+        except FileNotFoundError:
+            mtime = None
+
+        with connect() as conn:
+            if key not in _dir_mtimes:
+                row = conn.execute("SELECT mtime FROM run_dirs WHERE model = ? AND kind = ?", key).fetchone()
+                _dir_mtimes[key] = row["mtime"] if row else None
+
+            if mtime is None:
+                conn.execute("DELETE FROM runs WHERE model = ? AND kind = ?", key)
+                conn.execute("DELETE FROM run_dirs WHERE model = ? AND kind = ?", key)
+                _dir_mtimes[key] = None
+                return
+
+            if force or mtime != _dir_mtimes[key]:
+                with FILESYSTEM_SCAN.time(scan="catalog"):
+                    on_disk = set(os.listdir(base_dir))
+                known = {row["name"] for row in
+                         conn.execute("SELECT name FROM runs WHERE model = ? AND kind = ?", key)}
+                removed = known - on_disk
+                if removed:
+                    conn.executemany("DELETE FROM runs WHERE model = ? AND kind = ? AND name = ?",
+                                     [(model, kind, name) for name in removed])
+                # Forced: runs already known are stat'ed again as well, so their modified_at is current
+                rows = [_describe_run(model, kind, name) for name in (on_disk if force else on_disk - known)]
+                _upsert(conn, [row for row in rows if row is not None])
+                conn.execute("INSERT OR REPLACE INTO run_dirs (model, kind, mtime) VALUES (?, ?, ?)",
+                             (model, kind, mtime))
+                _dir_mtimes[key] = mtime
+
+            now = time.time()
+            if kind in ("train", "val") and (force or now - _pending_checked.get(key, 0) >= PENDING_RECHECK_INTERVAL):
+                _pending_checked[key] = now
+                pending_column = "has_weights = 0" if kind == "train" else "metrics IS NULL"
+                # Forced, runs older than the window are re-checked too (e.g. a training that took days)
+                pending = [row["name"] for row in conn.execute(
+                    f"SELECT name FROM runs WHERE model = ? AND kind = ? AND {pending_column} AND created_at > ?",
+                    (model, kind, 0 if force else now - PENDING_WINDOW))]
+                rows = [_describe_run(model, kind, name) for name in pending]
+                _upsert(conn, [row for row in rows if row is not None])
+
+
+def refresh_run(model, kind, name):
+    """Re-indexes a single run folder, e.g. after the job that writes it has finished."""
+    ensure_schema("catalog", CATALOG_SCHEMA)
+    row = _describe_run(model, kind, name)
+    with _lock, connect() as conn:
+        if row is None:
+            conn.execute("DELETE FROM runs WHERE model = ? AND kind = ? AND name = ?", (model, kind, name))
+        else:
+            _upsert(conn, [row])
+
+
+def allocate_run(model, kind, prefix="exp"):
+    """
+    Reserves the next free run folder (e.g. runs/detect/exp7) and returns its name.
+
+    The folder is created with os.mkdir, which fails if it exists, so two requests (or
+    two server processes) never get the same name: the one that loses the race moves
+    on to the next number. The caller passes the name to the script with --project,
+    --name and --exist-ok, so the script writes into exactly this folder.
+
+    Args:
+        model (str): Model name (e.g., "yolov5").
+        kind (str): "train", "detect" or "val".
+        prefix (str, optional): Name prefix of the run folders.
+
+    Returns:
+        str: Name of the created run folder.
+    """
+    base_dir = run_base_dir(model, kind)
+    os.makedirs(base_dir, exist_ok=True)
+    with FILESYSTEM_SCAN.time(scan="allocate"):
+        numbers = [_run_number(name) for name in os.listdir(base_dir) if name.startswith(prefix)]
+    number = max(numbers, default=0) + 1
+    while True:
+        name = f"{prefix}{number}"
+        try:
+            os.mkdir(os.path.join(base_dir, name))
+        except FileExistsError:
+            number += 1
+            continue
+        refresh_run(model, kind, name)
+        return name
+
+
+def list_query_from_args(args):
+    """
+    Extracts list options (page, page_size, sort, order, q) from request arguments.
+
+    Returns:
+        dict: Keyword arguments for list_runs.
+    """
+    page = args.get("page", type=int)
+    return {
+        "page": page,
+        "page_size": min(args.get("page_size", 50, type=int), 1000),
+        "sort": args.get("sort", "timestamp"),
+        "order": args.get("order", "desc"),
+        "q": args.get("q"),
+    }
+
+
+def list_runs(model, kind, page=None, page_size=50, sort="timestamp", order="desc", q=None,
+              require_weights=False, timestamp_format=None):
+    """
+    Returns runs of a model from the catalog.
+
+    Args:
+        model (str): Model name.
+        kind (str): "train", "detect" or "val".
+        page (int, optional): 1-based page number. Without it all runs are returned as a plain list.
+        page_size (int, optional): Number of runs per page. Defaults to 50.
+        sort (str, optional): "timestamp", "modified" or "name". Defaults to "timestamp".
+        order (str, optional): "asc" or "desc". Defaults to "desc".
+        q (str, optional): Substring the run name has to contain.
+        require_weights (bool, optional): Only runs with weights/best.pt (training runs).
+        timestamp_format (str, optional): strftime format of the timestamp, ISO 8601 by default.
+
+    Returns:
+        list | dict: List of runs, or a dict with items, total, page and page_size when paginated.
+    """
+    if kind not in RUN_KINDS:
+        raise Exception(f"Unknown run kind: {kind}")
+    if sort not in SORT_COLUMNS:
+        raise Exception(f"Unknown sort key: {sort}")
+    direction = "ASC" if str(order).lower() == "asc" else "DESC"
+
+    reconcile(model, kind)
+
+    conditions = ["model = ?", "kind = ?"]
+    args = [model, kind]
+    if require_weights:
+        conditions.append("has_weights = 1")
+    if q:
+        conditions.append("name LIKE ?")
+        args.append(f"%{q}%")
+    where = " AND ".join(conditions)
+    column = SORT_COLUMNS[sort]
+    query = f"SELECT * FROM runs WHERE {where} ORDER BY {column} {direction}, name {direction}"
+
+    with connect() as conn:
+        if page is None:
+            rows = conn.execute(query, args).fetchall()
+            total = len(rows)
+        else:
+            page = max(1, page)
+            total = conn.execute(f"SELECT COUNT(*) FROM runs WHERE {where}", args).fetchone()[0]
+            rows = conn.execute(query + " LIMIT ? OFFSET ?", args + [page_size, (page - 1) * page_size]).fetchall()
+
+    items = [_format_run(row, timestamp_format) for row in rows]
+    if page is None:
+        return items
+    return {"items": items, "total": total, "page": page, "page_size": page_size}
+
+
+def _format_run(row, timestamp_format):
+    if timestamp_format:
+        timestamp = datetime.datetime.fromtimestamp(row["modified_at"]).strftime(timestamp_format)
+    else:
+        timestamp = datetime.datetime.fromtimestamp(row["created_at"]).isoformat() + "Z"
+    run = {
+        "id": row["name"],
+        "name": row["name"],
+        "timestamp": timestamp,
+        "path": row["path"],
+    }
+    if row["kind"] == "val":
+        run["metrics"] = json.loads(row["metrics"]) if row["metrics"] else {}
+    return run
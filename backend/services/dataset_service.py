@@ -0,0 +1,345 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from services.db import DATA_DIR
+from services.metrics_service import FILESYSTEM_SCAN
+from services.server_service import blocking_map, is_cooperative
+
+MANIFEST_DIR = os.path.join(DATA_DIR, "datasets")
+IMAGE_EXTENSIONS = ('.bmp', '.jpg', '.jpeg', '.png', '.tif', '.tiff', '.webp', '.dng', '.mpo')
+# Below this number of files to check the pool startup costs more than it saves
+POOL_THRESHOLD = 256
+CHUNK_SIZE = 64
+MAX_WORKERS = int(os.environ.get("DATASET_WORKERS", min(8, os.cpu_count() or 1)))
+# Problems listed per category in the report, the counts are always complete
+MAX_LISTED_PROBLEMS = 50
+# Bumped when the records of check_item change, older manifests are checked again
+MANIFEST_VERSION = 2
+# Problem kinds the trainers cope with by themselves, they are reported but do not fail the preflight
+WARNING_KINDS = ("missing_labels", "image_warnings", "label_warnings")
+
+_manifest_locks = {}
+_manifest_locks_guard = threading.Lock()
+
+
+def label_path_for(image_path):
+    """Label file of an image the way YOLOv5/YOLOv7 find it (last /images/ replaced by /labels/, .txt suffix)."""
+    images, labels = f"{os.sep}images{os.sep}", f"{os.sep}labels{os.sep}"
+    head, sep, tail = image_path.rpartition(images)
+    base = head + labels + tail if sep else image_path
+    return os.path.splitext(base)[0] + ".txt"
+
+
+def list_dataset_images(source):
+    """Returns the image paths of a dataset folder (searched recursively) or of a .txt file with image paths."""
+    if os.path.isfile(source) and source.lower().endswith(".txt"):
+        parent = os.path.dirname(os.path.abspath(source))
+        with open(source, "r", encoding="utf-8") as f:
+            lines = [line.strip() for line in f if line.strip()]
+        return sorted(os.path.normpath(line if os.path.isabs(line) else os.path.join(parent, line))
+                      for line in lines if line.lower().endswith(IMAGE_EXTENSIONS))
+    if not os.path.isdir(source):
+        raise Exception(f"Dataset path not found: {source}")
+
+    paths = []
+    stack = [os.path.abspath(source)]
+    with FILESYSTEM_SCAN.time(scan="dataset"):
+        while stack:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    if entry.is_dir():
+                        stack.append(entry.path)
+                    elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                        paths.append(entry.path)
+    return sorted(paths)
+
+
+def _check_image(path):
+    """Returns (width, height, warning or None) of an image, raising on corrupt files."""
+    try:
+        from PIL import Image
+    except ImportError:
+        with open(path, "rb") as f:
+            header = f.read(12)
+        if not (header[:3] == b"\xff\xd8\xff" or header[:8] == b"\x89PNG\r\n\x1a\n" or header[:2] == b"BM"
+                or header[8:12] == b"WEBP" or header[:4] in (b"II*\x00", b"MM\x00*")):
+            raise Exception("unknown image format")
+        return None, None, None
+
+    with Image.open(path) as image:
+        image.verify()
+        width, height = image.size
+        fmt = image.format
+    if width < 10 or height < 10:
+        raise Exception(f"image size {width}x{height} <10 pixels")
+    warning = None
+    if fmt == "JPEG":
+        with open(path, "rb") as f:
+            f.seek(-2, 2)
+            if f.read() != b"\xff\xd9":
+                # YOLOv5 restores the marker and trains on the image, so this only warns
+                warning = "truncated JPEG (missing end of image marker)"
+    return width, height, warning
+
+
+def _check_labels(path):
+    """Parses a YOLO label file, returns (instances per class id, list of problems, list of warnings)."""
+    counts = {}
+    problems = []
+    warnings = []
+    seen = set()
+    with open(path, "r", encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            values = line.split()
+            if not values:
+                continue
+            # 5 values for a box, more (odd count) for a polygon segment
+            if len(values) < 5 or len(values) % 2 == 0:
+                problems.append(f"line {number}: expected 5 values or a polygon, got {len(values)}")
+                continue
+            try:
+                class_id = int(values[0])
+                coords = [float(v) for v in values[1:]]
+            except ValueError:
+                problems.append(f"line {number}: non-numeric values")
+                continue
+            if class_id < 0:
+                problems.append(f"line {number}: negative class id {class_id}")
+                continue
+            if any(c < 0 or c > 1.001 for c in coords):
+                problems.append(f"line {number}: coordinates are not normalized to 0-1")
+                continue
+            if len(values) == 5 and (coords[2] <= 0 or coords[3] <= 0):
+                problems.append(f"line {number}: box with zero width or height")
+                continue
+            if line.strip() in seen:
+                # Dropped by the trainers' label cache, not counted twice here either
+                warnings.append(f"line {number}: duplicate label")
+                continue
+            seen.add(line.strip())
+            counts[class_id] = counts.get(class_id, 0) + 1
+    return counts, problems, warnings
+
+
+def check_item(item):
+    """
+    Checks one image and its label file. Runs in the worker processes.
+
+    Args:
+        item (tuple): (image path, label path or None if the label file does not exist).
+
+    Returns:
+        dict: Image size, image error and warning, per-class instance counts, label problems and warnings.
+    """
+    image_path, label_path = item
+    record = {"w": None, "h": None, "error": None, "warning": None, "classes": {}, "label_problems": [],
+              "label_warnings": []}
+    try:
+        record["w"], record["h"], record["warning"] = _check_image(image_path)
+    except Exception as e:
+        record["error"] = str(e) or type(e).__name__
+    if label_path is not None:
+        try:
+            counts, record["label_problems"], record["label_warnings"] = _check_labels(label_path)
+            # JSON object keys are strings, keep them that way in the manifest too
+            record["classes"] = {str(k): v for k, v in counts.items()}
+        except Exception as e:
+            record["label_problems"] = [f"unreadable label file: {e}"]
+    return record
+
+
+def _stat_key(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _manifest_path(source):
+    key = hashlib.sha1(os.path.abspath(source).encode("utf-8")).hexdigest()
+    return os.path.join(MANIFEST_DIR, f"{key}.json")
+
+
+def _manifest_lock(path):
+    with _manifest_locks_guard:
+        return _manifest_locks.setdefault(path, threading.Lock())
+
+
+def index_dataset(source):
+    """
+    Checks every image and label file of a dataset, reusing the results of files whose
+    path, mtime and size did not change since the last run.
+
+    The manifest is stored in data/datasets/<hash of the dataset path>.json.
+
+    Returns:
+        tuple: (dict image path -> record, number of files checked in this run)
+    """
+    manifest_path = _manifest_path(source)
+    with _manifest_lock(manifest_path):
+        manifest = {}
+        if os.path.exists(manifest_path):
+            try:
+                with open(manifest_path, "r", encoding="utf-8") as f:
+                    stored = json.load(f)
+                if stored.get("version") == MANIFEST_VERSION:
+                    manifest = stored.get("files", {})
+            except (OSError, ValueError):
+                manifest = {}
+
+        files = {}
+        pending = []
+        for image_path in list_dataset_images(source):
+            label_path = label_path_for(image_path)
+            key = [_stat_key(image_path), _stat_key(label_path)]
+            cached = manifest.get(image_path)
+            if cached is not None and cached["key"] == key:
+                files[image_path] = cached
+            else:
+                files[image_path] = {"key": key}
+                pending.append((image_path, label_path if key[1] is not None else None))
+
+        if is_cooperative():
+            # Process pools do not mix with the monkey-patched threading of the gevent server
+            records = blocking_map(check_item, pending)
+        elif len(pending) >= POOL_THRESHOLD and MAX_WORKERS > 1:
+            with ProcessPoolExecutor(max_workers=MAX_WORKERS) as pool:
+                records = list(pool.map(check_item, pending, chunksize=CHUNK_SIZE))
+        else:
+            records = [check_item(item) for item in pending]
+        for (image_path, _), record in zip(pending, records):
+            files[image_path]["record"] = record
+
+        if pending or len(files) != len(manifest):
+            os.makedirs(MANIFEST_DIR, exist_ok=True)
+            tmp_path = f"{manifest_path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": MANIFEST_VERSION, "source": os.path.abspath(source), "files": files}, f, separators=(",", ":"))
+            os.replace(tmp_path, manifest_path)
+        return files, len(pending)
+
+
+def _summarize(values):
+    if not values:
+        return None
+    return {"min": min(values), "max": max(values), "mean": round(sum(values) / len(values), 1)}
+
+
+def dataset_report(source, class_list=None):
+    """
+    Builds the preflight report of one dataset split.
+
+    Args:
+        source (str): Image folder or .txt file with image paths.
+        class_list (list, optional): Class names; label class ids must be lower than its length.
+
+    Returns:
+        dict: Counts of images, labels and problems, per-class instance and image histograms,
+              image size statistics and ok (False if training would fail or learn from broken data).
+    """
+    started = time.perf_counter()
+    files, checked = index_dataset(source)
+    num_classes = len(class_list) if class_list else None
+
+    instances = {}
+    images_per_class = {}
+    problems = {"corrupt_images": [], "missing_labels": [], "invalid_labels": [], "unknown_classes": [],
+                "image_warnings": [], "label_warnings": []}
+    counts = {key: 0 for key in problems}
+    widths, heights = [], []
+    empty_labels = 0
+
+    def add_problem(kind, entry):
+        counts[kind] += 1
+        if len(problems[kind]) < MAX_LISTED_PROBLEMS:
+            problems[kind].append(entry)
+
+    for image_path, entry in files.items():
+        record = entry["record"]
+        if record["error"]:
+            add_problem("corrupt_images", {"image": image_path, "error": record["error"]})
+            continue
+        if record["warning"]:
+            add_problem("image_warnings", {"image": image_path, "warning": record["warning"]})
+        if record["w"]:
+            widths.append(record["w"])
+            heights.append(record["h"])
+        if entry["key"][1] is None:
+            add_problem("missing_labels", {"image": image_path})
+            continue
+        if record["label_problems"]:
+            add_problem("invalid_labels", {"label": label_path_for(image_path), "problems": record["label_problems"][:5]})
+        if record["label_warnings"]:
+            add_problem("label_warnings", {"label": label_path_for(image_path), "warnings": record["label_warnings"][:5]})
+        if not record["classes"]:
+            empty_labels += 1
+        for class_id, count in record["classes"].items():
+            class_id = int(class_id)
+            if num_classes is not None and class_id >= num_classes:
+                add_problem("unknown_classes", {"label": label_path_for(image_path), "class_id": class_id})
+                continue
+            name = class_list[class_id] if class_list else str(class_id)
+            instances[name] = instances.get(name, 0) + count
+            images_per_class[name] = images_per_class.get(name, 0) + 1
+
+    if class_list:
+        for name in class_list:
+            instances.setdefault(name, 0)
+            images_per_class.setdefault(name, 0)
+
+    return {
+        "source": source,
+        "images": len(files),
+        "labels": len(files) - counts["missing_labels"] - counts["corrupt_images"],
+        "empty_labels": empty_labels,
+        "problem_counts": counts,
+        "problems": problems,
+        "class_instances": instances,
+        "class_images": images_per_class,
+        "image_width": _summarize(widths),
+        "image_height": _summarize(heights),
+        "checked_files": checked,
+        "cached_files": len(files) - checked,
+        "seconds": round(time.perf_counter() - started, 3),
+        # Missing labels are treated as background images by the trainers, so they only warn
+        "ok": bool(files) and not any(count for kind, count in counts.items() if kind not in WARNING_KINDS),
+    }
+
+
+def preflight_dataset(data_dir, val_dir=None, class_list=None):
+    """
+    Validates the training and validation split before a training run is queued.
+
+    Returns:
+        dict: Report per split ("train", "val") and ok if all splits passed, or ok False and
+              an error if no training split was given.
+    """
+    if not data_dir:
+        return {"ok": False, "error": "dataDir is required"}
+    report = {"train": dataset_report(data_dir, class_list)}
+    if val_dir and os.path.abspath(val_dir) != os.path.abspath(data_dir):
+        report["val"] = dataset_report(val_dir, class_list)
+    report["ok"] = all(split["ok"] for split in report.values())
+    return report
+
+
+def preflight_errors(report):
+    """Returns a one-line description of the problems that fail a preflight report."""
+    if report.get("error"):
+        return report["error"]
+    messages = []
+    for split in ("train", "val"):
+        data = report.get(split)
+        if not data or data["ok"]:
+            continue
+        if not data["images"]:
+            messages.append(f"{split}: no images found in {data['source']}")
+        for kind, count in data["problem_counts"].items():
+            if count and kind not in WARNING_KINDS:
+                messages.append(f"{split}: {count} {kind.replace('_', ' ')}")
+    return "; ".join(messages)
@@ -0,0 +1,49 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# All backend state (job table, run catalog, caches) lives under this folder
+DATA_DIR = os.environ.get("APP_DATA_DIR", os.path.join(os.getcwd(), "data"))
+DB_PATH = os.path.join(DATA_DIR, "app.db")
+
+_schema_lock = threading.Lock()
+_initialized_schemas = set()
+
+
+@contextmanager
+def connect():
+    """
+    Opens a connection to the backend SQLite database.
+
+    The connection commits on success, rolls back on error and is always closed,
+    so it can safely be used from any thread.
+
+    Yields:
+        sqlite3.Connection: Connection with rows accessible by column name.
+    """
+    os.makedirs(DATA_DIR, exist_ok=True)
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def ensure_schema(name, script):
+    """
+    Executes a schema script once per process.
+
+    Args:
+        name (str): Identifier of the schema (e.g., "jobs").
+        script (str): SQL script with CREATE TABLE/INDEX IF NOT EXISTS statements.
+    """
+    with _schema_lock:
+        if name in _initialized_schemas:
+            return
+        with connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(script)
+        _initialized_schemas.add(name)
@@ -0,0 +1,363 @@
+import glob
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+from services.db import DATA_DIR, connect, ensure_schema
+from services.inference_service import run_inference
+from services.metrics_service import FILESYSTEM_SCAN
+from services.server_service import run_blocking
+
+CACHE_DIR = os.path.join(DATA_DIR, "detection_cache")
+BLOB_DIR = os.path.join(CACHE_DIR, "blobs")
+# Size cap of the cached detections and annotated images, the least recently used entries
+# are evicted first; 0 turns the cache off
+MAX_CACHE_BYTES = int(os.environ.get("DETECTION_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+# The extensions the inference worker accepts
+IMAGE_EXTENSIONS = ('.bmp', '.jpg', '.jpeg', '.png', '.tif', '.tiff', '.webp')
+CHUNK_SIZE = 1024 * 1024
+# Remembered file hashes, the oldest are forgotten first (uploads leave hashes of deleted files)
+MAX_HASHED_FILES = 200000
+
+CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS detection_cache (
+    key TEXT PRIMARY KEY,
+    image_sha256 TEXT NOT NULL,
+    detections TEXT NOT NULL,
+    labels TEXT,
+    labels_conf REAL,
+    output TEXT,
+    bytes INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS detection_cache_used ON detection_cache (used_at);
+CREATE TABLE IF NOT EXISTS detection_blobs (
+    name TEXT PRIMARY KEY,
+    bytes INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS content_hashes (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    sha256 TEXT NOT NULL
+);
+"""
+
+_evict_lock = threading.Lock()
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _hash_files(paths):
+    """SHA-256 of the files, only files whose mtime or size changed since they were last hashed are read."""
+    stats = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        stats[path] = (stat.st_mtime_ns, stat.st_size)
+    with connect() as conn:
+        known = {}
+        for start in range(0, len(stats), 500):
+            chunk = list(stats)[start:start + 500]
+            known.update((row["path"], row) for row in conn.execute(
+                f"SELECT * FROM content_hashes WHERE path IN ({','.join('?' * len(chunk))})", chunk))
+    hashes, rows = {}, []
+    for path, (mtime_ns, size) in stats.items():
+        row = known.get(path)
+        if row is not None and row["mtime_ns"] == mtime_ns and row["size"] == size:
+            hashes[path] = row["sha256"]
+            continue
+        try:
+            hashes[path] = _sha256(path)
+        except OSError:
+            continue
+        rows.append((path, mtime_ns, size, hashes[path]))
+    if rows:
+        with connect() as conn:
+            conn.executemany("INSERT OR REPLACE INTO content_hashes (path, mtime_ns, size, sha256) "
+                             "VALUES (?, ?, ?, ?)", rows)
+    return hashes
+
+
+def content_hashes(paths):
+    """
+    Returns the SHA-256 of every readable file of paths, keyed by path.
+
+    Hashes are kept with the mtime and size of the file, so unchanged files (a folder
+    that is detected again) are only stat'ed.
+    """
+    ensure_schema("detection_cache", CACHE_SCHEMA)
+    with FILESYSTEM_SCAN.time(scan="content_hash"):
+        return run_blocking(_hash_files, [os.path.abspath(p) for p in paths])
+
+
+def cache_key(image_sha256, weights_sha256, img_size, conf, iou):
+    return hashlib.sha256(f"{image_sha256}|{weights_sha256}|{int(img_size)}|{float(conf)}|{float(iou)}"
+                          .encode("utf-8")).hexdigest()
+
+
+def resolve_source(model, source):
+    """
+    Returns the absolute path of a local detection source (folder, glob or file). Relative
+    paths are resolved against the backend folder and then against the model folder (the
+    working directory of detect.py and the inference worker).
+    """
+    if os.path.isabs(source) or glob.glob(source):
+        return os.path.abspath(source)
+    return os.path.join(os.getcwd(), model, source)
+
+
+def list_source_images(model, source):
+    """
+    Expands a detection source (folder, glob, single image or list of images) into absolute
+    image paths, like the inference worker does. Relative paths are resolved with resolve_source.
+    """
+    if isinstance(source, (list, tuple)):
+        return [os.path.abspath(p) for p in source if p.lower().endswith(IMAGE_EXTENSIONS)]
+    source = resolve_source(model, source)
+    if os.path.isdir(source):
+        files = sorted(glob.glob(os.path.join(source, "*.*")))
+    elif "*" in source:
+        files = sorted(glob.glob(source, recursive=True))
+    elif os.path.isfile(source):
+        files = [source]
+    else:
+        raise FileNotFoundError(f"Source not found: {source}")
+    return [os.path.abspath(p) for p in files if p.lower().endswith(IMAGE_EXTENSIONS)]
+
+
+def _link(source, target):
+    """Hard-links source to target (replacing it), copies where links are not possible."""
+    tmp_target = f"{target}.{threading.get_ident()}.tmp"
+    try:
+        os.link(source, tmp_target)
+    except OSError:
+        shutil.copyfile(source, tmp_target)
+    os.replace(tmp_target, target)
+
+
+def _store_blob(path):
+    """Adds a file to the deduplicated blob store and returns its blob name (SHA-256 and extension)."""
+    name = _sha256(path) + os.path.splitext(path)[1].lower()
+    blob = os.path.join(BLOB_DIR, name[:2], name)
+    if not os.path.exists(blob):
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        _link(path, blob)
+    with connect() as conn:
+        conn.execute("INSERT OR REPLACE INTO detection_blobs (name, bytes) VALUES (?, ?)",
+                     (name, os.path.getsize(blob)))
+    return name
+
+
+def _blob_path(name):
+    return os.path.join(BLOB_DIR, name[:2], name)
+
+
+def _usable(entry, render, labels_conf):
+    if entry is None:
+        return False
+    if render and not (entry["output"] and os.path.exists(_blob_path(entry["output"]))):
+        return False
+    return labels_conf is None or (entry["labels"] is not None and entry["labels_conf"] == labels_conf)
+
+
+def _lookup(keys):
+    now = time.time()
+    with connect() as conn:
+        entries = {}
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            entries.update((row["key"], row) for row in conn.execute(
+                f"SELECT * FROM detection_cache WHERE key IN ({','.join('?' * len(chunk))})", chunk))
+        conn.executemany("UPDATE detection_cache SET used_at = ? WHERE key = ?", [(now, key) for key in entries])
+    return entries
+
+
+def _materialize(entry, path, model_dir, save_dir, render, labels_conf):
+    """Writes a cached result into the run folder and returns its worker-style image record."""
+    item = {"path": path, "name": os.path.basename(path), "detections": json.loads(entry["detections"]),
+            "cached": True}
+    if render:
+        item["output"] = os.path.join(save_dir, item["name"])
+        _link(_blob_path(entry["output"]), os.path.join(model_dir, item["output"]))
+    if labels_conf is not None:
+        stem = os.path.splitext(item["name"])[0]
+        with open(os.path.join(model_dir, save_dir, "labels", f"{stem}.txt"), "w") as f:
+            f.write(entry["labels"])
+    return item
+
+
+def _store(key, image_sha256, item, model_dir, save_dir, render, labels_conf):
+    """Adds the worker's result of one image to the cache, returns the cache row."""
+    detections = json.dumps(item["detections"], separators=(",", ":"))
+    labels = None
+    if labels_conf is not None:
+        stem = os.path.splitext(item["name"])[0]
+        try:
+            with open(os.path.join(model_dir, save_dir, "labels", f"{stem}.txt"), "r") as f:
+                labels = f.read()
+        except OSError:
+            labels_conf = None
+    output = _store_blob(os.path.join(model_dir, item["output"])) if render and item.get("output") else None
+    now = time.time()
+    row = {"key": key, "image_sha256": image_sha256, "detections": detections, "labels": labels,
+           "labels_conf": labels_conf, "output": output,
+           "bytes": len(detections) + len(labels or ""), "created_at": now, "used_at": now}
+    with connect() as conn:
+        previous = conn.execute("SELECT * FROM detection_cache WHERE key = ?", (key,)).fetchone()
+        if previous is not None:
+            # A result cached without the annotated image or labels keeps what it had
+            row["output"] = row["output"] or previous["output"]
+            if row["labels"] is None:
+                row["labels"], row["labels_conf"] = previous["labels"], previous["labels_conf"]
+        conn.execute(f"INSERT OR REPLACE INTO detection_cache ({', '.join(row)}) VALUES ({', '.join('?' * len(row))})",
+                     list(row.values()))
+    return row
+
+
+def evict():
+    """Removes the least recently used entries until the cache fits MAX_CACHE_BYTES, then unused blobs."""
+    ensure_schema("detection_cache", CACHE_SCHEMA)
+    with _evict_lock, connect() as conn:
+        conn.execute("DELETE FROM content_hashes WHERE rowid <= (SELECT MAX(rowid) FROM content_hashes) - ?",
+                     (MAX_HASHED_FILES,))
+        total = conn.execute("SELECT (SELECT COALESCE(SUM(bytes), 0) FROM detection_cache) + "
+                             "(SELECT COALESCE(SUM(bytes), 0) FROM detection_blobs)").fetchone()[0]
+        if total <= MAX_CACHE_BYTES:
+            return 0
+        blob_bytes = {row["name"]: row["bytes"] for row in conn.execute("SELECT name, bytes FROM detection_blobs")}
+        references = {}
+        for row in conn.execute("SELECT output, COUNT(*) AS n FROM detection_cache WHERE output IS NOT NULL "
+                                "GROUP BY output"):
+            references[row["output"]] = row["n"]
+        removed, orphans = [], []
+        for row in conn.execute("SELECT key, output, bytes FROM detection_cache ORDER BY used_at"):
+            if total <= MAX_CACHE_BYTES:
+                break
+            removed.append(row["key"])
+            total -= row["bytes"]
+            if row["output"] is not None:
+                references[row["output"]] = references.get(row["output"], 1) - 1
+                if references[row["output"]] == 0:
+                    orphans.append(row["output"])
+                    total -= blob_bytes.get(row["output"], 0)
+        conn.executemany("DELETE FROM detection_cache WHERE key = ?", [(key,) for key in removed])
+        conn.executemany("DELETE FROM detection_blobs WHERE name = ?", [(name,) for name in orphans])
+    for name in orphans:
+        # Run folders keep their hard links, only the cache's own link goes away
+        try:
+            os.remove(_blob_path(name))
+        except OSError:
+            pass
+    return len(removed)
+
+
+def cache_stats():
+    """Returns the entry count and size of the detection result cache."""
+    ensure_schema("detection_cache", CACHE_SCHEMA)
+    with connect() as conn:
+        row = conn.execute("SELECT COUNT(*) AS entries, COALESCE(SUM(bytes), 0) AS bytes FROM detection_cache"
+                           ).fetchone()
+        blobs = conn.execute("SELECT COUNT(*) AS blobs, COALESCE(SUM(bytes), 0) AS bytes FROM detection_blobs"
+                             ).fetchone()
+    return {"enabled": MAX_CACHE_BYTES > 0, "entries": row["entries"], "blobs": blobs["blobs"],
+            "bytes": row["bytes"] + blobs["bytes"], "max_bytes": MAX_CACHE_BYTES}
+
+
+def cached_inference(model, training_run, source, img_size, conf, iou, save_dir=None, render=True, batch_size=8,
+                     save_txt=False, store_conf=None, weights=None):
+    """
+    Runs detection like inference_service.run_inference, but only on images whose result
+    is not cached yet.
+
+    Results are cached per image under (SHA-256 of the image, SHA-256 of the weights,
+    img_size, conf, iou): the detections, the saved predictions (labels/*.txt) and the
+    annotated image, which is kept once in a content-addressed blob store and hard-linked
+    into every run folder that shows it. Images seen before, and copies of an image
+    within the request, are answered from the cache; the rest goes to the inference
+    worker in one request and is added to the cache as the batches finish.
+
+    Args:
+        See inference_service.run_inference.
+
+    Yields:
+        dict: Worker-style messages, one per batch (cached images have "cached": true)
+              and a final summary with "done" and the number of cached images.
+    """
+    model_dir = os.path.join(os.getcwd(), model)
+    weights = weights or os.path.join("runs", "train", training_run, "weights", "best.pt")
+    paths = list_source_images(model, source)
+    if MAX_CACHE_BYTES <= 0:
+        yield from run_inference(model, training_run, paths, img_size, conf, iou, save_dir=save_dir, render=render,
+                                 batch_size=batch_size, save_txt=save_txt, store_conf=store_conf, weights=weights)
+        return
+
+    render = render and bool(save_dir)
+    save_txt = save_txt and bool(save_dir)
+    # The worker saves predictions down to store_conf, the labels of a cached result must match
+    labels_conf = (min(float(conf), float(store_conf)) if store_conf is not None else float(conf)) \
+        if save_txt else None
+    if save_dir:
+        os.makedirs(os.path.join(model_dir, save_dir, "labels" if save_txt else ""), exist_ok=True)
+
+    weights_path = os.path.abspath(os.path.join(model_dir, weights))
+    weights_sha256 = content_hashes([weights_path]).get(weights_path)
+    if weights_sha256 is None:
+        raise Exception(f"Weight file not found: {weights}")
+    hashes = content_hashes(paths)
+    keys = {path: cache_key(hashes[path], weights_sha256, img_size, conf, iou) for path in paths if path in hashes}
+    entries = _lookup(sorted(set(keys.values())))
+
+    hits, misses, waiting = [], [], {}
+    for path in paths:
+        key = keys.get(path)
+        if _usable(entries.get(key), render, labels_conf):
+            hits.append(path)
+        elif key in waiting:
+            waiting[key].append(path)
+        else:
+            if key is not None:
+                waiting[key] = []
+            misses.append(path)
+
+    batch_size = max(1, int(batch_size))
+    for start in range(0, len(hits), batch_size):
+        yield {"event": "batch", "images": [_materialize(entries[keys[path]], path, model_dir, save_dir, render,
+                                                         labels_conf) for path in hits[start:start + batch_size]]}
+
+    timings = {"inference": 0.0, "render": 0.0}
+    if misses:
+        for message in run_inference(model, training_run, misses, img_size, conf, iou, save_dir=save_dir,
+                                     render=render, batch_size=batch_size, save_txt=save_txt, store_conf=store_conf,
+                                     weights=weights):
+            if message.get("done"):
+                timings = message["timings"]
+                break
+            images = []
+            for item in message.get("images", []):
+                images.append(item)
+                key = keys.get(item["path"])
+                if key is None:
+                    continue
+                row = _store(key, hashes[item["path"]], item, model_dir, save_dir, render, labels_conf)
+                images += [_materialize(row, path, model_dir, save_dir, render, labels_conf)
+                           for path in waiting.get(key, [])]
+            yield dict(message, images=images)
+        evict()
+
+    cached = len(paths) - len(misses)
+    if cached:
+        print(f"Detection cache: {cached} of {len(paths)} images served from the cache")
+    yield {"done": True, "count": len(paths), "cached": cached, "timings": timings}
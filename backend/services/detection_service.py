@@ -1,10 +1,34 @@
 import os
+import re
+import shutil
 import subprocess
-import threading
-import time
-import datetime
+import tempfile
 from flask import request  # Needed for extracting host URL in get_latest_images_logic
 
+from services.catalog_service import allocate_run, list_runs, refresh_run
+from services.db import DATA_DIR
+from services.detection_cache_service import cached_inference, resolve_source
+from services.environment_service import get_python_path
+from services.event_service import bus, experiment_topic, publish
+from services.export_service import backend_weights, resolve_backend
+from services.inference_service import run_inference, run_video_inference
+from services.job_service import submit_job
+from services.metrics_service import ProcessMeter
+from services.output_service import pump_output, run_log_path
+from services.prediction_store_service import STORE_CONF, store_predictions
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.wmv', '.mpg', '.mpeg', '.m4v')
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+UPLOAD_DIR = os.path.join(DATA_DIR, "uploads")
+
+# detect.py output lines that announce a written result image
+# YOLOv5: "image 1/8 /data/img/bus.jpg: 640x480 4 persons, 1 bus, 45.2ms"
+# YOLOv7: " The image with the result is saved in: runs/detect/exp/bus.jpg"
+SAVED_IMAGE_PATTERNS = [
+    re.compile(r"^image \d+/\d+ (.+?): \d+x\d+"),
+    re.compile(r"The image with the result is saved in: (.+)$"),
+]
+
 def run_detection_logic(form):
     training_run = form.get("trainingRun")
     source = form.get("source")
@@ -15,27 +39,25 @@ def run_detection_logic(form):
     img_size = form.get("img_size", "640")
     conf = form.get("conf", "0.4")
     iou = form.get("iou", "0.45")
+    engine = form.get("engine", "server")
+    mode = form.get("mode", "")
     weight_file = os.path.join("runs", "train", training_run, "weights", "best.pt")
     if not os.path.exists(os.path.join(model, weight_file)):
         raise Exception(f"Weight file not found for training run: {training_run}")
+    backend = resolve_backend(form.get("backend"))
+    if backend != "pytorch":
+        # detect.py and the inference worker load .onnx weights through DetectMultiBackend
+        weight_file = backend_weights(model, training_run, backend)
+    tiling = tiling_options(form)
+    use_cache = str(form.get("cache", "true")).lower() not in ("0", "false", "no")
+    if tiling and (engine != "server" or not can_use_inference_server(model, source)):
+        raise Exception("Tiled detection needs still images and the server engine")
 
-    # Determine a new experiment number
-    base_detect_dir = os.path.join(os.getcwd(), model, "runs", "detect")
-    if not os.path.exists(base_detect_dir):
-        os.makedirs(base_detect_dir, exist_ok=True)
-    exp_dirs = [
-        d for d in os.listdir(base_detect_dir)
-        if os.path.isdir(os.path.join(base_detect_dir, d)) and d.startswith("exp")
-    ]
-    if exp_dirs:
-        max_num = max([int(d[3:]) for d in exp_dirs if d[3:].isdigit()] or [0])
-    else:
-        max_num = 0
-    new_experiment = f"exp{max_num + 1}"
+    new_experiment = allocate_run(model, "detect")
 
     # Construct the detection command
     cmd = [
-        "python", "detect.py",
+        get_python_path(model), "detect.py",
         "--weights", weight_file,
         "--img", str(img_size),
         "--source", source,
@@ -43,65 +65,293 @@ def run_detection_logic(form):
         "--iou", str(iou),
         "--project", os.path.join("runs", "detect"),
         "--name", new_experiment,
-        "--exist-ok"
+        "--exist-ok",
+        # Predictions with confidences for the evaluator
+        "--save-txt", "--save-conf"
     ]
 
-    def run_detection():
+    topic = experiment_topic("detect", model, new_experiment)
+    run_dir = os.path.join(os.getcwd(), model, "runs", "detect", new_experiment)
+
+    def run_detection(job):
         cwd_path = os.path.join(os.getcwd(), model)
+        meter = ProcessMeter("detection")
         process = subprocess.Popen(
             cmd,
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
-            text=True,
             cwd=cwd_path
         )
-        for line in process.stdout:
-            print(line, end="")
-        process.stdout.close()
-        process.wait()
+        job.attach_process(process)
 
-    threading.Thread(target=run_detection).start()
-    # Return the new experiment id and the full command as debug info
-    return new_experiment, " ".join(cmd)
+        def forward(text):
+            for line in text.splitlines():
+                name = saved_image_name(line)
+                if name:
+                    publish(topic, "image", name=name)
 
-def get_latest_images_logic(model, experiment, timeout=10, poll_interval=1):
-    base_detect_dir = os.path.join(os.getcwd(), model, "runs", "detect")
-    experiment_folder = os.path.join(base_detect_dir, experiment)
-    waited = 0
-    while waited < timeout and not os.path.exists(experiment_folder):
-        time.sleep(poll_interval)
-        waited += poll_interval
-    if not os.path.exists(experiment_folder):
+        pump_output(process, meter, forward, run_log_path(run_dir))
+        store_predictions(run_dir, {"conf": float(conf), "iou": float(iou)})
+        refresh_run(model, "detect", new_experiment)
+        if process.returncode != 0:
+            raise Exception(f"detect.py exited with code {process.returncode}")
+
+    def run_detection_on_server(job):
+        save_dir = os.path.join("runs", "detect", new_experiment)
+        options = dict(save_dir=save_dir, batch_size=form.get("batch_size", 8), save_txt=True,
+                       store_conf=STORE_CONF, weights=weight_file)
+        if tiling:
+            options["tiling"] = tiling
+        # Tiles are not cached, other images seen before with these weights and thresholds are
+        detect = cached_inference if use_cache and not tiling else run_inference
+        try:
+            for message in detect(model, training_run, source, img_size, conf, iou, **options):
+                job.check_cancelled()
+                for item in message.get("images", []):
+                    if "output" in item:
+                        publish(topic, "image", name=item["name"])
+                if message.get("done"):
+                    print(f"Detection {new_experiment} finished: {message['count']} images, "
+                          f"timings {message['timings']}")
+                    store_predictions(run_dir, {"conf": min(float(conf), STORE_CONF), "iou": float(iou)})
+                    refresh_run(model, "detect", new_experiment)
+                    result = {"experiment": new_experiment, "images": message["count"],
+                              "cached": message.get("cached", 0)}
+                    if tiling:
+                        result.update(tiles=message["tiles"], timings=message["timings"])
+                    return result
+        except Exception as e:
+            # detect.py cannot tile, falling back would silently miss the small objects
+            if job.cancel_requested or tiling:
+                raise
+            print(f"Inference server failed for {new_experiment}, falling back to detect.py: {e}")
+            if use_cache:
+                # Cached images are hard links into the cache, detect.py must not write into them
+                shutil.rmtree(run_dir, ignore_errors=True)
+                os.makedirs(run_dir, exist_ok=True)
+            run_detection(job)
+        return {"experiment": new_experiment}
+
+    def run_video_on_server(job):
+        save_dir = os.path.join("runs", "detect", new_experiment)
+        # The worker checks for this file between progress reports, so a cancelled job stops early
+        cancel_file = os.path.join(os.getcwd(), model, save_dir, ".cancel")
+        try:
+            for message in run_video_inference(model, training_run, resolve_source(model, source), img_size, conf, iou,
+                                               save_dir, batch_size=form.get("batch_size", 8),
+                                               stride=form.get("stride", 1), cancel_file=cancel_file,
+                                               weights=weight_file):
+                if job.cancel_requested:
+                    open(cancel_file, "w").close()
+                    job.check_cancelled()
+                if message.get("event") == "progress":
+                    publish(topic, "progress", frames=message["frames"], fps=message["fps"],
+                            stages=message["stages"])
+                if message.get("done"):
+                    print(f"Video detection {new_experiment} finished: {message['frames']} frames, "
+                          f"{message['fps']} fps, stages {message['stages']}")
+                    for name in (message["results_file"], message["video_file"]):
+                        if name:
+                            publish(topic, "file", name=name)
+                    return {"experiment": new_experiment, "frames": message["frames"], "fps": message["fps"],
+                            "stages": message["stages"], "results_file": message["results_file"],
+                            "video_file": message["video_file"]}
+        finally:
+            if os.path.exists(cancel_file):
+                os.remove(cancel_file)
+            refresh_run(model, "detect", new_experiment)
+
+    params = {"model": model, "trainingRun": training_run, "source": source, "img_size": img_size,
+              "conf": conf, "iou": iou, "experiment": new_experiment, "backend": backend}
+
+    # Video files and, with mode=video, frame folders go through the pipelined video mode
+    if engine == "server" and is_video_source(model, source, mode):
+        command = f"inference-server {model} --video --weights {weight_file} --img {img_size} " \
+                  f"--source {source} --conf {conf} --iou {iou} --stride {form.get('stride', 1)} " \
+                  f"--batch-size {form.get('batch_size', 8)} --name {new_experiment}"
+        job = submit_job("detection", dict(params, command=command, mode="video"), run_video_on_server,
+                         priority=form.get("priority", 0), topic=topic)
+        return new_experiment, command, job.id
+
+    # The warm inference server handles still images, streams and videos go through detect.py
+    if engine == "server" and can_use_inference_server(model, source):
+        command = f"inference-server {model} --weights {weight_file} --img {img_size} " \
+                  f"--source {source} --conf {conf} --iou {iou} --name {new_experiment}"
+        if tiling:
+            command += " --tiled " + " ".join(f"--{k.replace('_', '-')} {v}" for k, v in tiling.items())
+            params.update(mode="tiled", tiling=tiling)
+        job = submit_job("detection", dict(params, command=command), run_detection_on_server,
+                         priority=form.get("priority", 0), topic=topic)
+        return new_experiment, command, job.id
+
+    command = " ".join(cmd)
+    job = submit_job("detection", dict(params, command=command), run_detection,
+                     priority=form.get("priority", 0), topic=topic)
+    # Return the new experiment id, the full command as debug info and the job id
+    return new_experiment, command, job.id
+
+
+def tiling_options(form):
+    """
+    Returns the tiled detection options of a detection request (mode=tiled), None for other modes.
+
+    Raises:
+        ValueError: If an option is out of range.
+    """
+    if form.get("mode", "") != "tiled":
         return None
+    options = {
+        "tile_size": int(form.get("tile_size", 640)),
+        "overlap": float(form.get("overlap", 0.2)),
+        "workers": int(form.get("workers", 2)),
+        "merge": form.get("merge", "nms"),
+        "merge_iou": float(form.get("merge_iou", 0.5)),
+        "match": form.get("match", "ios"),
+        "full_image": str(form.get("full_image", "true")).lower() in ("1", "true", "yes"),
+    }
+    if options["tile_size"] < 32:
+        raise ValueError("tile_size must be at least 32 pixels")
+    if not 0 <= options["overlap"] < 0.9:
+        raise ValueError("overlap must be between 0 and 0.9")
+    if options["merge"] not in ("nms", "wbf"):
+        raise ValueError("merge must be 'nms' or 'wbf'")
+    if options["match"] not in ("ios", "iou"):
+        raise ValueError("match must be 'ios' or 'iou'")
+    return options
+
 
-    image_files = [f for f in os.listdir(experiment_folder)
-                   if f.lower().endswith(('.png', '.jpg', '.jpeg'))
-                   and os.path.isfile(os.path.join(experiment_folder, f))]
+def run_batch_detection(model, training_run, paths, img_size=640, conf=0.25, iou=0.45, batch_size=16,
+                        render=False, cache=True):
+    """
+    Runs detection on a list of images through the warm inference worker and yields
+    the structured results as the batches finish.
+
+    Args:
+        model (str): Model family (e.g., "yolov5").
+        training_run (str): Training run whose best.pt is used.
+        paths (list): Absolute paths of the images.
+        img_size (int): Inference image size.
+        conf (float): Confidence threshold.
+        iou (float): IoU threshold for NMS.
+        batch_size (int): Number of images passed to the model at once.
+        render (bool): Also write annotated images into a new detection experiment.
+        cache (bool): Answer images detected before with these weights and thresholds from the
+                      detection result cache.
+
+    Yields:
+        dict: One record per image (name, path, detections with class, conf and xyxy),
+              followed by a summary record with "done": true.
+    """
+    weight_file = os.path.join(model, "runs", "train", training_run, "weights", "best.pt")
+    if not os.path.exists(weight_file):
+        raise Exception(f"Weight file not found for training run: {training_run}")
+    if not paths:
+        raise Exception("No images given")
+
+    experiment = allocate_run(model, "detect") if render else None
+    save_dir = os.path.join("runs", "detect", experiment) if render else None
+    topic = experiment_topic("detect", model, experiment) if render else None
+
+    detect = cached_inference if cache else run_inference
+    for message in detect(model, training_run, [os.path.abspath(p) for p in paths], img_size, conf, iou,
+                          save_dir=save_dir, render=render, batch_size=batch_size):
+        for item in message.get("images", []):
+            if topic and "output" in item:
+                publish(topic, "image", name=item["name"])
+                item["output"] = os.path.basename(item["output"])
+            yield item
+        if message.get("done"):
+            if topic:
+                refresh_run(model, "detect", experiment)
+                publish(topic, "completed", state="succeeded")
+            yield {"done": True, "count": message["count"], "cached": message.get("cached", 0),
+                   "timings": message["timings"], "experiment": experiment}
+
+
+def save_uploaded_images(files):
+    """
+    Stores uploaded images in a new temporary folder (the caller removes it).
+
+    Returns:
+        tuple: The folder and the list of absolute paths of the saved images.
+    """
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    upload_dir = tempfile.mkdtemp(prefix="batch_", dir=UPLOAD_DIR)
+    paths = []
+    for i, file in enumerate(files):
+        # The index prefix keeps files with equal names apart and preserves the order
+        path = os.path.join(upload_dir, f"{i:06d}_{os.path.basename(file.filename or 'image.jpg')}")
+        file.save(path)
+        paths.append(path)
+    return upload_dir, paths
+
+
+def saved_image_name(line):
+    """Returns the file name of the result image announced by a detect.py output line, if any."""
+    for pattern in SAVED_IMAGE_PATTERNS:
+        match = pattern.search(line.strip())
+        if match and match.group(1).lower().endswith(IMAGE_EXTENSIONS):
+            return os.path.basename(match.group(1))
+    return None
+
+
+def can_use_inference_server(model, source):
+    """Returns True if the source consists of still images only (no video, stream or webcam)."""
+    if not source:
+        return False
+    lower = source.lower()
+    if lower.isnumeric() or lower.startswith(("rtsp://", "rtmp://", "http://", "https://")):
+        return False
+    path = resolve_source(model, source)
+    if os.path.isdir(path):
+        return not any(f.lower().endswith(VIDEO_EXTENSIONS) for f in os.listdir(path))
+    return not lower.endswith(VIDEO_EXTENSIONS)
+
+
+def is_video_source(model, source, mode=""):
+    """Returns True for a local video file, or for a folder of frames when mode is "video"."""
+    if not source:
+        return False
+    path = resolve_source(model, source)
+    if not os.path.exists(path):
+        return False
+    if os.path.isdir(path):
+        return mode == "video"
+    return path.lower().endswith(VIDEO_EXTENSIONS)
+
+def get_latest_images_logic(model, experiment, wait=0):
+    """
+    Returns result image URLs of a detection experiment, newest first.
+
+    The list comes from the "image" events published while the detection runs, so
+    the folder is not listed on every call. With wait > 0 the call blocks until the
+    first result image is announced or the timeout (seconds) expires.
+
+    Returns:
+        dict | None: Experiment id and image URLs, None if there are no images yet.
+    """
+    experiment_folder = os.path.join(os.getcwd(), model, "runs", "detect", experiment)
+    topic = experiment_topic("detect", model, experiment)
+    if wait and not bus.result_files(topic, experiment_folder):
+        bus.wait(topic, timeout=wait, types=("image", "completed"))
+
+    image_files = bus.result_files(topic, experiment_folder)
     if not image_files:
         return None
-    image_files.sort(key=lambda f: os.path.getmtime(os.path.join(experiment_folder, f)), reverse=True)
     host_url = request.host_url.rstrip('/')
     image_urls = [f"{host_url}/api/detection/image/{model}/{experiment}/{f}" for f in image_files]
     return {"experiment": experiment, "images": image_urls}
 
 
-def get_detection_list(model):
-    base_dir = os.path.join(os.getcwd(), model, "runs", "detect")
-    runs = []
-    if os.path.exists(base_dir):
-        for run_dir in os.listdir(base_dir):
-            full_run_path = os.path.join(base_dir, run_dir)
-            if os.path.isdir(full_run_path):
-                creation_time = os.path.getctime(full_run_path)
-                creation_time_iso = datetime.datetime.fromtimestamp(creation_time).isoformat() + "Z"
-                runs.append({
-                    "id": run_dir,
-                    "name": run_dir,
-                    "timestamp": creation_time_iso,
-                    "path": full_run_path
-                })
-        runs.sort(key=lambda x: x["timestamp"], reverse=True)
-    return runs
+def get_detection_list(model, **list_options):
+    """
+    Returns detection runs of a model from the run catalog.
+
+    Args:
+        model (str): Model name.
+        **list_options: Paging, sorting and filtering options of catalog_service.list_runs.
+    """
+    return list_runs(model, "detect", **list_options)
 
 def get_detection(model, experiment, host_url):
     base_detect_dir = os.path.join(os.getcwd(), model, "runs", "detect")
@@ -0,0 +1,210 @@
+import json
+import os
+import subprocess
+import threading
+import time
+
+MODEL_ENVIRONMENTS = {
+    "yolov5": "yolov5_env",
+    "yolov7": "yolov7_env"
+}
+DEFAULT_ENVIRONMENT = "yolov_base_env"
+# Interpreter used when conda or the environment of a model is not available
+FALLBACK_PYTHON = "python"
+# Seconds after which a resolved environment is checked again, even if nothing changed on disk
+ENVIRONMENT_TTL = int(os.environ.get("ENVIRONMENT_TTL", 3600))
+PROBE_TIMEOUT = 120
+
+# Run inside the environment's interpreter to report its torch and thread setup
+PROBE_SCRIPT = """
+import json, os, sys
+info = {"python_version": sys.version.split()[0], "cpu_count": os.cpu_count(),
+        "omp_num_threads": os.environ.get("OMP_NUM_THREADS")}
+try:
+    import torch
+    info.update(torch=torch.__version__, cuda=torch.cuda.is_available(),
+                cuda_devices=torch.cuda.device_count() if torch.cuda.is_available() else 0,
+                num_threads=torch.get_num_threads(), num_interop_threads=torch.get_num_interop_threads())
+except Exception as e:
+    info["torch_error"] = str(e)
+print(json.dumps(info))
+"""
+
+
+def get_python_path_for_env(env_name, env_list=None):
+    """
+    Retrieves the Python interpreter path for a given conda environment.
+
+    Args:
+        env_name (str): Name of the conda environment.
+        env_list (list, optional): Environment paths from "conda env list"; queried when not given.
+
+    Returns:
+        str: The absolute path to the Python interpreter in the specified environment.
+
+    Raises:
+        Exception: If the conda environment list fails or the environment cannot be found.
+    """
+    if env_list is None:
+        env_list = list_conda_environments()
+
+    # Find the environment path matching the provided environment name
+    env_path = next((env for env in env_list if os.path.basename(env) == env_name), None)
+    if env_path is None:
+        raise Exception(f"Environment '{env_name}' not found.")
+
+    # Build path to python env
+    python_path = os.path.join(env_path, "python.exe" if os.name == "nt" else "bin/python")
+    if not os.path.exists(python_path):
+        raise Exception(f"Python not found in environment '{env_name}': {python_path}")
+
+    return python_path
+
+
+def list_conda_environments():
+    """Returns the paths of all conda environments."""
+    try:
+        result = subprocess.run(["conda", "env", "list", "--json"],
+                                capture_output=True, text=True)
+    except FileNotFoundError:
+        raise Exception("conda is not installed or not on PATH")
+    if result.returncode != 0:
+        raise Exception("Failed to run conda env list: " + result.stderr)
+
+    try:
+        env_list, _ = json.JSONDecoder().raw_decode(result.stdout)
+    except json.JSONDecodeError as e:
+        print("Error parsing JSON:", e)
+        raise
+    return env_list["envs"]
+
+
+def probe_interpreter(python_path):
+    """Runs the probe script in an interpreter and returns its torch/thread configuration."""
+    result = subprocess.run([python_path, "-c", PROBE_SCRIPT], capture_output=True, text=True,
+                            timeout=PROBE_TIMEOUT)
+    if result.returncode != 0:
+        raise Exception(f"Interpreter {python_path} failed: {result.stderr.strip()[-500:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+class EnvironmentRegistry:
+    """
+    Cache of the resolved interpreters of the model environments.
+
+    "conda env list" and importing torch take seconds, so every environment is resolved
+    and validated once (in the background at startup) and jobs only pay for the spawn
+    itself. An entry is resolved again when its interpreter disappears or changes, when
+    it is older than ENVIRONMENT_TTL, or after invalidate().
+    """
+
+    def __init__(self, environments):
+        self.environments = environments
+        self.lock = threading.Lock()
+        # Held while resolving, so concurrent callers wait for one resolution instead of repeating it
+        self.resolve_lock = threading.Lock()
+        self.entries = {}
+        self.prewarm_thread = None
+
+    def _is_fresh(self, entry):
+        if time.time() - entry["resolved_at"] > ENVIRONMENT_TTL:
+            return False
+        if entry["python"] == FALLBACK_PYTHON:
+            return True
+        try:
+            return os.stat(entry["python"]).st_mtime == entry["mtime"]
+        except OSError:
+            return False
+
+    def _resolve(self, env_name, env_list=None):
+        entry = {"environment": env_name, "resolved_at": time.time(), "error": None, "config": None}
+        started = time.perf_counter()
+        try:
+            python_path = get_python_path_for_env(env_name, env_list)
+            entry.update(python=python_path, mtime=os.stat(python_path).st_mtime, fallback=False)
+        except Exception as e:
+            entry.update(python=FALLBACK_PYTHON, mtime=None, fallback=True, error=str(e))
+        try:
+            entry["config"] = probe_interpreter(entry["python"])
+        except Exception as e:
+            entry["error"] = entry["error"] or str(e)
+        entry["resolve_seconds"] = round(time.perf_counter() - started, 3)
+        return entry
+
+    def get(self, model):
+        """
+        Returns the cached environment entry of a model family, resolving it if needed.
+
+        Returns:
+            dict: environment, python (FALLBACK_PYTHON if it could not be resolved), fallback,
+                  error and the probed torch/thread config.
+        """
+        env_name = self.environments.get(model, DEFAULT_ENVIRONMENT)
+        with self.lock:
+            entry = self.entries.get(env_name)
+        if entry is not None and self._is_fresh(entry):
+            return entry
+
+        with self.resolve_lock:
+            with self.lock:
+                entry = self.entries.get(env_name)
+            if entry is None or not self._is_fresh(entry):
+                entry = self._resolve(env_name)
+                with self.lock:
+                    self.entries[env_name] = entry
+            return entry
+
+    def python_path(self, model, strict=False):
+        """
+        Returns the interpreter of a model family.
+
+        Raises:
+            Exception: With strict, if the environment could not be resolved.
+        """
+        entry = self.get(model)
+        if strict and entry["fallback"]:
+            raise Exception(f"Environment '{entry['environment']}' is not available: {entry['error']}")
+        return entry["python"]
+
+    def invalidate(self, model=None):
+        """Drops the cached entry of a model family, or all entries."""
+        with self.lock:
+            if model is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(self.environments.get(model, DEFAULT_ENVIRONMENT), None)
+
+    def refresh(self):
+        """Resolves all environments again with a single "conda env list" call."""
+        with self.resolve_lock:
+            try:
+                env_list = list_conda_environments()
+            except Exception as e:
+                print(f"Could not list conda environments: {e}")
+                env_list = None
+            entries = {name: self._resolve(name, env_list) for name in set(self.environments.values())}
+            with self.lock:
+                self.entries.update(entries)
+        return self.status()
+
+    def prewarm(self):
+        """Resolves all environments in a background thread."""
+        if self.prewarm_thread is None:
+            self.prewarm_thread = threading.Thread(target=self.refresh, daemon=True, name="environment-prewarm")
+            self.prewarm_thread.start()
+        return self.prewarm_thread
+
+    def status(self):
+        with self.lock:
+            entries = {name: {k: v for k, v in entry.items() if k != "mtime"} for name, entry in self.entries.items()}
+        return {
+            model: entries.get(env_name, {"environment": env_name, "resolved_at": None})
+            for model, env_name in self.environments.items()
+        }
+
+
+registry = EnvironmentRegistry(MODEL_ENVIRONMENTS)
+
+
+def get_python_path(model, strict=False):
+    return registry.python_path(model, strict)
@@ -2,6 +2,13 @@ import os
 import time
 import json
 
+import numpy as np
+
+from services.dataset_service import label_path_for, list_dataset_images
+from services.job_service import scheduler
+from services.server_service import run_blocking
+from services.training_service import get_training_run_data
+
 
 def get_evaluation_data(model, experiment, host_url):
     """
@@ -30,3 +37,400 @@ def get_evaluation_data(model, experiment, host_url):
         "f1_curve_url": f"{host_url}/api/evaluation/file/{model}/{experiment}/F1_curve.png"
     }
     return eval_data
+
+
+# IoU thresholds of AP@[.5:.95]
+IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+# Confidence grid of the P/R/F1-confidence curves
+CURVE_POINTS = 1000
+# Points of the PR curves and of the confidence curves returned as JSON
+DEFAULT_OUTPUT_POINTS = 101
+# Thresholds of the confusion matrix (as YOLOv5/YOLOv7 plot it)
+MATRIX_CONF = 0.25
+MATRIX_IOU = 0.45
+EVALUATION_FILE = "evaluation.json"
+EPS = 1e-16
+
+_trapezoid = getattr(np, "trapezoid", None) or np.trapz
+
+
+def read_label_file(path, columns):
+    """
+    Reads a YOLO label/prediction file into an (n, columns) float array.
+
+    Ground truth files have 5 columns (class, x, y, w, h), prediction files written
+    with --save-conf have 6 (class, x, y, w, h, conf). Polygon labels are reduced to
+    their bounding box.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            rows = [line.split() for line in f if line.strip()]
+    except FileNotFoundError:
+        return np.zeros((0, columns))
+    boxes = []
+    for row in rows:
+        values = [float(v) for v in row]
+        if len(values) == columns:
+            boxes.append(values)
+        elif columns == 5 and len(values) > 5 and len(values) % 2:
+            xs, ys = values[1::2], values[2::2]
+            boxes.append([values[0], (min(xs) + max(xs)) / 2, (min(ys) + max(ys)) / 2,
+                          max(xs) - min(xs), max(ys) - min(ys)])
+    return np.array(boxes, dtype=np.float64).reshape(-1, columns)
+
+
+def xywh_to_xyxy(boxes):
+    xy, half = boxes[:, :2], boxes[:, 2:4] / 2
+    return np.concatenate((xy - half, xy + half), axis=1)
+
+
+def box_iou(boxes1, boxes2):
+    """IoU matrix (len(boxes1), len(boxes2)) of xyxy boxes. Normalized coordinates are fine, IoU does not depend on the scale."""
+    top_left = np.maximum(boxes1[:, None, :2], boxes2[None, :, :2])
+    bottom_right = np.minimum(boxes1[:, None, 2:], boxes2[None, :, 2:])
+    inter = np.clip(bottom_right - top_left, 0, None).prod(axis=2)
+    area1 = (boxes1[:, 2:] - boxes1[:, :2]).prod(axis=1)
+    area2 = (boxes2[:, 2:] - boxes2[:, :2]).prod(axis=1)
+    return inter / (area1[:, None] + area2[None, :] - inter + EPS)
+
+
+def greedy_match(gt, pred, iou):
+    """
+    Greedy one-to-one matching of candidate pairs by descending IoU.
+
+    The ids must be unique over the whole set (e.g. global box indexes), so the pairs of
+    all images are matched in one pass.
+
+    Returns:
+        tuple: Matched gt ids and pred ids.
+    """
+    order = np.argsort(-iou, kind="stable")
+    gt, pred = gt[order], pred[order]
+    # Keep the best pair of every prediction, then the best of those per ground truth box
+    _, first = np.unique(pred, return_index=True)
+    first.sort()
+    gt, pred = gt[first], pred[first]
+    _, first = np.unique(gt, return_index=True)
+    return gt[first], pred[first]
+
+
+def compute_ap(recall, precision):
+    """101-point interpolated AP (COCO) of one recall/precision curve, also returns the precision envelope."""
+    mrec = np.concatenate(([0.0], recall, [1.0]))
+    mpre = np.concatenate(([1.0], precision, [0.0]))
+    mpre = np.flip(np.maximum.accumulate(np.flip(mpre)))
+    x = np.linspace(0, 1, 101)
+    return _trapezoid(np.interp(x, mrec, mpre), x), mrec, mpre
+
+
+def _smooth(values, fraction=0.05):
+    """Box filter used to pick a stable best-F1 confidence."""
+    width = round(len(values) * fraction * 2) // 2 + 1
+    padded = np.concatenate((np.full(width // 2, values[0]), values, np.full(width // 2, values[-1])))
+    return np.convolve(padded, np.ones(width) / width, mode="valid")
+
+
+def _resample(values, points):
+    if values.shape[-1] <= points:
+        return values
+    indexes = np.linspace(0, values.shape[-1] - 1, points).round().astype(int)
+    return values[..., indexes]
+
+
+def _rounded(array, digits=5):
+    return np.round(array, digits).tolist()
+
+
+class Evaluator:
+    """
+    Accumulates predictions and ground truth of many images and computes the
+    detection metrics of the whole set.
+
+    add() only computes the IoU matrix of each image and keeps the candidate pairs
+    with global box indexes. Matching for all IoU thresholds, the AP, the curves and
+    the confusion matrix are then computed in batch over the pairs of all images.
+    """
+
+    def __init__(self, num_classes, iou_thresholds=IOU_THRESHOLDS, conf_threshold=0.001):
+        self.num_classes = num_classes
+        self.iou_thresholds = np.asarray(iou_thresholds)
+        self.conf_threshold = conf_threshold
+        self.conf, self.pred_cls, self.target_cls, self.target_image = [], [], [], []
+        # Same-class pairs for AP matching and any-class pairs for the confusion matrix: (gt, pred, iou)
+        self.pairs, self.matrix_pairs = [], []
+        self.num_targets = self.num_predictions = 0
+        self.images = 0
+
+    def add(self, predictions, targets):
+        """
+        Adds one image.
+
+        Args:
+            predictions (ndarray): (n, 6) class, x, y, w, h, conf (normalized xywh).
+            targets (ndarray): (m, 5) class, x, y, w, h.
+        """
+        predictions = predictions[predictions[:, 5] >= self.conf_threshold]
+        target_cls = targets[:, 0].astype(np.int64)
+        pred_cls = predictions[:, 0].astype(np.int64)
+        self.target_cls.append(target_cls)
+        self.target_image.append(np.full(len(target_cls), self.images))
+        self.conf.append(predictions[:, 5])
+        self.pred_cls.append(pred_cls)
+
+        if len(predictions) and len(targets):
+            iou = box_iou(xywh_to_xyxy(targets[:, 1:5]), xywh_to_xyxy(predictions[:, 1:5]))
+            gt, pred = np.nonzero((iou >= self.iou_thresholds.min()) & (target_cls[:, None] == pred_cls[None, :]))
+            self.pairs.append((gt + self.num_targets, pred + self.num_predictions, iou[gt, pred]))
+            gt, pred = np.nonzero((iou > MATRIX_IOU) & (predictions[:, 5] > MATRIX_CONF)[None, :])
+            self.matrix_pairs.append((gt + self.num_targets, pred + self.num_predictions, iou[gt, pred]))
+
+        self.num_targets += len(targets)
+        self.num_predictions += len(predictions)
+        self.images += 1
+
+    @staticmethod
+    def _concat(pairs):
+        if not pairs:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+        return tuple(np.concatenate(column) for column in zip(*pairs))
+
+    def _correct(self):
+        """(n_pred, n_thresholds) bool, True where a prediction is a true positive at the threshold."""
+        correct = np.zeros((self.num_predictions, len(self.iou_thresholds)), dtype=bool)
+        gt, pred, iou = self._concat(self.pairs)
+        for i, threshold in enumerate(self.iou_thresholds):
+            selected = iou >= threshold
+            _, matched = greedy_match(gt[selected], pred[selected], iou[selected])
+            correct[matched, i] = True
+        return correct
+
+    def _confusion_matrix(self, target_cls, pred_cls, conf):
+        # Rows are predicted classes, columns true classes, the last row/column is the background
+        background = self.num_classes
+        matrix = np.zeros((background + 1, background + 1), dtype=np.int64)
+        target_cls, pred_cls = np.clip(target_cls, 0, background), np.clip(pred_cls, 0, background)
+        gt, pred = greedy_match(*self._concat(self.matrix_pairs))
+        matched_gt = np.zeros(len(target_cls), dtype=bool)
+        matched_gt[gt] = True
+        unmatched_pred = conf > MATRIX_CONF
+        unmatched_pred[pred] = False
+        np.add.at(matrix, (pred_cls[pred], target_cls[gt]), 1)
+        np.add.at(matrix, (background, target_cls[~matched_gt]), 1)
+        np.add.at(matrix, (pred_cls[unmatched_pred], background), 1)
+        return matrix
+
+    def compute(self, class_names=None, output_points=DEFAULT_OUTPUT_POINTS):
+        """
+        Returns per-class AP@[.5:.95], precision/recall/F1 at the best-F1 confidence,
+        PR curves, P/R/F1-confidence curves and the confusion matrix as JSON-ready data.
+        """
+        nc = self.num_classes
+        names = list(class_names) if class_names else [str(i) for i in range(nc)]
+        thresholds = len(self.iou_thresholds)
+        conf = np.concatenate(self.conf) if self.conf else np.zeros(0)
+        pred_cls = np.concatenate(self.pred_cls) if self.pred_cls else np.zeros(0, dtype=np.int64)
+        target_cls = np.concatenate(self.target_cls) if self.target_cls else np.zeros(0, dtype=np.int64)
+        target_image = np.concatenate(self.target_image) if self.target_image else np.zeros(0, dtype=np.int64)
+        correct = self._correct()
+        matrix = self._confusion_matrix(target_cls, pred_cls, conf)
+
+        order = np.argsort(-conf, kind="stable")
+        correct, conf, pred_cls = correct[order], conf[order], pred_cls[order]
+        known = target_cls < nc
+        instances = np.bincount(target_cls[known], minlength=nc)
+        # Number of images containing each class (unique (image, class) pairs)
+        image_classes = np.unique(target_image[known] * nc + target_cls[known])
+        images_per_class = np.bincount(image_classes % nc, minlength=nc)
+
+        px = np.linspace(0, 1, CURVE_POINTS)
+        ap = np.zeros((nc, thresholds))
+        p_curve, r_curve = np.zeros((nc, CURVE_POINTS)), np.zeros((nc, CURVE_POINTS))
+        pr_curve = np.zeros((nc, CURVE_POINTS))
+        for c in range(nc):
+            selected = pred_cls == c
+            if not instances[c] or not selected.any():
+                continue
+            tpc = correct[selected].cumsum(axis=0)
+            fpc = (~correct[selected]).cumsum(axis=0)
+            recall = tpc / (instances[c] + EPS)
+            precision = tpc / (tpc + fpc)
+            # Confidence decreases along the arrays, np.interp needs increasing x
+            r_curve[c] = np.interp(-px, -conf[selected], recall[:, 0], left=0)
+            p_curve[c] = np.interp(-px, -conf[selected], precision[:, 0], left=1)
+            for j in range(thresholds):
+                ap[c, j], mrec, mpre = compute_ap(recall[:, j], precision[:, j])
+                if j == 0:
+                    pr_curve[c] = np.interp(px, mrec, mpre)
+
+        f1_curve = 2 * p_curve * r_curve / (p_curve + r_curve + EPS)
+        present = instances > 0
+        mean_f1 = f1_curve[present].mean(axis=0) if present.any() else np.zeros(CURVE_POINTS)
+        best = int(_smooth(mean_f1, 0.1).argmax())
+        precision, recall, f1 = p_curve[:, best], r_curve[:, best], f1_curve[:, best]
+
+        per_class = [
+            {
+                "class_id": c,
+                "class": names[c] if c < len(names) else str(c),
+                "images": int(images_per_class[c]),
+                "instances": int(instances[c]),
+                "precision": round(float(precision[c]), 5),
+                "recall": round(float(recall[c]), 5),
+                "f1": round(float(f1[c]), 5),
+                "ap50": round(float(ap[c, 0]), 5),
+                "ap50_95": round(float(ap[c].mean()), 5),
+                "ap": _rounded(ap[c]),
+            }
+            for c in range(nc)
+        ]
+
+        def mean(values):
+            return round(float(values[present].mean()), 5) if present.any() else 0.0
+
+        return {
+            "images": self.images,
+            "instances": int(instances.sum()),
+            "predictions": int(len(conf)),
+            "iou_thresholds": _rounded(self.iou_thresholds, 3),
+            "summary": {
+                "precision": mean(precision),
+                "recall": mean(recall),
+                "f1": mean(f1),
+                "map50": mean(ap[:, 0]),
+                "map50_95": mean(ap.mean(axis=1)),
+                "best_f1_conf": round(float(px[best]), 4),
+            },
+            "per_class": per_class,
+            "curves": {
+                "confidence": _rounded(_resample(px, output_points), 4),
+                "precision": _rounded(_resample(p_curve, output_points)),
+                "recall": _rounded(_resample(r_curve, output_points)),
+                "f1": _rounded(_resample(f1_curve, output_points)),
+                "pr_recall": _rounded(_resample(px, output_points), 4),
+                "pr_precision": _rounded(_resample(pr_curve, output_points)),
+            },
+            "confusion_matrix": {
+                "labels": [p["class"] for p in per_class] + ["background"],
+                "conf": MATRIX_CONF,
+                "iou": MATRIX_IOU,
+                "matrix": matrix.tolist(),
+            },
+        }
+
+
+def evaluate_predictions(predictions_dir, source, class_names=None, conf_threshold=0.001,
+                         output_points=DEFAULT_OUTPUT_POINTS):
+    """
+    Evaluates YOLO-format prediction files against the ground truth labels of a dataset.
+
+    Args:
+        predictions_dir (str): Folder with <image stem>.txt files (class x y w h conf), as written
+                               by detect.py/val.py with --save-txt --save-conf.
+        source (str): Image folder or .txt list of the evaluated dataset; labels are found the
+                      way the trainers find them.
+        class_names (list, optional): Class names, their count defines the number of classes.
+        conf_threshold (float): Predictions below this confidence are ignored.
+        output_points (int): Number of points of the returned curves.
+
+    Returns:
+        dict: Metrics of Evaluator.compute plus the evaluation time.
+    """
+    if not os.path.isdir(predictions_dir):
+        raise Exception(f"Prediction folder not found: {predictions_dir}")
+    images = list_dataset_images(source)
+    if not images:
+        raise Exception(f"No images found in {source}")
+    return evaluate_images(predictions_dir, images, class_names, conf_threshold, output_points)
+
+
+def evaluate_images(predictions_dir, images, class_names=None, conf_threshold=0.001,
+                    output_points=DEFAULT_OUTPUT_POINTS):
+    """
+    Evaluates the prediction files of a list of images (see evaluate_predictions). Parses
+    and computes only, so it can run in run_blocking; the images are listed by the caller.
+    """
+    started = time.perf_counter()
+    predictions = [read_label_file(os.path.join(predictions_dir, os.path.splitext(os.path.basename(p))[0] + ".txt"), 6)
+                   for p in images]
+    targets = [read_label_file(label_path_for(p), 5) for p in images]
+
+    num_classes = len(class_names) if class_names else int(max(
+        [a[:, 0].max() for a in predictions + targets if len(a)] or [0])) + 1
+    evaluator = Evaluator(num_classes, conf_threshold=conf_threshold)
+    for image_predictions, image_targets in zip(predictions, targets):
+        evaluator.add(image_predictions, image_targets)
+    result = evaluator.compute(class_names, output_points)
+    result["seconds"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def run_context(model, kind, experiment):
+    """
+    Returns the folder of a validation or detection run, the params of the job that
+    created it (empty if unknown) and the class names of its training run (or None).
+    """
+    if kind not in ("val", "detect"):
+        raise Exception(f"Unsupported run kind: {kind}")
+    run_dir = os.path.join(os.getcwd(), model, "runs", kind, experiment)
+    if not os.path.isdir(run_dir):
+        raise Exception(f"Run {experiment} not found")
+
+    job = scheduler.find_job("validation" if kind == "val" else "detection", model=model, experiment=experiment)
+    params = job["params"] if job else {}
+    class_names = None
+    if params.get("trainingRun"):
+        try:
+            class_names = get_training_run_data(model, params["trainingRun"])["classes"]
+        except Exception as e:
+            print(f"Class names of {params['trainingRun']} not available: {e}")
+    if isinstance(class_names, dict):
+        class_names = [class_names[k] for k in sorted(class_names)]
+    return run_dir, params, class_names
+
+
+def evaluate_run(model, experiment, kind="val", source=None, refresh=False):
+    """
+    Evaluates the stored predictions (labels/*.txt) of a validation or detection run.
+
+    The source dataset and class names are taken from the job that created the run
+    unless source is given. The result is cached in <run>/evaluation.json until the
+    predictions change.
+
+    Args:
+        model (str): Model name (e.g., "yolov5").
+        experiment (str): Run identifier (e.g., "exp3").
+        kind (str): "val" or "detect".
+        source (str, optional): Image folder or .txt list with the ground truth labels.
+        refresh (bool): Ignore the cached result.
+
+    Returns:
+        dict: Evaluation metrics, see Evaluator.compute.
+    """
+    run_dir, params, class_names = run_context(model, kind, experiment)
+    predictions_dir = os.path.join(run_dir, "labels")
+    if not os.path.isdir(predictions_dir):
+        raise Exception(f"Run {experiment} has no stored predictions (labels folder)")
+    source = source or params.get("source")
+    if not source:
+        raise Exception(f"Dataset of run {experiment} is unknown, pass source")
+
+    key = {"source": os.path.abspath(source), "mtime": os.stat(predictions_dir).st_mtime,
+           "files": len(os.listdir(predictions_dir))}
+    cache_path = os.path.join(run_dir, EVALUATION_FILE)
+    if not refresh and os.path.exists(cache_path):
+        with open(cache_path, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+        if cached.get("key") == key:
+            return cached["result"]
+
+    # Listed here, the dataset scan is timed by a metric whose lock must stay on the greenlet side
+    images = list_dataset_images(source)
+    if not images:
+        raise Exception(f"No images found in {source}")
+    result = run_blocking(evaluate_images, predictions_dir, images, class_names)
+    result["experiment"] = experiment
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"key": key, "result": result}, f, separators=(",", ":"))
+    os.replace(tmp_path, cache_path)
+    return result
@@ -0,0 +1,157 @@
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+from services.metrics_service import FILESYSTEM_SCAN
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# Events kept per topic for clients that reconnect or poll late
+MAX_EVENTS_PER_TOPIC = 1000
+# Topics (experiments, jobs) kept in memory, least recently used ones are dropped
+MAX_TOPICS = 500
+
+
+def experiment_topic(kind, model, experiment):
+    """Topic name of a run folder, e.g. "detect/yolov5/exp3"."""
+    return f"{kind}/{model}/{experiment}"
+
+
+def job_topic(job_id):
+    return f"job/{job_id}"
+
+
+class Topic:
+    def __init__(self):
+        self.events = deque(maxlen=MAX_EVENTS_PER_TOPIC)
+        self.files = []
+        self.file_names = set()
+        self.completed = False
+        self.scanned_mtime = None
+
+
+class EventBus:
+    """
+    In-memory publish/subscribe hub for job and run events.
+
+    Every event gets a sequence number that is unique across all topics, so a client
+    can continue from the last event it has seen (long-poll "after" parameter or the
+    SSE Last-Event-ID header). Waiting clients block on a condition variable and are
+    woken up by publish(), there is no polling.
+
+    Besides the events, every topic keeps the list of result files announced with
+    "image" events, so the latest results of a run can be returned without listing
+    its folder.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.topics = OrderedDict()
+        self.sequence = itertools.count(1)
+
+    def _topic(self, name):
+        # Must be called with self.condition held
+        topic = self.topics.get(name)
+        if topic is None:
+            topic = self.topics[name] = Topic()
+            while len(self.topics) > MAX_TOPICS:
+                self.topics.popitem(last=False)
+        else:
+            self.topics.move_to_end(name)
+        return topic
+
+    def publish(self, topic_name, event_type, **data):
+        """
+        Publishes an event and wakes up all waiting subscribers.
+
+        Args:
+            topic_name (str): Topic of the event (see experiment_topic and job_topic).
+            event_type (str): "started", "image", "completed", "state", ...
+            **data: JSON serializable event payload. "image" events need a "name".
+
+        Returns:
+            dict: The published event.
+        """
+        with self.condition:
+            topic = self._topic(topic_name)
+            event = {"id": next(self.sequence), "topic": topic_name, "type": event_type, "time": time.time(), **data}
+            topic.events.append(event)
+            if event_type == "image" and data["name"] not in topic.file_names:
+                topic.file_names.add(data["name"])
+                topic.files.append(data["name"])
+            elif event_type == "completed":
+                topic.completed = True
+            self.condition.notify_all()
+        return event
+
+    def events_after(self, topic_name, after=0):
+        with self.condition:
+            topic = self.topics.get(topic_name)
+            if topic is None:
+                return []
+            return [event for event in topic.events if event["id"] > after]
+
+    def wait(self, topic_name, after=0, timeout=0, types=None):
+        """
+        Returns the events of a topic newer than "after", waiting up to timeout seconds
+        for at least one to be published. With types only events of those types count.
+        """
+        deadline = time.monotonic() + max(0, timeout)
+        with self.condition:
+            while True:
+                topic = self.topics.get(topic_name)
+                events = [event for event in topic.events
+                          if event["id"] > after and (types is None or event["type"] in types)] if topic else []
+                remaining = deadline - time.monotonic()
+                if events or remaining <= 0:
+                    return events
+                self.condition.wait(remaining)
+
+    def is_completed(self, topic_name):
+        with self.condition:
+            topic = self.topics.get(topic_name)
+            return topic is not None and topic.completed
+
+    def result_files(self, topic_name, folder=None):
+        """
+        Returns result file names of a topic, newest first.
+
+        Runs that were not announced through events (older runs, runs from before a
+        restart, finished runs whose output announced no files) are listed from their
+        folder once; the listing is reused until the folder mtime changes.
+        """
+        with self.condition:
+            topic = self.topics.get(topic_name)
+            if topic is not None and (topic.files or (topic.events and not topic.completed) or folder is None):
+                return list(reversed(topic.files))
+
+        if folder is None or not os.path.isdir(folder):
+            return []
+        mtime = os.stat(folder).st_mtime
+        with self.condition:
+            topic = self._topic(topic_name)
+            if topic.scanned_mtime == mtime:
+                return list(reversed(topic.files))
+
+        entries = []
+        with FILESYSTEM_SCAN.time(scan="result_files"), os.scandir(folder) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    entries.append((entry.stat().st_mtime, entry.name))
+        entries.sort()
+
+        with self.condition:
+            topic = self._topic(topic_name)
+            topic.files = [name for _, name in entries]
+            topic.file_names = set(topic.files)
+            topic.scanned_mtime = mtime
+            return list(reversed(topic.files))
+
+
+bus = EventBus()
+
+
+def publish(topic_name, event_type, **data):
+    return bus.publish(topic_name, event_type, **data)
@@ -0,0 +1,259 @@
+import json
+import os
+import shutil
+import subprocess
+import time
+
+from services.artifact_service import get_manifest
+from services.db import DATA_DIR
+from services.environment_service import get_python_path
+from services.job_service import ACTIVE_STATES, scheduler, submit_job
+from services.metrics_service import ProcessMeter
+from services.output_service import pump_output
+from services.training_service import get_training_run_data
+
+EXPORT_DIR = os.path.join(DATA_DIR, "exports")
+TOOLS_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "workers", "onnx_tools.py")
+BACKENDS = ("pytorch", "onnx", "int8")
+# Files of an export folder besides model.onnx and export.json (see quantization_service)
+QUANTIZED_FILE = "model.int8.onnx"
+QUANTIZATION_REPORT = "quantization.json"
+# Families whose detect.py, val.py and hub model load .onnx weights (DetectMultiBackend)
+ONNX_FAMILIES = ("yolov5",)
+ONNX_OPSET = int(os.environ.get("ONNX_OPSET", 12))
+# Export every successfully finished training run of an ONNX family
+AUTO_EXPORT = os.environ.get("AUTO_EXPORT_ONNX", "1") == "1"
+# Minimum share of detections the ONNX model has to reproduce (same class, IoU >= 0.9)
+PARITY_MIN_AGREEMENT = float(os.environ.get("ONNX_PARITY_MIN_AGREEMENT", 0.95))
+PARITY_SAMPLES = int(os.environ.get("ONNX_PARITY_SAMPLES", 8))
+
+
+def weights_sha256(model, training_run):
+    """SHA-256 of the run's best.pt, taken from the (cached) artifact manifest."""
+    manifest = get_manifest(model, "train", training_run)
+    entry = next((f for f in manifest["files"] if f["path"] == "weights/best.pt"), None)
+    if entry is None:
+        raise Exception(f"Weight file not found for training run: {training_run}")
+    return entry["sha256"]
+
+
+def _export_folder(sha256):
+    return os.path.join(EXPORT_DIR, sha256[:16])
+
+
+def _read_json(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _read_export(folder):
+    return _read_json(os.path.join(folder, "export.json"))
+
+
+def get_export(model, training_run):
+    """
+    Returns the ONNX export of the run's current best.pt, None if there is none.
+
+    Exports are cached by the hash of the weights in data/exports/<hash>/ (model.onnx and
+    export.json), so a retrained best.pt is never served an outdated model.
+    """
+    return _read_export(_export_folder(weights_sha256(model, training_run)))
+
+
+def get_quantization(model, training_run):
+    """Returns the quantization report of the run's current best.pt, None if it was not quantized."""
+    return _read_json(os.path.join(_export_folder(weights_sha256(model, training_run)), QUANTIZATION_REPORT))
+
+
+def onnx_weights(model, training_run):
+    """
+    Absolute path of the ONNX model to use instead of best.pt.
+
+    Raises:
+        Exception: If the family has no ONNX backend, the run was not exported or the export
+                   failed its parity check.
+    """
+    if model not in ONNX_FAMILIES:
+        raise Exception(f"The ONNX backend is not available for {model}")
+    export = get_export(model, training_run)
+    if export is None:
+        raise Exception(f"Training run {training_run} has no ONNX export yet, start one with POST /api/exports")
+    if not export["parity"]["passed"]:
+        raise Exception(f"The ONNX export of {training_run} failed its parity check: {export['parity']}")
+    return export["onnx"]
+
+
+def int8_weights(model, training_run):
+    """
+    Absolute path of the published INT8 model of the run.
+
+    Raises:
+        Exception: If the run was not quantized or the quantized model did not pass the accuracy gate.
+    """
+    fp32 = onnx_weights(model, training_run)
+    report = get_quantization(model, training_run)
+    if report is None:
+        raise Exception(f"Training run {training_run} has no INT8 model yet, start one with POST /api/exports/quantize")
+    if not report["published"]:
+        raise Exception(f"The INT8 model of {training_run} was not published: {report['reason']}")
+    return os.path.join(os.path.dirname(fp32), QUANTIZED_FILE)
+
+
+def resolve_backend(backend):
+    backend = (backend or "pytorch").lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}', expected one of {', '.join(BACKENDS)}")
+    return backend
+
+
+def backend_weights(model, training_run, backend):
+    """Weights of the given backend ("onnx" or "int8"), None for "pytorch" (the run's best.pt)."""
+    backend = resolve_backend(backend)
+    if backend == "onnx":
+        return onnx_weights(model, training_run)
+    if backend == "int8":
+        return int8_weights(model, training_run)
+    return None
+
+
+def run_logged(job, cmd, cwd, kind):
+    """Runs a cancellable command of a job, printing its output (see output_service.OutputPump)."""
+    meter = ProcessMeter(kind)
+    process = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        cwd=cwd
+    )
+    job.attach_process(process)
+    pump_output(process, meter)
+    if process.returncode != 0:
+        raise Exception(f"{os.path.basename(cmd[1])} exited with code {process.returncode}")
+
+
+def run_tool(python, args, cwd, kind="export"):
+    """Runs onnx_tools.py and returns its JSON result (the last stdout line)."""
+    meter = ProcessMeter(kind)
+    process = subprocess.run([python, TOOLS_SCRIPT] + args, cwd=cwd, capture_output=True, text=True,
+                             encoding="utf-8", errors="replace")
+    meter.finish()
+    if process.returncode != 0:
+        raise Exception(f"onnx_tools.py {args[0]} failed: {process.stderr.strip()[-2000:]}")
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def start_export(model, training_run, img_size=None, force=False, priority=0):
+    """
+    Exports the run's best.pt to ONNX as an "export" job: export.py (dynamic axes,
+    simplified graph), an offline ONNX Runtime graph optimization and a parity check of
+    the outputs against the PyTorch model on a sample of the run's validation images.
+
+    Returns:
+        dict: The cached export ({"cached": True, ...}) or the job id of the running or queued export.
+    """
+    if model not in ONNX_FAMILIES:
+        raise Exception(f"The ONNX backend is not available for {model}")
+    sha256 = weights_sha256(model, training_run)
+    folder = _export_folder(sha256)
+    export = _read_export(folder)
+    if export is not None and not force:
+        return dict(export, cached=True)
+
+    existing = scheduler.find_job("export", weightsSha256=sha256)
+    if existing is not None and existing["state"] in ACTIVE_STATES:
+        return {"cached": False, "job_id": existing["id"], "state": existing["state"]}
+    # Quantizations of any method keep their work dir and results in the folder the new export replaces
+    quantizing = [job.id for job in scheduler.active_jobs("quantization") if job.params.get("weightsSha256") == sha256]
+    if quantizing:
+        raise Exception(f"The export of {training_run} is being quantized (job {quantizing[0]}), "
+                        f"export it again when that job has finished")
+
+    try:
+        run_data = get_training_run_data(model, training_run)
+    except Exception as e:
+        print(f"Training data of {training_run} not available, parity check uses random images: {e}")
+        run_data = {}
+    img_size = int(img_size or run_data.get("img_size") or 640)
+    val_images = run_data.get("val")
+    model_dir = os.path.join(os.getcwd(), model)
+    weights = os.path.join(model_dir, "runs", "train", training_run, "weights", "best.pt")
+
+    def run_export(job):
+        python = get_python_path(model, strict=True)
+        work_dir = f"{folder}.tmp-{job.id}"
+        os.makedirs(work_dir, exist_ok=True)
+        try:
+            # export.py writes the .onnx next to the weights, a copy keeps the run folder untouched
+            work_weights = os.path.join(work_dir, "best.pt")
+            shutil.copyfile(weights, work_weights)
+            started = time.perf_counter()
+            run_logged(job, [python, "export.py", "--weights", work_weights, "--include", "onnx",
+                             "--imgsz", str(img_size), "--dynamic", "--simplify", "--opset", str(ONNX_OPSET),
+                             "--device", "cpu"], model_dir, "export")
+            export_seconds = time.perf_counter() - started
+
+            job.check_cancelled()
+            onnx_path = os.path.join(folder, "model.onnx")
+            optimization = run_tool(python, ["optimize", "--input", os.path.join(work_dir, "best.onnx"),
+                                              "--output", os.path.join(work_dir, "model.onnx")], model_dir)
+
+            job.check_cancelled()
+            args = ["parity", "--weights", weights, "--onnx", os.path.join(work_dir, "model.onnx"),
+                    "--img", str(img_size), "--samples", str(PARITY_SAMPLES)]
+            if val_images:
+                args += ["--images", val_images]
+            parity = run_tool(python, args, model_dir)
+            parity["passed"] = parity["box_agreement"] >= PARITY_MIN_AGREEMENT
+            parity["min_agreement"] = PARITY_MIN_AGREEMENT
+
+            metadata = {
+                "model": model,
+                "training_run": training_run,
+                "weights_sha256": sha256,
+                "onnx": onnx_path,
+                "bytes": os.path.getsize(os.path.join(work_dir, "model.onnx")),
+                "img_size": img_size,
+                "opset": ONNX_OPSET,
+                "export_seconds": round(export_seconds, 3),
+                "optimization": optimization,
+                "parity": parity,
+                "created_at": time.time(),
+            }
+            with open(os.path.join(work_dir, "export.json"), "w", encoding="utf-8") as f:
+                json.dump(metadata, f, indent=2)
+            for name in ("best.pt", "best.onnx"):
+                os.remove(os.path.join(work_dir, name))
+            # The quantization report and INT8 model belong to the same weights, they are kept
+            for name in (QUANTIZATION_REPORT, QUANTIZED_FILE):
+                if os.path.exists(os.path.join(folder, name)):
+                    os.replace(os.path.join(folder, name), os.path.join(work_dir, name))
+            if os.path.isdir(folder):
+                shutil.rmtree(folder)
+            os.replace(work_dir, folder)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        print(f"ONNX export of {model}/{training_run}: parity {parity}, optimization {optimization}")
+        job.result.update(onnx=onnx_path, parity=parity)
+        if not parity["passed"]:
+            raise Exception(f"Parity check failed: {parity['box_agreement']} of the detections reproduced, "
+                            f"{PARITY_MIN_AGREEMENT} required")
+        return {"onnx": onnx_path, "parity": parity}
+
+    params = {"model": model, "trainingRun": training_run, "weightsSha256": sha256, "imgSize": img_size,
+              "command": f"export.py --weights {weights} --include onnx --imgsz {img_size} --dynamic --simplify"}
+    job = submit_job("export", params, run_export, priority=priority)
+    return {"cached": False, "job_id": job.id, "state": job.state}
+
+
+def export_finished_training(model, run_dir):
+    """Starts the automatic export of a successfully finished training run (AUTO_EXPORT_ONNX)."""
+    if not AUTO_EXPORT or model not in ONNX_FAMILIES or not run_dir:
+        return
+    try:
+        start_export(model, os.path.basename(os.path.normpath(run_dir)))
+    except Exception as e:
+        print(f"Automatic ONNX export of {run_dir} not started: {e}")
@@ -0,0 +1,163 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import jsonify, send_file
+from werkzeug.security import safe_join
+
+from services.db import DATA_DIR
+from services.server_service import run_blocking
+
+DERIVATIVE_DIR = os.path.join(DATA_DIR, "derivatives")
+DERIVATIVE_FORMATS = {"webp": ("WEBP", "image/webp"), "jpeg": ("JPEG", "image/jpeg"), "jpg": ("JPEG", "image/jpeg")}
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.webp')
+MAX_DERIVATIVE_SIZE = 4096
+DEFAULT_QUALITY = 80
+
+# Seconds browsers may reuse a result file before revalidating it with its ETag
+CACHE_MAX_AGE = int(os.environ.get("IMAGE_CACHE_MAX_AGE", 300))
+# Size cap of the derivative cache, the least recently generated files are removed first
+MAX_CACHE_BYTES = int(os.environ.get("IMAGE_CACHE_MAX_BYTES", 1024 ** 3))
+CLEANUP_EVERY = 200
+
+# Pillow releases the GIL while decoding, resizing and encoding, so threads scale
+_executor = ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1), thread_name_prefix="derivatives")
+_inflight = {}
+_inflight_lock = threading.Lock()
+_generated = 0
+
+
+def file_etag(path, stat, *variant):
+    """Strong ETag derived from the source path, mtime, size and the requested variant."""
+    key = f"{path}|{stat.st_mtime_ns}|{stat.st_size}|{'|'.join(str(v) for v in variant)}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def _generate(source, target, width, height, fmt, quality):
+    from PIL import Image
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with Image.open(source) as image:
+        image.draft("RGB", (width, height))  # lets JPEG decode at a reduced scale
+        image = image.convert("RGB")
+        image.thumbnail((width, height))
+        tmp_target = f"{target}.{threading.get_ident()}.tmp"
+        try:
+            image.save(tmp_target, DERIVATIVE_FORMATS[fmt][0], quality=quality)
+            os.replace(tmp_target, target)
+        except Exception:
+            # A half-written derivative would otherwise stay in the cache folder
+            if os.path.exists(tmp_target):
+                os.remove(tmp_target)
+            raise
+    return target
+
+
+def _cleanup():
+    files = []
+    for root, _, names in os.walk(DERIVATIVE_DIR):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= MAX_CACHE_BYTES:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+
+def get_derivative(source, stat, width, height, fmt, quality):
+    """
+    Returns the path of a resized/re-encoded copy of source, generating it in the worker
+    pool if it is not cached yet. Concurrent requests for the same derivative share one
+    generation.
+    """
+    global _generated
+    key = file_etag(source, stat, width, height, fmt, quality)
+    target = os.path.join(DERIVATIVE_DIR, key[:2], f"{key}.{fmt}")
+    if os.path.exists(target):
+        return target, key
+
+    with _inflight_lock:
+        future = _inflight.get(key)
+        if future is None:
+            future = _inflight[key] = _executor.submit(run_blocking, _generate, source, target, width, height,
+                                                       fmt, quality)
+    try:
+        future.result()
+    finally:
+        with _inflight_lock:
+            if _inflight.pop(key, None) is not None:
+                _generated += 1
+                if _generated % CLEANUP_EVERY == 0:
+                    _executor.submit(_cleanup)
+    return target, key
+
+
+def _derivative_options(args, filename):
+    width = args.get("w", type=int)
+    height = args.get("h", type=int)
+    fmt = (args.get("fmt") or "").lower()
+    if not (width or height or fmt) or not filename.lower().endswith(IMAGE_EXTENSIONS):
+        return None
+    if fmt and fmt not in DERIVATIVE_FORMATS:
+        raise ValueError(f"Unsupported format: {fmt}")
+    width = min(width or height or MAX_DERIVATIVE_SIZE, MAX_DERIVATIVE_SIZE)
+    height = min(height or width, MAX_DERIVATIVE_SIZE)
+    quality = max(1, min(args.get("q", DEFAULT_QUALITY, type=int), 100))
+    return width, height, fmt or "jpeg", quality
+
+
+def send_result_file(base_dir, filename, args, not_found_message=None):
+    """
+    Sends a file of a run folder with a strong ETag, Cache-Control and support for
+    conditional and Range requests.
+
+    Image files can be requested as derivatives with the query parameters w and/or h
+    (bounding box in pixels), fmt (webp or jpeg) and q (quality 1-100). Derivatives are
+    cached on disk keyed by the source path, mtime and size.
+
+    Args:
+        base_dir (str): Run folder.
+        filename (str): File name (may contain subfolders) inside the run folder.
+        args: Request query arguments.
+        not_found_message (str, optional): Error message of the 404 response.
+
+    Returns:
+        Response: The file, a 304/206 response or a JSON error.
+    """
+    path = safe_join(base_dir, filename)
+    if path is None or not os.path.isfile(path):
+        return jsonify({"error": not_found_message or f"File {filename} not found"}), 404
+    stat = os.stat(path)
+
+    try:
+        options = _derivative_options(args, filename)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if options is not None:
+        try:
+            derivative, etag = get_derivative(path, stat, *options)
+            response = send_file(derivative, mimetype=DERIVATIVE_FORMATS[options[2]][1], etag=etag,
+                                 conditional=True, max_age=CACHE_MAX_AGE)
+            response.cache_control.public = True
+            return response
+        except ImportError:
+            print("Pillow is not installed, serving the original image instead of a derivative")
+        except Exception as e:
+            return jsonify({"error": f"Could not create derivative of {filename}: {e}"}), 500
+
+    response = send_file(path, etag=file_etag(path, stat), conditional=True,
+                         last_modified=stat.st_mtime, max_age=CACHE_MAX_AGE)
+    response.cache_control.public = True
+    return response
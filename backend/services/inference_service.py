@@ -0,0 +1,224 @@
+import itertools
+import json
+import os
+import subprocess
+import threading
+
+from services.environment_service import get_python_path
+from services.metrics_service import ProcessMeter
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                             "workers", "inference_worker.py")
+
+# Bounds of the per-family model cache kept inside each worker
+MAX_CACHED_MODELS = int(os.environ.get("INFERENCE_MAX_MODELS", 3))
+MAX_CACHED_BYTES = int(os.environ.get("INFERENCE_MAX_BYTES", 2 * 1024 ** 3))
+
+
+class InferenceWorker:
+    """
+    Handle of one long-lived inference worker process.
+
+    One worker is started per model family, because every family lives in its own
+    conda environment and repository. The worker keeps its loaded models in memory,
+    so only the first request for a (training run, img_size) pays the model loading
+    and warmup cost. Requests to one worker are serialized.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.process = None
+        self.meter = None
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+
+    def _ensure_started(self):
+        if self.process is not None and self.process.poll() is None:
+            return
+        cmd = [
+            get_python_path(self.model), WORKER_SCRIPT,
+            "--family", self.model,
+            "--max-models", str(MAX_CACHED_MODELS),
+            "--max-bytes", str(MAX_CACHED_BYTES),
+        ]
+        print("Starting inference worker:", " ".join(cmd))
+        # Spawn to first output covers the interpreter, torch import and the first model load
+        self.meter = ProcessMeter("inference_worker")
+        self.process = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            encoding="utf-8",
+            errors="replace",
+            cwd=os.path.join(os.getcwd(), self.model)
+        )
+
+    def request(self, payload):
+        """
+        Sends one request to the worker and yields its messages until the final one.
+
+        The worker stays locked until the final message has been read, so the caller must
+        consume the messages promptly and never wait on client I/O between them.
+
+        Raises:
+            Exception: If the worker reports an error or terminates unexpectedly.
+        """
+        with self.lock:
+            self._ensure_started()
+            request_id = next(self.ids)
+            self.process.stdin.write(json.dumps(dict(payload, id=request_id)) + "\n")
+            self.process.stdin.flush()
+
+            done = False
+            try:
+                while not done:
+                    line = self.process.stdout.readline()
+                    if not line:
+                        self.process = None
+                        self.meter.finish()
+                        raise Exception(f"Inference worker '{self.model}' terminated unexpectedly")
+                    self.meter.line()
+                    message = json.loads(line)
+                    if message.get("id") != request_id:
+                        continue
+                    done = message.get("done", False)
+                    if message.get("error"):
+                        raise Exception(message["error"])
+                    yield message
+            finally:
+                # Drain the rest of the response if the caller stopped iterating early
+                while not done and self.process is not None:
+                    line = self.process.stdout.readline()
+                    if not line:
+                        self.process = None
+                        break
+                    message = json.loads(line)
+                    done = message.get("id") == request_id and message.get("done", False)
+
+    def call(self, payload):
+        """Sends a request and returns only its final message."""
+        message = None
+        for message in self.request(payload):
+            pass
+        return message
+
+    def stop(self):
+        with self.lock:
+            if self.process is not None and self.process.poll() is None:
+                self.process.stdin.close()
+                self.process.terminate()
+                self.meter.finish()
+            self.process = None
+
+
+_workers = {}
+_workers_lock = threading.Lock()
+
+
+def get_worker(model):
+    with _workers_lock:
+        worker = _workers.get(model)
+        if worker is None:
+            worker = _workers[model] = InferenceWorker(model)
+        return worker
+
+
+def run_inference(model, training_run, source, img_size, conf, iou, save_dir=None, render=True, batch_size=8,
+                  save_txt=False, store_conf=None, tiling=None, weights=None):
+    """
+    Runs detection through the warm inference worker of the given model family.
+
+    Args:
+        model (str): Model family (e.g., "yolov5").
+        training_run (str): Training run whose best.pt is used (e.g., "exp1").
+        source (str | list): Image folder, glob, single image or list of image paths.
+        img_size (int): Inference image size.
+        conf (float): Confidence threshold.
+        iou (float): IoU threshold for NMS.
+        save_dir (str, optional): Folder (relative to the model folder) for annotated images.
+        render (bool): Whether annotated images should be written to save_dir.
+        batch_size (int): Number of images passed to the model at once.
+        save_txt (bool): Also write YOLO-format predictions with confidences to save_dir/labels.
+        store_conf (float, optional): Lower confidence threshold of the saved predictions, so they
+                                      can be re-thresholded later without inference.
+        tiling (dict, optional): Run tiled detection (workers/tiling.py) with these options: tile_size
+                                 (used instead of img_size), overlap, workers, merge, merge_iou, match
+                                 and full_image. batch_size then counts tiles.
+        weights (str, optional): Weights used instead of best.pt (e.g. the run's ONNX export).
+
+    Yields:
+        dict: Worker messages, one per finished batch and a final summary with "done".
+    """
+    payload = {
+        "op": "detect",
+        "training_run": training_run,
+        "weights": weights or os.path.join("runs", "train", training_run, "weights", "best.pt"),
+        "source": source,
+        "img_size": int(img_size),
+        "conf": float(conf),
+        "iou": float(iou),
+        "save_dir": save_dir,
+        "render": render,
+        "batch_size": int(batch_size),
+        "save_txt": save_txt,
+        "store_conf": store_conf,
+    }
+    if tiling:
+        payload = dict(payload, op="tiled", **tiling)
+    return get_worker(model).request(payload)
+
+
+def run_video_inference(model, training_run, source, img_size, conf, iou, save_dir, batch_size=8, stride=1,
+                        render=True, cancel_file=None, weights=None):
+    """
+    Runs pipelined video/frame-sequence detection through the warm inference worker.
+
+    Args:
+        model (str): Model family (e.g., "yolov5").
+        training_run (str): Training run whose best.pt is used.
+        source (str): Video file or folder with frame images.
+        img_size (int): Inference image size.
+        conf (float): Confidence threshold.
+        iou (float): IoU threshold for NMS.
+        save_dir (str): Output folder (relative to the model folder) for frames.ndjson and the video.
+        batch_size (int): Frames per inference batch.
+        stride (int): Only every stride-th frame is processed.
+        render (bool): Write the annotated video.
+        cancel_file (str, optional): Absolute path whose creation stops the run.
+        weights (str, optional): Weights used instead of best.pt (e.g. the run's ONNX export).
+
+    Yields:
+        dict: Progress messages with per-stage fps and a final summary with "done".
+    """
+    payload = {
+        "op": "video",
+        "training_run": training_run,
+        "weights": weights or os.path.join("runs", "train", training_run, "weights", "best.pt"),
+        "source": source,
+        "img_size": int(img_size),
+        "conf": float(conf),
+        "iou": float(iou),
+        "save_dir": save_dir,
+        "batch_size": int(batch_size),
+        "stride": int(stride),
+        "render": render,
+        "cancel_file": cancel_file,
+    }
+    return get_worker(model).request(payload)
+
+
+def get_engine_status():
+    """Returns the model cache state of every running inference worker."""
+    status = {}
+    with _workers_lock:
+        workers = dict(_workers)
+    for model, worker in workers.items():
+        if worker.process is None or worker.process.poll() is not None:
+            status[model] = {"running": False}
+            continue
+        if worker.lock.locked():
+            status[model] = {"running": True, "busy": True}
+            continue
+        status[model] = {"running": True, **worker.call({"op": "stats"})["cache"]}
+    return status
@@ -0,0 +1,357 @@
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+
+from services.db import connect, ensure_schema
+from services.event_service import job_topic, publish
+from services.metrics_service import JOB_DURATION, JOB_QUEUE_WAIT, JOBS_LIMIT, JOBS_QUEUED, JOBS_RUNNING, \
+    registry as metrics_registry
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+# Stopped at a checkpoint, a new job continues the work (see training_service.resume_training_logic)
+PAUSED = "paused"
+ACTIVE_STATES = (QUEUED, RUNNING)
+
+# Maximum number of jobs of each kind that may run at the same time
+CONCURRENCY_LIMITS = {
+    "training": int(os.environ.get("JOBS_MAX_TRAINING", 1)),
+    "detection": int(os.environ.get("JOBS_MAX_DETECTION", 2)),
+    "validation": int(os.environ.get("JOBS_MAX_VALIDATION", 1)),
+    "export": int(os.environ.get("JOBS_MAX_EXPORT", 1)),
+    "quantization": int(os.environ.get("JOBS_MAX_QUANTIZATION", 1)),
+    # Upper bound over all sweeps, each sweep also keeps to its own parallelism
+    "sweep": int(os.environ.get("JOBS_MAX_SWEEP", os.cpu_count() or 1)),
+}
+DEFAULT_CONCURRENCY_LIMIT = 1
+
+JOBS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    state TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    params TEXT,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_kind_state ON jobs (kind, state);
+CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created_at);
+"""
+
+
+class JobCancelled(Exception):
+    """Raised by a job target when it notices that the job was cancelled."""
+
+
+class JobPaused(Exception):
+    """Raised by a job target after it stopped its work at a resumable checkpoint."""
+
+
+class Job:
+    """
+    A unit of background work (training, detection or validation run).
+
+    The target is called with the job itself, so it can attach the subprocess it
+    starts (to make the job cancellable) and store its result.
+    """
+
+    def __init__(self, kind, params, target, priority=0, topic=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.topic = topic
+        self.kind = kind
+        self.params = params or {}
+        self.target = target
+        self.priority = int(priority)
+        self.state = QUEUED
+        self.result = {}
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.process = None
+        self.cancel_requested = False
+        self.pause_requested = False
+        # Set by targets that can stop at a checkpoint, called with immediate=True|False
+        self.pause_handler = None
+
+    def attach_process(self, process):
+        """Registers the subprocess of the job; terminates it right away if the job was cancelled meanwhile."""
+        self.process = process
+        if self.cancel_requested:
+            process.terminate()
+
+    def check_cancelled(self):
+        if self.cancel_requested:
+            raise JobCancelled()
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "state": self.state,
+            "priority": self.priority,
+            "params": self.params,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobScheduler:
+    """
+    Runs jobs with a per-kind concurrency limit.
+
+    Jobs that cannot start right away wait in a priority queue per kind (higher
+    priority first, FIFO within the same priority). Every state change is written to
+    the persistent job table, so finished jobs stay visible after a restart.
+    """
+
+    def __init__(self, limits=None):
+        self.limits = dict(CONCURRENCY_LIMITS if limits is None else limits)
+        self.lock = threading.Lock()
+        self.queues = {}
+        self.running = {}
+        self.jobs = {}
+        self.sequence = itertools.count()
+        self.loaded = False
+
+    def _ensure_loaded(self):
+        if self.loaded:
+            return
+        ensure_schema("jobs", JOBS_SCHEMA)
+        # Jobs that were active when the previous server process ended can not be resumed
+        with connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET state = ?, error = ?, finished_at = ? WHERE state IN (?, ?)",
+                (FAILED, "Interrupted by server restart", time.time(), QUEUED, RUNNING)
+            )
+        self.loaded = True
+
+    def limit(self, kind):
+        return self.limits.get(kind, DEFAULT_CONCURRENCY_LIMIT)
+
+    def submit(self, kind, params, target, priority=0, topic=None):
+        """
+        Queues a new job and starts it as soon as a slot of its kind is free.
+
+        Args:
+            kind (str): Job kind (e.g., "training").
+            params (dict): JSON serializable parameters shown in the status API.
+            target (callable): Function called with the job; its return value becomes the job result.
+            priority (int, optional): Higher priority jobs start first. Defaults to 0.
+            topic (str, optional): Event topic (e.g., the run folder) that also receives the state events.
+
+        Returns:
+            Job: The submitted job.
+        """
+        job = Job(kind, params, target, priority, topic)
+        with self.lock:
+            self._ensure_loaded()
+            self.jobs[job.id] = job
+            self._persist(job)
+            heapq.heappush(self.queues.setdefault(kind, []), (-job.priority, next(self.sequence), job))
+            self._dispatch()
+        return job
+
+    def _dispatch(self):
+        # Must be called with self.lock held
+        for kind, queue in self.queues.items():
+            while queue and self.running.get(kind, 0) < self.limit(kind):
+                _, _, job = heapq.heappop(queue)
+                if job.state != QUEUED:
+                    continue
+                job.state = RUNNING
+                job.started_at = time.time()
+                JOB_QUEUE_WAIT.observe(job.started_at - job.created_at, kind=kind)
+                self.running[kind] = self.running.get(kind, 0) + 1
+                self._persist(job)
+                threading.Thread(target=self._run, args=(job,), daemon=True).start()
+
+    def _run(self, job):
+        try:
+            result = job.target(job)
+            if result:
+                job.result.update(result)
+            job.state = CANCELLED if job.cancel_requested else SUCCEEDED
+        except JobCancelled:
+            job.state = CANCELLED
+        except JobPaused:
+            job.state = CANCELLED if job.cancel_requested else PAUSED
+        except Exception as e:
+            if job.cancel_requested:
+                job.state = CANCELLED
+            else:
+                traceback.print_exc()
+                job.state = FAILED
+                job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            job.process = None
+            job.pause_handler = None
+            JOB_DURATION.observe(job.finished_at - job.started_at, kind=job.kind, state=job.state)
+            with self.lock:
+                self.running[job.kind] -= 1
+                self._persist(job)
+                # Finished jobs are served from the job table from now on
+                self.jobs.pop(job.id, None)
+                self._dispatch()
+
+    def cancel(self, job_id):
+        """
+        Cancels a queued job or terminates a running one.
+
+        Raises:
+            Exception: If the job does not exist or is already finished.
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.state not in ACTIVE_STATES:
+                raise Exception(f"No active job with id {job_id}")
+            job.cancel_requested = True
+            if job.state == QUEUED:
+                job.state = CANCELLED
+                job.finished_at = time.time()
+                self._persist(job)
+                self.jobs.pop(job.id, None)
+            elif job.process is not None:
+                job.process.terminate()
+        return job.to_dict()
+
+    def pause(self, job_id, immediate=False):
+        """
+        Asks a running job to stop at its next checkpoint. The job ends in the paused
+        state, which frees its slot for other jobs.
+
+        Raises:
+            Exception: If the job is not running or can not be paused.
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.state != RUNNING:
+                raise Exception(f"No running job with id {job_id}")
+            if job.pause_handler is None:
+                raise Exception(f"Job {job_id} can not be paused")
+            handler = job.pause_handler
+            already_requested = job.pause_requested
+            job.pause_requested = True
+            job.result["pausing"] = True
+        if not already_requested or immediate:
+            handler(immediate)
+        return job.to_dict()
+
+    def get(self, job_id):
+        """Returns the job as a dict, looking into the job table for jobs of earlier server runs."""
+        job = self.jobs.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        with self.lock:
+            self._ensure_loaded()
+        with connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _row_to_dict(row) if row else None
+
+    def active_jobs(self, kind=None):
+        """Returns the in-memory Job objects that are queued or running, newest first."""
+        jobs = [job for job in self.jobs.values()
+                if job.state in ACTIVE_STATES and (kind is None or job.kind == kind)]
+        return sorted(jobs, key=lambda j: j.created_at, reverse=True)
+
+    def list_jobs(self, kind=None, state=None, limit=100):
+        with self.lock:
+            self._ensure_loaded()
+        query = "SELECT * FROM jobs"
+        conditions, args = [], []
+        if kind:
+            conditions.append("kind = ?")
+            args.append(kind)
+        if state:
+            conditions.append("state = ?")
+            args.append(state)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        args.append(int(limit))
+        with connect() as conn:
+            rows = conn.execute(query, args).fetchall()
+        return [_row_to_dict(row) for row in rows]
+
+    def find_job(self, kind, **params):
+        """Returns the newest job of a kind whose params contain the given values, None if there is none."""
+        with self.lock:
+            self._ensure_loaded()
+        query = "SELECT * FROM jobs WHERE kind = ?"
+        args = [kind]
+        for key, value in params.items():
+            query += f" AND json_extract(params, '$.{key}') = ?"
+            args.append(value)
+        query += " ORDER BY created_at DESC LIMIT 1"
+        with connect() as conn:
+            row = conn.execute(query, args).fetchone()
+        return _row_to_dict(row) if row else None
+
+    def stats(self):
+        with self.lock:
+            kinds = set(self.limits) | set(self.queues) | set(self.running)
+            return {
+                kind: {
+                    "limit": self.limit(kind),
+                    "running": self.running.get(kind, 0),
+                    "queued": sum(1 for _, _, job in self.queues.get(kind, []) if job.state == QUEUED),
+                }
+                for kind in sorted(kinds)
+            }
+
+    def _persist(self, job):
+        self._announce(job)
+        with connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO jobs (id, kind, state, priority, params, result, error, "
+                "created_at, started_at, finished_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job.id, job.kind, job.state, job.priority, json.dumps(job.params), json.dumps(job.result),
+                 job.error, job.created_at, job.started_at, job.finished_at)
+            )
+
+
+    def _announce(self, job):
+        # Job state changes are published as events, finished jobs as "completed"
+        event_type = "state" if job.state in ACTIVE_STATES else "completed"
+        for topic in filter(None, (job_topic(job.id), job.topic)):
+            publish(topic, event_type, job_id=job.id, kind=job.kind, state=job.state, error=job.error)
+
+
+def _row_to_dict(row):
+    job = dict(row)
+    job["params"] = json.loads(job["params"]) if job["params"] else {}
+    job["result"] = json.loads(job["result"]) if job["result"] else {}
+    return job
+
+
+scheduler = JobScheduler()
+
+
+def _collect_queue_metrics():
+    for kind, stats in scheduler.stats().items():
+        JOBS_RUNNING.set(stats["running"], kind=kind)
+        JOBS_QUEUED.set(stats["queued"], kind=kind)
+        JOBS_LIMIT.set(stats["limit"], kind=kind)
+
+
+metrics_registry.add_collector(_collect_queue_metrics)
+
+
+def submit_job(kind, params, target, priority=0, topic=None):
+    return scheduler.submit(kind, params, target, priority, topic)
@@ -0,0 +1,279 @@
+import gzip
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+
+from services.db import DATA_DIR
+from services.job_service import ACTIVE_STATES, scheduler
+from services.server_service import HEARTBEAT_SECONDS, RETRY_MILLISECONDS
+
+LOG_DIR = os.path.join(DATA_DIR, "logs")
+
+# Lines and bytes kept in memory per job, older lines are only read back from the archive
+MAX_BUFFERED_LINES = int(os.environ.get("LOG_MAX_BUFFERED_LINES", 2000))
+MAX_BUFFERED_BYTES = int(os.environ.get("LOG_MAX_BUFFERED_BYTES", 1024 ** 2))
+# Lines dropped from memory at once
+SPILL_BATCH = 500
+# Seconds between two flushes of the archive, which make its new lines readable
+ARCHIVE_FLUSH_INTERVAL = 2.0
+# Finished broadcasts kept in memory for late or reconnecting subscribers
+MAX_FINISHED_BROADCASTS = 20
+
+
+def count_lines(path):
+    """Number of complete lines in a gzip log, 0 if it does not exist."""
+    count = 0
+    try:
+        with gzip.open(path, "rt", encoding="utf-8", errors="replace") as f:
+            for count, _ in enumerate(f, 1):
+                pass
+    except FileNotFoundError:
+        pass
+    except EOFError:
+        # The archive of a running job has no end marker yet
+        pass
+    return count
+
+
+class LogBroadcast:
+    """
+    Log of one job that any number of subscribers can follow.
+
+    Every line gets a monotonically increasing offset (starting at 0) and is written
+    through to a gzip archive (data/logs/<job_id>.log.gz, or the run's output.log.gz).
+    The newest lines are also kept in a ring buffer; when it exceeds its line or byte
+    cap, the oldest lines are dropped from memory and read back from the archive, so
+    subscribers can still resume from any offset while memory stays bounded even if
+    nobody is listening.
+
+    An archive may already hold the log of an earlier job (a resumed training appends
+    to the log of its run); line 0 of this job is line first_line of the archive.
+    """
+
+    def __init__(self, job_id, kind, archive_path=None, first_line=None):
+        self.job_id = job_id
+        self.kind = kind
+        self.condition = threading.Condition()
+        self.buffer = deque()
+        self.buffered_bytes = 0
+        self.first_buffered = 0
+        self.next_offset = 0
+        self.closed = False
+        self.archive_path = archive_path or os.path.join(LOG_DIR, f"{job_id}.log.gz")
+        self.first_line = count_lines(self.archive_path) if first_line is None else first_line
+        self.archive = None
+        self.flushed_at = time.monotonic()
+
+    def append(self, text):
+        """Appends text (possibly several lines) and wakes up the subscribers."""
+        lines = text.splitlines()
+        if not lines:
+            return
+        with self.condition:
+            if self.archive is None:
+                os.makedirs(os.path.dirname(self.archive_path), exist_ok=True)
+                self.archive = gzip.open(self.archive_path, "ab")
+            self.archive.write(("\n".join(lines) + "\n").encode("utf-8"))
+            for line in lines:
+                self.buffer.append(line)
+                self.buffered_bytes += len(line)
+                self.next_offset += 1
+            if len(self.buffer) > MAX_BUFFERED_LINES or self.buffered_bytes > MAX_BUFFERED_BYTES:
+                self._spill()
+            elif time.monotonic() - self.flushed_at >= ARCHIVE_FLUSH_INTERVAL:
+                self._flush()
+            self.condition.notify_all()
+
+    def _flush(self):
+        # Must be called with self.condition held
+        self.archive.flush(zlib.Z_SYNC_FLUSH)
+        self.flushed_at = time.monotonic()
+
+    def _spill(self):
+        # Must be called with self.condition held; the dropped lines have to be readable from the archive
+        count = min(len(self.buffer) - 1, max(SPILL_BATCH, len(self.buffer) - MAX_BUFFERED_LINES))
+        if count <= 0:
+            return
+        self._flush()
+        for _ in range(count):
+            self.buffered_bytes -= len(self.buffer.popleft())
+        self.first_buffered += count
+
+    def close(self):
+        """Marks the log as finished and completes its archive."""
+        with self.condition:
+            if self.archive is not None:
+                self.archive.close()
+                self.archive = None
+            self.closed = True
+            self.condition.notify_all()
+
+    def _read_spilled(self, start, stop):
+        lines = []
+        start, stop = self.first_line + start, self.first_line + stop
+        try:
+            with gzip.open(self.archive_path, "rt", encoding="utf-8", errors="replace") as f:
+                for offset, line in enumerate(f):
+                    if offset >= stop:
+                        break
+                    if offset >= start:
+                        lines.append((offset - self.first_line, line.rstrip("\n")))
+        except (FileNotFoundError, EOFError):
+            pass
+        return lines
+
+    def read(self, start, timeout=None):
+        """
+        Returns (offset, line) pairs from offset start on, waiting up to timeout seconds
+        for new lines. Returns an empty list on timeout or when the log is closed and
+        fully read.
+        """
+        with self.condition:
+            if start >= self.next_offset and not self.closed:
+                self.condition.wait(timeout)
+            first_buffered = self.first_buffered
+            buffered = [(first_buffered + i, line) for i, line in enumerate(self.buffer)
+                        if first_buffered + i >= start]
+        if start < first_buffered:
+            return self._read_spilled(start, first_buffered) + buffered
+        return buffered
+
+    @property
+    def finished(self):
+        with self.condition:
+            return self.closed
+
+
+class LogRegistry:
+    """Keeps the log broadcasts of active jobs and of the most recently finished ones."""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.broadcasts = OrderedDict()
+
+    def create(self, job_id, kind, archive_path=None):
+        broadcast = LogBroadcast(job_id, kind, archive_path)
+        with self.condition:
+            self.broadcasts[job_id] = broadcast
+            finished = [key for key, b in self.broadcasts.items() if b.finished]
+            for key in finished[:max(0, len(finished) - MAX_FINISHED_BROADCASTS)]:
+                del self.broadcasts[key]
+            self.condition.notify_all()
+        return broadcast
+
+    def get(self, job_id, timeout=0):
+        """Returns the broadcast of a job, waiting up to timeout seconds for the job to start."""
+        with self.condition:
+            self.condition.wait_for(lambda: job_id in self.broadcasts, timeout)
+            return self.broadcasts.get(job_id)
+
+    def latest(self, kind, newer_than=None, timeout=None):
+        """
+        Returns the newest broadcast of a job kind. With newer_than, waits up to timeout
+        seconds for a broadcast created after that one.
+        """
+        with self.condition:
+            while True:
+                candidates = [b for b in self.broadcasts.values() if b.kind == kind]
+                newest = candidates[-1] if candidates else None
+                if newest is not None and newest is not newer_than:
+                    return newest
+                if not self.condition.wait(timeout):
+                    return None
+
+
+registry = LogRegistry()
+
+
+def archived_log(job_id, kind):
+    """
+    Returns a closed broadcast that replays the archive of a finished job whose broadcast
+    is no longer in memory (evicted or from an earlier server run). Returns None while
+    the job is queued or running, its broadcast may still be created.
+    """
+    job = scheduler.get(job_id)
+    if job is not None and job["state"] in ACTIVE_STATES:
+        return None
+    # Jobs record where their lines are in a shared archive (see log_info)
+    info = (job or {}).get("result", {}).get("log") or {}
+    broadcast = LogBroadcast(job_id, kind, info.get("path"), info.get("first_line", 0))
+    lines = info.get("lines")
+    if lines is None:
+        lines = count_lines(broadcast.archive_path) - broadcast.first_line
+    broadcast.first_buffered = broadcast.next_offset = max(0, lines)
+    broadcast.closed = True
+    return broadcast
+
+
+def create_log(job_id, kind, archive_path=None):
+    """Creates the log broadcast of a job, archived to archive_path (data/logs/<job_id>.log.gz by default)."""
+    return registry.create(job_id, kind, archive_path)
+
+
+def log_info(broadcast):
+    """Location of a job's lines in its archive, stored in the job result for archived_log."""
+    return {"path": broadcast.archive_path, "first_line": broadcast.first_line, "lines": broadcast.next_offset}
+
+
+def parse_event_id(event_id):
+    """Splits an SSE event id "<job_id>:<offset>" into its parts, (None, -1) if it is missing or malformed."""
+    if not event_id or ":" not in event_id:
+        return None, -1
+    job_id, offset = event_id.rsplit(":", 1)
+    return job_id, int(offset) if offset.isdigit() else -1
+
+
+def follow_log(kind, job_id=None, last_event_id=None, heartbeat=HEARTBEAT_SECONDS):
+    """
+    Yields SSE messages with the log lines of a job.
+
+    With job_id the stream follows that job (waiting while it is queued) and ends
+    with its log. Without it the
+    stream follows the newest job of the kind and moves on to the next job when one
+    is started. A client that reconnects with Last-Event-ID continues after the
+    last line it received; otherwise a running job is replayed from its start.
+    """
+    resume_job, resume_offset = parse_event_id(last_event_id)
+    yield f"retry: {RETRY_MILLISECONDS}\n\n"
+    broadcast = (registry.get(job_id) or archived_log(job_id, kind)) if job_id else registry.latest(kind, timeout=0)
+
+    first = True
+    while True:
+        if broadcast is None:
+            if job_id:
+                broadcast = registry.get(job_id, timeout=heartbeat) or archived_log(job_id, kind)
+            else:
+                broadcast = registry.latest(kind, timeout=heartbeat)
+            if broadcast is None:
+                yield ": keep-alive\n\n"
+                continue
+
+        if broadcast.job_id == resume_job:
+            offset = resume_offset + 1
+        elif first and not job_id and broadcast.finished:
+            # Do not replay an old, finished log to a freshly opened page
+            offset = broadcast.next_offset
+        else:
+            offset = 0
+        first = False
+
+        while True:
+            lines = broadcast.read(offset, heartbeat)
+            for line_offset, line in lines:
+                yield f"id: {broadcast.job_id}:{line_offset}\ndata: {line}\n\n"
+                offset = line_offset + 1
+            if not lines:
+                if broadcast.finished and offset >= broadcast.next_offset:
+                    break
+                yield ": keep-alive\n\n"
+
+        if job_id:
+            return
+        previous = broadcast
+        broadcast = None
+        while broadcast is None:
+            broadcast = registry.latest(kind, newer_than=previous, timeout=heartbeat)
+            if broadcast is None:
+                yield ": keep-alive\n\n"
@@ -0,0 +1,264 @@
+import cProfile
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, request
+
+from services.db import DATA_DIR
+
+# Set REQUEST_PROFILING=1 to allow profiling single requests with the X-Profile header
+PROFILING_ENABLED = os.environ.get("REQUEST_PROFILING", "0") == "1"
+PROFILE_HEADER = "X-Profile"
+PROFILE_DIR = os.path.join(DATA_DIR, "profiles")
+# Only one request is profiled at a time, cProfile can not tell apart greenlets sharing a thread
+_profile_lock = threading.Lock()
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Jobs and subprocesses run from seconds (detection) to days (training)
+JOB_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 7200, 21600, 86400)
+STARTUP_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+SCAN_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    """One counter, gauge or histogram with its samples per label combination."""
+
+    def __init__(self, name, kind, help_text, label_names=(), buckets=None):
+        self.name = name
+        self.kind = kind
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets) if buckets else None
+        self.lock = threading.Lock()
+        # Label values -> value; histograms keep [bucket counts..., sum, count]
+        self.samples = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def inc(self, value=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.samples[key] = self.samples.get(key, 0) + value
+
+    def dec(self, value=1, **labels):
+        self.inc(-value, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.samples[key] = value
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            sample = self.samples.get(key)
+            if sample is None:
+                sample = self.samples[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    sample[i] += 1
+                    break
+            sample[-2] += value
+            sample[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the duration of a with block."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            samples = sorted((key, list(value) if isinstance(value, list) else value)
+                             for key, value in self.samples.items())
+        for key, value in samples:
+            if self.kind != "histogram":
+                lines.append(f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(self.buckets, value[:-2]):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {value[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(value[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {value[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Process-wide metrics in the Prometheus text exposition format.
+
+    Counters and histograms are updated where the work happens. Values that already
+    exist elsewhere (queue depths of the scheduler) are read by collectors right
+    before rendering instead of being kept up to date on every change.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.collectors = []
+
+    def _register(self, name, kind, help_text, label_names, buckets=None):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = Metric(name, kind, help_text, label_names, buckets)
+            return metric
+
+    def counter(self, name, help_text, label_names=()):
+        return self._register(name, "counter", help_text, label_names)
+
+    def gauge(self, name, help_text, label_names=()):
+        return self._register(name, "gauge", help_text, label_names)
+
+    def histogram(self, name, help_text, label_names=(), buckets=REQUEST_BUCKETS):
+        return self._register(name, "histogram", help_text, label_names, buckets)
+
+    def add_collector(self, collector):
+        """Registers a callable that updates gauges right before the metrics are rendered."""
+        with self.lock:
+            self.collectors.append(collector)
+
+    def render(self):
+        with self.lock:
+            collectors = list(self.collectors)
+            metrics = list(self.metrics.values())
+        for collector in collectors:
+            try:
+                collector()
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+REQUEST_DURATION = registry.histogram(
+    "http_request_duration_seconds", "Time until the response of a request was returned (streams: until the stream started).",
+    ("method", "route", "status"))
+REQUESTS_IN_PROGRESS = registry.gauge("http_requests_in_progress", "Requests being handled.")
+JOB_DURATION = registry.histogram(
+    "job_duration_seconds", "Run time of finished jobs.", ("kind", "state"), JOB_BUCKETS)
+JOB_QUEUE_WAIT = registry.histogram(
+    "job_queue_wait_seconds", "Time jobs waited in the queue before they started.", ("kind",), JOB_BUCKETS)
+JOBS_RUNNING = registry.gauge("jobs_running", "Running jobs.", ("kind",))
+JOBS_QUEUED = registry.gauge("jobs_queued", "Jobs waiting for a free slot.", ("kind",))
+JOBS_LIMIT = registry.gauge("jobs_concurrency_limit", "Jobs of a kind that may run at the same time.", ("kind",))
+SUBPROCESS_FIRST_OUTPUT = registry.histogram(
+    "subprocess_first_output_seconds", "Time from spawning a subprocess to its first output line.",
+    ("kind",), STARTUP_BUCKETS)
+SUBPROCESS_DURATION = registry.histogram(
+    "subprocess_duration_seconds", "Run time of subprocesses.", ("kind",), JOB_BUCKETS)
+SUBPROCESS_OUTPUT_LINES = registry.counter(
+    "subprocess_output_lines_total", "Output lines read from subprocesses.", ("kind",))
+SSE_SUBSCRIBERS = registry.gauge("sse_subscribers", "Open event and log streams.", ("stream",))
+FILESYSTEM_SCAN = registry.histogram(
+    "filesystem_scan_duration_seconds", "Time spent listing run and dataset folders.", ("scan",), SCAN_BUCKETS)
+
+
+class ProcessMeter:
+    """
+    Measures one subprocess of a job kind: spawn to first output line, output lines
+    and total run time. Create it right before spawning, call line() for every output
+    line (or line(count) for several) and finish() once the process ended.
+    """
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.started = time.perf_counter()
+        self.first_output = None
+
+    def line(self, count=1):
+        if self.first_output is None:
+            self.first_output = time.perf_counter()
+            SUBPROCESS_FIRST_OUTPUT.observe(self.first_output - self.started, kind=self.kind)
+        SUBPROCESS_OUTPUT_LINES.inc(count, kind=self.kind)
+
+    def finish(self):
+        SUBPROCESS_DURATION.observe(time.perf_counter() - self.started, kind=self.kind)
+
+
+def track_stream(stream, iterable):
+    """Passes a streaming response body through while counting it as an open subscriber."""
+    SSE_SUBSCRIBERS.inc(stream=stream)
+    try:
+        yield from iterable
+    finally:
+        SSE_SUBSCRIBERS.dec(stream=stream)
+
+
+def render_metrics():
+    return registry.render()
+
+
+def init_app(app):
+    """Records the latency of every request and, if enabled, profiles requests sent with X-Profile."""
+
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+        REQUESTS_IN_PROGRESS.inc()
+        if PROFILING_ENABLED and request.headers.get(PROFILE_HEADER) and _profile_lock.acquire(blocking=False):
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    @app.after_request
+    def record_request(response):
+        profiler = g.pop("profiler", None)
+        if profiler is not None:
+            try:
+                profiler.disable()
+                os.makedirs(PROFILE_DIR, exist_ok=True)
+                endpoint = (request.endpoint or "unmatched").replace(".", "_")
+                filename = f"{time.strftime('%Y%m%d_%H%M%S')}_{endpoint}_{os.getpid()}_{threading.get_ident()}.prof"
+                profiler.dump_stats(os.path.join(PROFILE_DIR, filename))
+                response.headers["X-Profile-File"] = filename
+            finally:
+                _profile_lock.release()
+
+        started = g.pop("request_started", None)
+        if started is not None:
+            REQUESTS_IN_PROGRESS.dec()
+            # The URL rule keeps the label set small (no experiment names or file names)
+            route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+            REQUEST_DURATION.observe(time.perf_counter() - started, method=request.method, route=route,
+                                     status=response.status_code)
+        return response
+
+    @app.teardown_request
+    def stop_profiler(exception=None):
+        # after_request is skipped when a request fails, the profiler still has to be stopped
+        profiler = g.pop("profiler", None)
+        if profiler is not None:
+            profiler.disable()
+            _profile_lock.release()
@@ -0,0 +1,194 @@
+import codecs
+import gzip
+import os
+import re
+import sys
+import time
+import zlib
+from collections import deque
+from itertools import islice
+
+from services.artifact_service import artifact_dir
+
+# Complete output of a run's script, written into the run folder
+RUN_LOG_FILE = "output.log.gz"
+# Bytes read from a subprocess at once
+READ_SIZE = 64 * 1024
+# Minimum seconds between two forwarded progress bar states of the unfinished line
+PROGRESS_INTERVAL = float(os.environ.get("OUTPUT_PROGRESS_INTERVAL", 0.5))
+# Seconds between two flushes of the gzip log, which make its new lines readable
+LOG_FLUSH_INTERVAL = 2.0
+# Whether the forwarded output is also written to the server's stdout
+ECHO_OUTPUT = os.environ.get("JOB_OUTPUT_ECHO", "1") != "0"
+MAX_LOG_LINES = 10000
+
+ANSI_ESCAPE_PATTERN = re.compile(r'\x1B\[[0-?]*[ -/]*[@-~]')
+# Start of an escape sequence whose rest has not been read yet
+PARTIAL_ESCAPE_PATTERN = re.compile(r'\x1B(\[[0-?]*[ -/]*)?$')
+
+
+def collapse(line):
+    """Returns what a terminal shows for a line with carriage return redraws: the text after the last \\r."""
+    return line.rstrip("\r").rsplit("\r", 1)[-1]
+
+
+def run_log_path(run_dir):
+    return os.path.join(run_dir, RUN_LOG_FILE) if run_dir else None
+
+
+class OutputPump:
+    """
+    Reads the output of a job's subprocess and hands it on in coalesced form.
+
+    The pipe is read in chunks of up to READ_SIZE bytes as they become available (read1,
+    cooperative under gevent), instead of one readline per line. Carriage return redraws
+    (tqdm progress bars) are collapsed to the state a terminal would show: finished lines
+    are forwarded once per chunk, the state of the unfinished line at most every
+    PROGRESS_INTERVAL seconds; a line that finishes in the state already forwarded is
+    not forwarded again. Finished lines are also appended to a gzip log (the
+    run's output.log.gz), which stays readable while it is written.
+
+    Args:
+        stream: Binary stdout of the subprocess (stderr redirected into it).
+        meter (ProcessMeter, optional): Counts the finished lines.
+        on_output (callable, optional): Called with one or more "\\n" terminated lines.
+        log_path (str, optional): Gzip log the finished lines are appended to.
+    """
+
+    def __init__(self, stream, meter=None, on_output=None, log_path=None, interval=PROGRESS_INTERVAL,
+                 echo=ECHO_OUTPUT):
+        self.stream = stream
+        self.meter = meter
+        self.on_output = on_output
+        self.log_path = log_path
+        self.interval = interval
+        self.echo = echo
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.partial = ""
+        self.progress = None
+        self.progress_at = 0.0
+        self.flushed_at = time.monotonic()
+        self.lines = 0
+
+    def run(self):
+        """Pumps until the subprocess closes its output, returns the number of finished lines."""
+        read = getattr(self.stream, "read1", self.stream.read)
+        log = gzip.open(self.log_path, "ab") if self.log_path else None
+        try:
+            while True:
+                chunk = read(READ_SIZE)
+                if not chunk:
+                    break
+                self._feed(self.decoder.decode(chunk), log)
+            rest = self.decoder.decode(b"", final=True)
+            if rest or self.partial:
+                self._feed(rest + "\n", log)
+        finally:
+            self.stream.close()
+            if log is not None:
+                log.close()
+        return self.lines
+
+    def _feed(self, text, log):
+        parts = (self.partial + text).split("\n")
+        # Only the terminal state of the unfinished line is needed, drop its older redraws
+        self.partial = parts.pop()
+        if "\r" in self.partial:
+            # The leading \r keeps it marked as a redrawn line
+            self.partial = "\r" + collapse(self.partial) + ("\r" if self.partial.endswith("\r") else "")
+        finished = [ANSI_ESCAPE_PATTERN.sub("", collapse(line)) for line in parts]
+
+        output = ""
+        now = time.monotonic()
+        if finished:
+            # The first finished line is the unfinished one of the previous chunk
+            forwarded = finished[1:] if finished[0] == self.progress else finished
+            if forwarded:
+                output = "\n".join(forwarded) + "\n"
+            self.lines += len(finished)
+            if self.meter is not None:
+                self.meter.line(len(finished))
+            if log is not None:
+                log.write(("\n".join(finished) + "\n").encode("utf-8"))
+                if now - self.flushed_at >= LOG_FLUSH_INTERVAL:
+                    # Makes everything written so far readable before the log is closed
+                    log.flush(zlib.Z_SYNC_FLUSH)
+                    self.flushed_at = now
+            self.progress = None
+
+        # Only redrawn lines (progress bars) are shown before they finish, a line that was
+        # merely split between two reads waits for its end
+        state = ""
+        if "\r" in self.partial:
+            state = PARTIAL_ESCAPE_PATTERN.sub("", ANSI_ESCAPE_PATTERN.sub("", collapse(self.partial)))
+        if state and state != self.progress and now - self.progress_at >= self.interval:
+            self.progress = state
+            self.progress_at = now
+            output += state + "\n"
+        if output:
+            self._forward(output)
+
+    def _forward(self, output):
+        if self.on_output is not None:
+            self.on_output(output)
+        if self.echo:
+            sys.stdout.write(output)
+            sys.stdout.flush()
+
+
+def pump_output(process, meter=None, on_output=None, log_path=None):
+    """Pumps the output of a subprocess (see OutputPump), then waits for it and returns its exit code."""
+    OutputPump(process.stdout, meter, on_output, log_path).run()
+    process.wait()
+    if meter is not None:
+        meter.finish()
+    return process.returncode
+
+
+def _log_lines(path):
+    try:
+        with gzip.open(path, "rt", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                yield line.rstrip("\n")
+    except EOFError:
+        # The log of a running job has no end marker yet, its flushed part is complete lines
+        return
+
+
+def read_run_log(model, kind, experiment, offset=0, limit=1000, tail=None):
+    """
+    Returns a range of lines of a run's output log. The log is decompressed as a stream,
+    up to the requested range (to its end for tail requests).
+
+    Args:
+        model (str): Model name (e.g., "yolov5").
+        kind (str): "train", "detect" or "val".
+        experiment (str): Run folder name.
+        offset (int): First line (0-based).
+        limit (int): Maximum number of lines (at most MAX_LOG_LINES).
+        tail (int, optional): Return the last tail lines instead of offset/limit.
+
+    Returns:
+        dict: lines, offset of the first returned line, next_offset and end (no lines follow).
+
+    Raises:
+        FileNotFoundError: If the run or its log does not exist.
+    """
+    path = run_log_path(artifact_dir(model, kind, experiment))
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Run {model}/{kind}/{experiment} has no output log")
+    if tail is not None:
+        tail = max(1, min(int(tail), MAX_LOG_LINES))
+        total = 0
+        lines = deque(maxlen=tail)
+        for total, line in enumerate(_log_lines(path), 1):
+            lines.append(line)
+        lines, offset, end = list(lines), total - len(lines), True
+    else:
+        limit = max(1, min(int(limit), MAX_LOG_LINES))
+        offset = max(0, int(offset))
+        lines = list(islice(_log_lines(path), offset, offset + limit + 1))
+        end = len(lines) <= limit
+        lines = lines[:limit]
+    return {"model": model, "kind": kind, "experiment": experiment, "offset": offset, "lines": lines,
+            "next_offset": offset + len(lines), "end": end}
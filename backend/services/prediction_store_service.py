@@ -0,0 +1,357 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from services.evaluation_service import Evaluator, read_label_file, run_context, xywh_to_xyxy
+from services.dataset_service import label_path_for, list_dataset_images
+
+STORE_DIR = "predictions"
+# Confidence down to which detections of the inference server are kept in the store
+STORE_CONF = float(os.environ.get("PREDICTION_STORE_CONF", 0.001))
+MAX_DETECTIONS = 300
+# Box pairs compared at once by batched_nms, bounds its memory independent of the number of images
+NMS_PAIR_CHUNK = int(os.environ.get("PREDICTION_STORE_NMS_PAIRS", 4_000_000))
+
+# Ground truth of the last evaluated datasets, so threshold sweeps with metrics do not re-read the labels
+MAX_CACHED_GROUND_TRUTH = 4
+
+_build_lock = threading.Lock()
+_ground_truth = OrderedDict()
+_ground_truth_lock = threading.Lock()
+
+
+def _store_dir(run_dir):
+    return os.path.join(run_dir, STORE_DIR)
+
+
+def _image_key(relative):
+    """Store key of an image or label file: its path relative to the dataset or labels folder, without extension."""
+    return os.path.splitext(relative)[0].replace(os.sep, "/")
+
+
+def _label_names(labels_dir):
+    names = []
+    for root, _, files in os.walk(labels_dir):
+        names += [os.path.relpath(os.path.join(root, name), labels_dir) for name in files if name.endswith(".txt")]
+    return sorted(names)
+
+
+def build_store(run_dir, capture=None):
+    """
+    Converts the prediction files of a run (labels/*.txt) into the columnar store.
+
+    The store in <run>/predictions holds one row per detection in boxes.npy (float32
+    normalized xywh), scores.npy (float32) and classes.npy (int16), sorted by image;
+    offsets.npy gives the first row of every image in images.json. Images are keyed by
+    the path of their label file relative to the labels folder (without .txt), so images
+    of different folders with the same file name stay apart. All arrays can be
+    memory-mapped, so queries do not parse any text.
+
+    Args:
+        run_dir (str): Run folder with the labels folder.
+        capture (dict, optional): Thresholds the predictions were made with (conf, iou).
+
+    Returns:
+        dict: The store metadata.
+    """
+    labels_dir = os.path.join(run_dir, "labels")
+    if not os.path.isdir(labels_dir):
+        raise Exception(f"No stored predictions in {run_dir}")
+    started = time.perf_counter()
+    names = _label_names(labels_dir)
+    arrays = [read_label_file(os.path.join(labels_dir, name), 6) for name in names]
+    predictions = np.concatenate(arrays) if arrays else np.zeros((0, 6))
+    offsets = np.concatenate(([0], np.cumsum([len(a) for a in arrays]))).astype(np.int64)
+
+    store_dir = _store_dir(run_dir)
+    tmp_dir = f"{store_dir}.{threading.get_ident()}.tmp"
+    os.makedirs(tmp_dir, exist_ok=True)
+    np.save(os.path.join(tmp_dir, "boxes.npy"), predictions[:, 1:5].astype(np.float32))
+    np.save(os.path.join(tmp_dir, "scores.npy"), predictions[:, 5].astype(np.float32))
+    np.save(os.path.join(tmp_dir, "classes.npy"), predictions[:, 0].astype(np.int16))
+    np.save(os.path.join(tmp_dir, "offsets.npy"), offsets)
+    meta = {
+        "images": [_image_key(name) for name in names],
+        "detections": int(len(predictions)),
+        "capture": capture or {},
+        "labels_mtime": os.stat(labels_dir).st_mtime,
+        "created": time.time(),
+        "build_seconds": round(time.perf_counter() - started, 3),
+    }
+    with open(os.path.join(tmp_dir, "images.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, separators=(",", ":"))
+
+    with _build_lock:
+        if os.path.isdir(store_dir):
+            for name in os.listdir(store_dir):
+                os.remove(os.path.join(store_dir, name))
+            os.rmdir(store_dir)
+        os.replace(tmp_dir, store_dir)
+    return meta
+
+
+def load_store(run_dir):
+    """
+    Returns the memory-mapped store of a run, building it first if it is missing or
+    older than the prediction files.
+    """
+    store_dir = _store_dir(run_dir)
+    meta_path = os.path.join(store_dir, "images.json")
+    labels_dir = os.path.join(run_dir, "labels")
+    meta = None
+    if os.path.exists(meta_path):
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if os.path.isdir(labels_dir) and os.stat(labels_dir).st_mtime != meta["labels_mtime"]:
+            meta = build_store(run_dir, meta.get("capture"))
+    else:
+        meta = build_store(run_dir)
+
+    return {
+        "meta": meta,
+        "boxes": np.load(os.path.join(store_dir, "boxes.npy"), mmap_mode="r"),
+        "scores": np.load(os.path.join(store_dir, "scores.npy"), mmap_mode="r"),
+        "classes": np.load(os.path.join(store_dir, "classes.npy"), mmap_mode="r"),
+        "offsets": np.load(os.path.join(store_dir, "offsets.npy")),
+    }
+
+
+def _overlapping_pairs(boxes, sizes, iou_threshold):
+    """Pairs (i, j), i before j, of consecutive groups of the given sizes whose IoU exceeds iou_threshold."""
+    # Every box paired with all later (lower-scored) boxes of its group
+    starts = np.cumsum(sizes) - sizes
+    rank = np.arange(len(boxes)) - np.repeat(starts, sizes)
+    later = np.repeat(sizes, sizes) - rank - 1
+    first = np.repeat(np.arange(len(boxes)), later)
+    second = first + np.arange(len(first)) - np.repeat(np.cumsum(later) - later, later) + 1
+
+    top_left = np.maximum(boxes[first, :2], boxes[second, :2])
+    bottom_right = np.minimum(boxes[first, 2:], boxes[second, 2:])
+    inter = np.clip(bottom_right - top_left, 0, None).prod(axis=1)
+    areas = (boxes[:, 2:] - boxes[:, :2]).prod(axis=1)
+    overlapping = inter / (areas[first] + areas[second] - inter + 1e-16) > iou_threshold
+    return first[overlapping], second[overlapping]
+
+
+def batched_nms(boxes, scores, groups, iou_threshold):
+    """
+    Exact greedy NMS of many groups (e.g. image and class) at once.
+
+    Candidate pairs are only formed inside a group, for consecutive groups with up to
+    NMS_PAIR_CHUNK pairs at a time, so memory grows with the largest group rather than
+    with the whole run. Instead of a loop over boxes, "kept" is iterated as a fixpoint:
+    a box is kept if no kept, higher-scored box of its group overlaps it by more than
+    iou_threshold. Every iteration settles at least one more level of the suppression
+    chains, which are short in practice.
+
+    Returns:
+        ndarray: Indexes of the kept boxes.
+    """
+    if not len(boxes):
+        return np.zeros(0, dtype=np.int64)
+    order = np.lexsort((-scores, groups))
+    boxes, groups = xywh_to_xyxy(boxes[order].astype(np.float64)), groups[order]
+
+    _, starts, sizes = np.unique(groups, return_index=True, return_counts=True)
+    pairs = sizes * (sizes - 1) // 2
+    chunks = (np.cumsum(pairs) - pairs) // NMS_PAIR_CHUNK
+    # Groups are consecutive, so are the groups of a chunk
+    bounds = np.append(np.unique(chunks, return_index=True)[1], len(sizes))
+    firsts, seconds = [], []
+    for low, high in zip(bounds[:-1], bounds[1:]):
+        begin, end = starts[low], starts[high - 1] + sizes[high - 1]
+        first, second = _overlapping_pairs(boxes[begin:end], sizes[low:high], iou_threshold)
+        firsts.append(first + begin)
+        seconds.append(second + begin)
+    first, second = np.concatenate(firsts), np.concatenate(seconds)
+
+    keep = np.ones(len(boxes), dtype=bool)
+    while True:
+        suppressed = np.zeros(len(boxes), dtype=bool)
+        suppressed[second[keep[first]]] = True
+        if np.array_equal(~suppressed, keep):
+            break
+        keep = ~suppressed
+    return np.sort(order[keep])
+
+
+def apply_thresholds(store, conf, iou=None, classes=None, agnostic=False, max_det=MAX_DETECTIONS):
+    """
+    Re-applies confidence, class filter and NMS to the stored predictions.
+
+    NMS runs only when iou is lower than the IoU the predictions were captured with,
+    the captured boxes already passed NMS at that threshold.
+
+    Returns:
+        tuple: Indexes of the selected rows and the image index of every row.
+    """
+    offsets = store["offsets"]
+    image_index = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    selected = np.asarray(store["scores"]) >= conf
+    if classes is not None:
+        selected &= np.isin(store["classes"], classes)
+    indexes = np.nonzero(selected)[0]
+
+    capture_iou = store["meta"].get("capture", {}).get("iou")
+    if iou is not None and (capture_iou is None or iou < float(capture_iou) or agnostic):
+        groups = image_index[indexes].astype(np.int64)
+        if not agnostic:
+            groups = groups * (int(np.max(store["classes"], initial=0)) + 1) + store["classes"][indexes]
+        indexes = indexes[batched_nms(np.asarray(store["boxes"])[indexes], np.asarray(store["scores"])[indexes],
+                                      groups, iou)]
+
+    if max_det:
+        # Keep the max_det best detections of every image
+        images = image_index[indexes]
+        order = np.lexsort((-np.asarray(store["scores"])[indexes], images))
+        indexes, images = indexes[order], images[order]
+        _, starts, sizes = np.unique(images, return_index=True, return_counts=True)
+        rank = np.arange(len(indexes)) - np.repeat(starts, sizes)
+        indexes = np.sort(indexes[rank < max_det])
+    return indexes, image_index
+
+
+def query_run(model, experiment, kind="detect", conf=0.25, iou=None, classes=None, agnostic=False,
+              metrics=False, source=None, image=None):
+    """
+    Recomputes detection counts (and optionally metrics) of a run for new thresholds
+    from its prediction store, without running the model.
+
+    Args:
+        model (str): Model name.
+        experiment (str): Run identifier.
+        kind (str): "detect" or "val".
+        conf (float): Confidence threshold.
+        iou (float, optional): NMS IoU threshold.
+        classes (list, optional): Only these class ids.
+        agnostic (bool): Class-agnostic NMS.
+        metrics (bool): Also evaluate against the ground truth of the run's dataset.
+        source (str, optional): Dataset with the ground truth, defaults to the run's dataset.
+        image (str, optional): Also return the detections of this image (path relative to the
+                               dataset folder, file name or stem).
+
+    Returns:
+        dict: Total and per-class detection counts, images with detections, the capture
+              thresholds, optionally metrics and the detections of one image.
+    """
+    started = time.perf_counter()
+    run_dir, params, class_names = run_context(model, kind, experiment)
+    store = load_store(run_dir)
+    indexes, image_index = apply_thresholds(store, conf, iou, classes, agnostic)
+
+    classes_column = np.asarray(store["classes"])[indexes].astype(np.int64)
+    counts = np.bincount(classes_column, minlength=len(class_names) if class_names else 0)
+    names = class_names or [str(i) for i in range(len(counts))]
+    result = {
+        "experiment": experiment,
+        "conf": conf,
+        "iou": iou,
+        "detections": int(len(indexes)),
+        "images": len(store["meta"]["images"]),
+        "images_with_detections": int(len(np.unique(image_index[indexes]))),
+        "per_class": {names[c] if c < len(names) else str(c): int(n) for c, n in enumerate(counts)},
+        "capture": store["meta"].get("capture", {}),
+    }
+
+    if image is not None:
+        keys = store["meta"]["images"]
+        key = _image_key(image)
+        if key not in keys:
+            # Flat label folders (detect.py) are keyed by the stem only
+            key = key.rsplit("/", 1)[-1]
+        if key not in keys:
+            raise Exception(f"Image {image} has no stored predictions")
+        position = keys.index(key)
+        rows = indexes[image_index[indexes] == position]
+        result["image_detections"] = [
+            {"class_id": int(store["classes"][r]), "conf": round(float(store["scores"][r]), 5),
+             "xywhn": [round(float(v), 6) for v in store["boxes"][r]]}
+            for r in rows
+        ]
+
+    if metrics:
+        source = source or params.get("source")
+        if not source:
+            raise Exception(f"Dataset of run {experiment} is unknown, pass source")
+        result["metrics"] = _evaluate_selection(store, indexes, image_index, source, class_names)
+
+    result["seconds"] = round(time.perf_counter() - started, 4)
+    return result
+
+
+def load_ground_truth(source):
+    """
+    Returns the image paths and label arrays of a dataset, cached in memory until a
+    label file changes (checked by its mtime).
+    """
+    images = list_dataset_images(source)
+    label_paths = [label_path_for(path) for path in images]
+    mtimes = []
+    for path in label_paths:
+        try:
+            mtimes.append(os.stat(path).st_mtime_ns)
+        except OSError:
+            mtimes.append(None)
+    key = (os.path.abspath(source), hash(tuple(mtimes)))
+    with _ground_truth_lock:
+        if key in _ground_truth:
+            _ground_truth.move_to_end(key)
+            return _ground_truth[key]
+
+    targets = [read_label_file(path, 5) for path in label_paths]
+    with _ground_truth_lock:
+        _ground_truth[key] = images, targets
+        while len(_ground_truth) > MAX_CACHED_GROUND_TRUTH:
+            _ground_truth.popitem(last=False)
+    return images, targets
+
+
+def _image_positions(store, images):
+    """
+    Position in the store of every dataset image, None if it has no predictions.
+
+    Images are matched by their path relative to the dataset, then by their stem. A stem
+    shared by several images of the dataset can not be told apart in a flat label folder,
+    those images get no predictions rather than all the same ones.
+    """
+    keys = {key: i for i, key in enumerate(store["meta"]["images"])}
+    root = os.path.commonpath([os.path.dirname(path) for path in images]) if images else ""
+    relative = [_image_key(os.path.relpath(path, root)) for path in images]
+    stems = [key.rsplit("/", 1)[-1] for key in relative]
+    counts = {}
+    for stem in stems:
+        counts[stem] = counts.get(stem, 0) + 1
+    return [keys[key] if key in keys else keys.get(stem) if counts[stem] == 1 else None
+            for key, stem in zip(relative, stems)]
+
+
+def _evaluate_selection(store, indexes, image_index, source, class_names):
+    images, targets = load_ground_truth(source)
+    predictions = np.column_stack((np.asarray(store["classes"])[indexes], np.asarray(store["boxes"])[indexes],
+                                   np.asarray(store["scores"])[indexes])).astype(np.float64)
+    selected_images = image_index[indexes]
+    starts = np.searchsorted(selected_images, np.arange(len(store["meta"]["images"]) + 1))
+
+    num_classes = len(class_names) if class_names else int(max(
+        [t[:, 0].max() for t in targets if len(t)] + [predictions[:, 0].max() if len(predictions) else 0])) + 1
+    evaluator = Evaluator(num_classes, conf_threshold=0)
+    for position, image_targets in zip(_image_positions(store, images), targets):
+        image_predictions = predictions[starts[position]:starts[position + 1]] if position is not None \
+            else np.zeros((0, 6))
+        evaluator.add(image_predictions, image_targets)
+    return evaluator.compute(class_names)
+
+
+def store_predictions(run_dir, capture):
+    """Builds the store at the end of a run; a run without prediction files is skipped."""
+    if not os.path.isdir(os.path.join(run_dir, "labels")):
+        return None
+    try:
+        return build_store(run_dir, capture)
+    except Exception as e:
+        print(f"Could not build the prediction store of {run_dir}: {e}")
+        return None
@@ -0,0 +1,148 @@
+import json
+import os
+import shutil
+import time
+
+from services.environment_service import get_python_path
+from services.evaluation_service import evaluate_predictions
+from services.export_service import QUANTIZATION_REPORT, QUANTIZED_FILE, get_quantization, onnx_weights, \
+    run_logged, run_tool, weights_sha256
+from services.job_service import ACTIVE_STATES, scheduler, submit_job
+from services.training_service import get_training_run_data
+from services.validation_service import VAL_SCRIPTS, create_yaml_for_validation
+
+QUANTIZATION_METHODS = ("static", "dynamic")
+# Images of the run's validation set used to calibrate the activation ranges (static)
+CALIBRATION_IMAGES = int(os.environ.get("QUANT_CALIBRATION_IMAGES", 64))
+# Largest accepted mAP@[.5:.95] drop (absolute) of the INT8 model against the FP32 ONNX model
+MAX_MAP_DROP = float(os.environ.get("QUANT_MAX_MAP_DROP", 0.01))
+# Confidence and NMS IoU of the mAP evaluation (the values val.py uses for mAP)
+EVAL_CONF = 0.001
+EVAL_IOU = 0.6
+
+
+def _class_names(classes):
+    if isinstance(classes, dict):
+        return [classes[key] for key in sorted(classes)]
+    return list(classes) if classes else None
+
+
+def start_quantization(model, training_run, method="static", tolerance=None, calibration_images=None,
+                       force=False, priority=0):
+    """
+    Quantizes the run's ONNX export to INT8 as a "quantization" job, gated by accuracy.
+
+    The job calibrates on a sample of the run's validation set, measures the FP32 and
+    INT8 latency, validates both models on the whole validation set (val.py with the
+    predictions saved) and evaluates the predictions with the NumPy evaluator. The INT8
+    model is published for detection (backend "int8") only if its mAP@[.5:.95] is at
+    most tolerance below the FP32 model's; the report is kept either way.
+
+    Args:
+        model (str): Model family (e.g., "yolov5").
+        training_run (str): Training run with an ONNX export.
+        method (str): "static" (calibrated activations) or "dynamic".
+        tolerance (float, optional): Accepted mAP@[.5:.95] drop, QUANT_MAX_MAP_DROP by default.
+        calibration_images (int, optional): Calibration sample size, QUANT_CALIBRATION_IMAGES by default.
+        force (bool): Quantize again even if a report for these weights and method exists.
+        priority (int): Job priority.
+
+    Returns:
+        dict: The existing report ({"cached": True, ...}) or the job id.
+    """
+    if method not in QUANTIZATION_METHODS:
+        raise ValueError(f"Unknown quantization method '{method}', expected one of {', '.join(QUANTIZATION_METHODS)}")
+    fp32_path = onnx_weights(model, training_run)
+    tolerance = MAX_MAP_DROP if tolerance is None else float(tolerance)
+    calibration_images = int(calibration_images or CALIBRATION_IMAGES)
+
+    report = get_quantization(model, training_run)
+    if report is not None and report["method"] == method and report["tolerance"] == tolerance and not force:
+        return dict(report, cached=True)
+
+    sha256 = weights_sha256(model, training_run)
+    existing = scheduler.find_job("quantization", weightsSha256=sha256, method=method)
+    if existing is not None and existing["state"] in ACTIVE_STATES:
+        return {"cached": False, "job_id": existing["id"], "state": existing["state"]}
+    export = scheduler.find_job("export", weightsSha256=sha256)
+    if export is not None and export["state"] in ACTIVE_STATES:
+        raise Exception(f"The ONNX export of {training_run} is being replaced (job {export['id']}), "
+                        f"quantize it when that job has finished")
+
+    run_data = get_training_run_data(model, training_run)
+    val_images = run_data["val"]
+    if not val_images or not os.path.exists(val_images):
+        raise Exception(f"Validation set of {training_run} not found: {val_images}")
+    class_names = _class_names(run_data["classes"])
+    img_size = int(run_data["img_size"] or 640)
+    model_dir = os.path.join(os.getcwd(), model)
+    folder = os.path.dirname(fp32_path)
+
+    def run_quantization(job):
+        python = get_python_path(model, strict=True)
+        work_dir = os.path.join(folder, f"quantize-{job.id}")
+        os.makedirs(work_dir, exist_ok=True)
+        try:
+            int8_path = os.path.join(work_dir, QUANTIZED_FILE)
+            quantization = run_tool(python, ["quantize", "--input", fp32_path, "--output", int8_path,
+                                             "--method", method, "--images", val_images,
+                                             "--samples", str(calibration_images), "--img", str(img_size)],
+                                    model_dir, "quantization")
+            job.result["progress"] = {"step": "evaluation"}
+
+            data_yaml = create_yaml_for_validation(val_images, training_run, model)
+            evaluations = {}
+            for name, weights in (("fp32", fp32_path), ("int8", int8_path)):
+                job.check_cancelled()
+                started = time.perf_counter()
+                run_logged(job, [python, VAL_SCRIPTS[model], "--weights", weights, "--data", data_yaml,
+                                 "--img", str(img_size), "--conf", str(EVAL_CONF), "--iou", str(EVAL_IOU),
+                                 "--project", work_dir, "--name", name, "--exist-ok",
+                                 "--save-txt", "--save-conf"], model_dir, "quantization")
+                result = evaluate_predictions(os.path.join(work_dir, name, "labels"), val_images, class_names)
+                evaluations[name] = dict(result["summary"], images=result["images"],
+                                         validation_seconds=round(time.perf_counter() - started, 3))
+
+            drop = evaluations["fp32"]["map50_95"] - evaluations["int8"]["map50_95"]
+            published = drop <= tolerance
+            report = {
+                "model": model,
+                "training_run": training_run,
+                "weights_sha256": sha256,
+                "method": method,
+                "tolerance": tolerance,
+                "quantization": quantization,
+                "fp32": evaluations["fp32"],
+                "int8": evaluations["int8"],
+                "map50_delta": round(evaluations["int8"]["map50"] - evaluations["fp32"]["map50"], 5),
+                "map50_95_delta": round(evaluations["int8"]["map50_95"] - evaluations["fp32"]["map50_95"], 5),
+                "latency_ms": {"fp32": quantization["fp32_ms"], "int8": quantization["int8_ms"]},
+                "speedup": quantization["speedup"],
+                "published": published,
+                "reason": None if published else
+                f"mAP@[.5:.95] dropped by {drop:.4f}, the tolerance is {tolerance}",
+                "created_at": time.time(),
+            }
+
+            published_path = os.path.join(folder, QUANTIZED_FILE)
+            if published:
+                os.replace(int8_path, published_path)
+            elif os.path.exists(published_path):
+                # The last report decides, an earlier model of another method is withdrawn
+                os.remove(published_path)
+            tmp_path = os.path.join(folder, QUANTIZATION_REPORT + ".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+            os.replace(tmp_path, os.path.join(folder, QUANTIZATION_REPORT))
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        print(f"INT8 quantization of {model}/{training_run}: mAP@[.5:.95] {evaluations['fp32']['map50_95']} -> "
+              f"{evaluations['int8']['map50_95']}, speedup {quantization['speedup']}, published {published}")
+        return {"published": published, "map50_95_delta": report["map50_95_delta"], "speedup": report["speedup"],
+                "reason": report["reason"]}
+
+    params = {"model": model, "trainingRun": training_run, "weightsSha256": sha256, "method": method,
+              "tolerance": tolerance, "calibrationImages": calibration_images}
+    job = submit_job("quantization", params, run_quantization, priority=priority)
+    return {"cached": False, "job_id": job.id, "state": job.state}
@@ -0,0 +1,37 @@
+import os
+
+# Seconds between keep-alive comments of SSE streams; a client that went away is noticed
+# at the latest with the next heartbeat, when writing to its socket fails
+HEARTBEAT_SECONDS = float(os.environ.get("SSE_HEARTBEAT_SECONDS", 15))
+# Reconnect delay suggested to EventSource clients
+RETRY_MILLISECONDS = int(os.environ.get("SSE_RETRY_MILLISECONDS", 3000))
+
+
+def is_cooperative():
+    """True when running in the gevent server (serve.py), where threads are greenlets."""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched("threading")
+
+
+def run_blocking(function, *args):
+    """
+    Runs CPU-bound work (image decoding, label parsing, NumPy). In the gevent server it
+    runs in a real OS thread of the hub's thread pool, so the greenlets serving other
+    requests and streams are not stalled. The function must not use locks or other
+    state shared with greenlets.
+    """
+    if is_cooperative():
+        import gevent
+        return gevent.get_hub().threadpool.apply(function, args)
+    return function(*args)
+
+
+def blocking_map(function, items):
+    """Maps function over items in the real OS threads of the gevent hub (see run_blocking)."""
+    if is_cooperative():
+        import gevent
+        return list(gevent.get_hub().threadpool.imap(function, items))
+    return [function(item) for item in items]
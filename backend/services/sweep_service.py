@@ -0,0 +1,443 @@
+import itertools
+import json
+import math
+import os
+import random
+import statistics
+import threading
+import time
+import uuid
+
+from services.db import connect, ensure_schema
+from services.dataset_service import preflight_dataset, preflight_errors
+from services.job_service import ACTIVE_STATES, CANCELLED, scheduler
+from services.training_metrics_service import get_training_metrics, read_results_file
+from services.training_service import run_training_logic
+
+SWEEP_KIND = "sweep"
+# Parameters of run_training_logic a sweep may vary
+TUNABLE_PARAMETERS = {"imageSize": int, "batchSize": int, "epochs": int, "weights": str}
+METRICS = ("map50_95", "map50", "precision", "recall")
+DEFAULT_MEMORY_PER_TRIAL_GB = 4
+MAX_TRIALS = 256
+# Seconds between two checks of the running trials
+POLL_SECONDS = int(os.environ.get("SWEEP_POLL_SECONDS", 10))
+
+SWEEPS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sweeps (
+    id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    config TEXT NOT NULL,
+    trials TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    finished_at REAL
+);
+"""
+
+
+def available_memory_gb():
+    """Free physical memory in GB, None where it can not be determined."""
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") / 1024 ** 3
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def compute_parallelism(cores_per_trial, memory_per_trial_gb, max_parallel=None):
+    """Number of trials that fit into the CPU cores and the free memory at the same time."""
+    limits = [max(1, (os.cpu_count() or 1) // cores_per_trial)]
+    memory = available_memory_gb()
+    if memory is not None and memory_per_trial_gb:
+        limits.append(max(1, int(memory // memory_per_trial_gb)))
+    if max_parallel:
+        limits.append(int(max_parallel))
+    return max(1, min(limits))
+
+
+def _sample(spec, rng):
+    if isinstance(spec, list):
+        return rng.choice(spec)
+    low, high = spec["min"], spec["max"]
+    if spec.get("log"):
+        value = math.exp(rng.uniform(math.log(low), math.log(high)))
+    else:
+        value = rng.uniform(low, high)
+    return int(round(value)) if spec.get("type", "int") == "int" else value
+
+
+def expand_space(space, mode="grid", trials=None, seed=None):
+    """
+    Expands a search space into trial parameter sets.
+
+    Args:
+        space (dict): Parameter -> list of values, or (random mode only) a range
+                      {"min", "max", "log", "type": "int"|"float"}.
+        mode (str): "grid" (all combinations) or "random" (trials samples).
+        trials (int, optional): Number of random samples, for grid an upper bound.
+        seed (int, optional): Seed of the random search.
+
+    Returns:
+        list: One dict of parameter values per trial.
+    """
+    unknown = set(space) - set(TUNABLE_PARAMETERS)
+    if unknown:
+        raise ValueError(f"Parameters can not be tuned: {', '.join(sorted(unknown))}")
+    if not space:
+        raise ValueError("The search space is empty")
+
+    if mode == "grid":
+        for name, values in space.items():
+            if not isinstance(values, list) or not values:
+                raise ValueError(f"Grid search needs a list of values for {name}")
+        names = list(space)
+        combinations = [dict(zip(names, values)) for values in itertools.product(*(space[n] for n in names))]
+        if trials:
+            combinations = combinations[:int(trials)]
+    elif mode == "random":
+        if not trials:
+            raise ValueError("Random search needs the number of trials")
+        rng = random.Random(seed)
+        combinations = [{name: _sample(spec, rng) for name, spec in space.items()} for _ in range(int(trials))]
+    else:
+        raise ValueError(f"Unknown search mode: {mode}")
+
+    if len(combinations) > MAX_TRIALS:
+        raise ValueError(f"The sweep has {len(combinations)} trials, at most {MAX_TRIALS} are allowed")
+    return [{name: TUNABLE_PARAMETERS[name](value) for name, value in c.items()} for c in combinations]
+
+
+def _best_so_far(values):
+    """Running maximum of a metric series; epochs without validation keep the previous value."""
+    best, curve = None, []
+    for value in values:
+        if value is not None:
+            best = value if best is None else max(best, value)
+        curve.append(best if best is not None else 0.0)
+    return curve
+
+
+class Sweep:
+    """
+    One hyperparameter search: a set of training trials queued as "sweep" jobs, a
+    monitor that applies median stopping and a leaderboard of the finished runs.
+
+    A trial is only submitted to the scheduler while fewer than config["parallel"]
+    trials of this sweep are active, so every sweep keeps its own parallelism; the
+    monitor submits the next trials as slots become free.
+
+    Median stopping: once a trial finished grace_epochs epochs, it is stopped at
+    epoch e if its best metric so far is below the median of the best metrics the
+    other trials reached by epoch e (at least min_trials of them).
+    """
+
+    def __init__(self, config, trials, sweep_id=None, state="running", created_at=None, finished_at=None):
+        self.id = sweep_id or uuid.uuid4().hex
+        self.config = config
+        self.trials = trials
+        self.state = state
+        self.created_at = created_at or time.time()
+        self.finished_at = finished_at
+        self.lock = threading.Lock()
+        self.cancel_requested = False
+
+    def run_dir(self, trial):
+        return os.path.join(os.getcwd(), self.config["base"].get("model", "yolov5"), "runs", "train", trial["name"])
+
+    def start(self):
+        try:
+            with self.lock:
+                self._fill(strict=True)
+        except Exception:
+            # Trials queued before the failure would otherwise run without a sweep watching them
+            self.cancel_requested = True
+            for trial in self.trials:
+                if trial["job_id"] and trial["state"] in ACTIVE_STATES:
+                    try:
+                        scheduler.cancel(trial["job_id"])
+                    except Exception as e:
+                        print(f"Could not cancel trial {trial['index']}: {e}")
+            raise
+        self._persist()
+        threading.Thread(target=self._monitor, daemon=True, name=f"sweep-{self.id[:8]}").start()
+
+    def _submit(self, trial):
+        base = self.config["base"]
+        cores = self.config["cores_per_trial"]
+        threads = {"OMP_NUM_THREADS": str(cores), "MKL_NUM_THREADS": str(cores)}
+        data = dict(base, **trial["params"], name=trial["name"], workers=min(cores, 8), skipPreflight=True)
+        result = run_training_logic(data, kind=SWEEP_KIND, env=threads)
+        if not result:
+            raise Exception("Training environment is not available")
+        trial["job_id"] = result["job_id"]
+        trial["state"] = result["state"]
+
+    def _fill(self, strict=False):
+        # Must be called with self.lock held
+        active = sum(1 for trial in self.trials if trial["job_id"] and trial["state"] in ACTIVE_STATES)
+        for trial in self.trials:
+            if active >= self.config["parallel"] or self.cancel_requested:
+                break
+            if trial["job_id"] is not None or trial["state"] not in ACTIVE_STATES:
+                continue
+            try:
+                self._submit(trial)
+            except Exception as e:
+                if strict:
+                    raise
+                trial["state"] = "failed"
+                trial["error"] = str(e)
+                continue
+            active += 1
+
+    def _curve(self, trial):
+        if trial.get("curve") is not None:
+            return trial["curve"]
+        if trial["job_id"] is None:
+            return []
+        try:
+            series = get_training_metrics(trial["job_id"])["series"]
+        except Exception:
+            return []
+        curve = _best_so_far(series.get(self.config["metric"], []))
+        if trial["state"] not in ACTIVE_STATES:
+            # Finished trials do not change any more
+            trial["curve"] = curve
+        return curve
+
+    def _update(self):
+        with self.lock:
+            for trial in self.trials:
+                if trial["job_id"] and trial["state"] in ACTIVE_STATES:
+                    job = scheduler.get(trial["job_id"])
+                    trial["state"] = job["state"] if job else "failed"
+                    if job and job.get("error"):
+                        trial["error"] = job["error"]
+
+            rules = self.config["median_stopping"]
+            if rules:
+                curves = {trial["index"]: self._curve(trial) for trial in self.trials}
+                for trial in self.trials:
+                    if trial["state"] != "running" or trial.get("stopped_early"):
+                        continue
+                    curve = curves[trial["index"]]
+                    if not curve:
+                        # No epoch finished yet, nothing to compare
+                        continue
+                    epoch = len(curve) - 1
+                    if epoch + 1 < rules["grace_epochs"]:
+                        continue
+                    others = [c[epoch] for index, c in curves.items() if index != trial["index"] and len(c) > epoch]
+                    if len(others) < rules["min_trials"]:
+                        continue
+                    median = statistics.median(others)
+                    if curve[epoch] < median:
+                        trial["stopped_early"] = {"epoch": epoch, "value": round(curve[epoch], 5),
+                                                  "median": round(median, 5)}
+                        print(f"Sweep {self.id}: stopping trial {trial['index']} at epoch {epoch} "
+                              f"({curve[epoch]:.4f} < median {median:.4f})")
+                        try:
+                            scheduler.cancel(trial["job_id"])
+                        except Exception as e:
+                            print(f"Could not stop trial {trial['index']}: {e}")
+
+            self._fill()
+            if all(trial["state"] not in ACTIVE_STATES for trial in self.trials):
+                self.state = CANCELLED if self.cancel_requested else "finished"
+                self.finished_at = time.time()
+        self._persist()
+
+    def _monitor(self):
+        while self.state == "running":
+            time.sleep(POLL_SECONDS)
+            try:
+                self._update()
+            except Exception as e:
+                print(f"Sweep {self.id} monitor error: {e}")
+
+    def cancel(self):
+        self.cancel_requested = True
+        for trial in self.trials:
+            if trial["job_id"] is None and trial["state"] in ACTIVE_STATES:
+                # Never submitted, nothing to stop
+                trial["state"] = CANCELLED
+            elif trial["state"] in ACTIVE_STATES:
+                try:
+                    scheduler.cancel(trial["job_id"])
+                except Exception as e:
+                    print(f"Could not cancel trial {trial['index']}: {e}")
+        self._update()
+
+    def leaderboard(self):
+        """Trials ranked by the best value of the sweep metric in their results file (or parsed output)."""
+        metric = self.config["metric"]
+        rows = []
+        for trial in self.trials:
+            series = read_results_file(self.run_dir(trial))
+            if series is None and trial.get("job_id"):
+                try:
+                    series = get_training_metrics(trial["job_id"])["series"]
+                except Exception:
+                    series = None
+            values = series.get(metric, []) if series else []
+            scored = [(v, i) for i, v in enumerate(values) if v is not None]
+            best_value, best_index = max(scored) if scored else (None, None)
+            rows.append({
+                "trial": trial["index"],
+                "name": trial["name"],
+                "params": trial["params"],
+                "job_id": trial.get("job_id"),
+                "state": trial["state"],
+                "stopped_early": trial.get("stopped_early"),
+                "epochs": len(values),
+                metric: best_value,
+                "best_epoch": series["epoch"][best_index] if best_index is not None else None,
+                "final": {m: series[m][best_index] for m in METRICS if series.get(m)} if best_index is not None else {},
+            })
+        rows.sort(key=lambda row: (row[metric] is None, -(row[metric] or 0)))
+        for rank, row in enumerate(rows, 1):
+            row["rank"] = rank if row[metric] is not None else None
+        return rows
+
+    def to_dict(self, leaderboard=True):
+        with self.lock:
+            data = {
+                "id": self.id,
+                "state": self.state,
+                "config": self.config,
+                "created_at": self.created_at,
+                "finished_at": self.finished_at,
+                "trials": [{k: v for k, v in t.items() if k != "curve"} for t in self.trials],
+            }
+        if leaderboard:
+            data["leaderboard"] = self.leaderboard()
+        return data
+
+    def _persist(self):
+        data = self.to_dict(leaderboard=False)
+        with connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sweeps (id, state, config, trials, created_at, finished_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (self.id, self.state, json.dumps(self.config), json.dumps(data["trials"]),
+                 self.created_at, self.finished_at)
+            )
+
+
+_sweeps = {}
+_sweeps_lock = threading.Lock()
+_loaded = False
+
+
+def _ensure_loaded():
+    global _loaded
+    if _loaded:
+        return
+    ensure_schema("sweeps", SWEEPS_SCHEMA)
+    # The trials of a sweep from a previous server process were failed by the job scheduler
+    with connect() as conn:
+        conn.execute("UPDATE sweeps SET state = ?, finished_at = ? WHERE state = ?",
+                     ("interrupted", time.time(), "running"))
+    _loaded = True
+
+
+def create_sweep(data):
+    """
+    Expands a search space into training trials and queues them.
+
+    Args:
+        data (dict): base (run_training_logic parameters shared by all trials), space, mode
+                     ("grid"/"random"), trials, seed, metric, cores_per_trial,
+                     memory_per_trial_gb, max_parallel and median_stopping
+                     ({"grace_epochs", "min_trials"} or false).
+
+    Returns:
+        dict: The sweep with its trials.
+    """
+    base = dict(data.get("base") or {})
+    if not base.get("dataDir"):
+        raise ValueError("base.dataDir is required")
+    metric = data.get("metric", "map50_95")
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric: {metric}")
+    combinations = expand_space(data.get("space") or {}, data.get("mode", "grid"), data.get("trials"),
+                                data.get("seed"))
+
+    cpu_count = os.cpu_count() or 1
+    max_parallel = data.get("max_parallel")
+    cores_per_trial = int(data.get("cores_per_trial") or max(1, cpu_count // min(len(combinations),
+                                                                                  max_parallel or cpu_count)))
+    memory_per_trial = float(data.get("memory_per_trial_gb", DEFAULT_MEMORY_PER_TRIAL_GB))
+    parallel = compute_parallelism(cores_per_trial, memory_per_trial, max_parallel)
+
+    stopping = data.get("median_stopping", {})
+    if stopping is not False:
+        stopping = {"grace_epochs": int((stopping or {}).get("grace_epochs", 5)),
+                    "min_trials": int((stopping or {}).get("min_trials", 3))}
+        if stopping["grace_epochs"] < 1:
+            raise ValueError("median_stopping.grace_epochs must be at least 1")
+        if stopping["min_trials"] < 1:
+            raise ValueError("median_stopping.min_trials must be at least 1")
+
+    # The dataset is checked once for all trials
+    if not base.pop("skipPreflight", False):
+        preflight = preflight_dataset(base.get("dataDir"), base.get("valDir"), base.get("classList"))
+        if not preflight["ok"]:
+            raise Exception(f"Dataset preflight failed: {preflight_errors(preflight)}")
+
+    with _sweeps_lock:
+        _ensure_loaded()
+    sweep_id = uuid.uuid4().hex
+    trials = [{"index": i, "name": f"sweep_{sweep_id[:8]}_{i}", "params": params, "job_id": None,
+               "state": "queued"} for i, params in enumerate(combinations)]
+    config = {"base": base, "space": data.get("space"), "mode": data.get("mode", "grid"), "metric": metric,
+              "cores_per_trial": cores_per_trial, "memory_per_trial_gb": memory_per_trial,
+              "parallel": parallel, "median_stopping": stopping}
+    sweep = Sweep(config, trials, sweep_id)
+
+    with _sweeps_lock:
+        _sweeps[sweep.id] = sweep
+    try:
+        sweep.start()
+    except Exception:
+        with _sweeps_lock:
+            _sweeps.pop(sweep.id, None)
+        raise
+    return sweep.to_dict(leaderboard=False)
+
+
+def get_sweep(sweep_id):
+    """Returns a sweep with its leaderboard, None if it does not exist."""
+    with _sweeps_lock:
+        _ensure_loaded()
+        sweep = _sweeps.get(sweep_id)
+    if sweep is not None:
+        return sweep.to_dict()
+    with connect() as conn:
+        row = conn.execute("SELECT * FROM sweeps WHERE id = ?", (sweep_id,)).fetchone()
+    if row is None:
+        return None
+    return Sweep(json.loads(row["config"]), json.loads(row["trials"]), row["id"], row["state"],
+                 row["created_at"], row["finished_at"]).to_dict()
+
+
+def list_sweeps(limit=50):
+    with _sweeps_lock:
+        _ensure_loaded()
+    with connect() as conn:
+        rows = conn.execute("SELECT id, state, config, trials, created_at, finished_at FROM sweeps "
+                            "ORDER BY created_at DESC LIMIT ?", (int(limit),)).fetchall()
+    return [
+        {"id": row["id"], "state": row["state"], "created_at": row["created_at"],
+         "finished_at": row["finished_at"], "metric": json.loads(row["config"])["metric"],
+         "trials": len(json.loads(row["trials"]))}
+        for row in rows
+    ]
+
+
+def cancel_sweep(sweep_id):
+    with _sweeps_lock:
+        sweep = _sweeps.get(sweep_id)
+    if sweep is None:
+        raise Exception(f"Sweep {sweep_id} is not running")
+    sweep.cancel()
+    return sweep.to_dict(leaderboard=False)
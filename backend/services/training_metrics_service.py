@@ -0,0 +1,314 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from services.db import DATA_DIR
+from services.job_service import scheduler
+
+METRICS_DIR = os.path.join(DATA_DIR, "metrics")
+# Parsers of finished jobs kept in memory, older ones are served from their file
+MAX_PARSERS = 50
+
+# "      0/49      3.41G     0.1127    0.06877    0.03617         92        640:  45%|####  | 9/20 [00:05<00:06,  1.74it/s]"
+PROGRESS_PATTERN = re.compile(
+    r"^\s*(?P<epoch>\d+)/(?P<last>\d+)\s+(?P<mem>[\d.]+[KMG]?)\s+(?P<values>[\d.eE+\-\s]+?):"
+    r"\s*(?P<percent>\d+)%.*?(?P<batch>\d+)/(?P<batches>\d+)\s*"
+    r"(?:\[(?P<elapsed>[\d:]+)<(?P<eta>[\d:?]+),\s*(?P<rate>[\d.]+)(?P<unit>it/s|s/it))?"
+)
+# "                   all        128        929      0.735      0.624      0.716      0.479"
+VALIDATION_PATTERN = re.compile(
+    r"^\s*all\s+(?P<images>\d+)\s+(?P<instances>\d+)\s+(?P<p>[\d.]+)\s+(?P<r>[\d.]+)"
+    r"\s+(?P<map50>[\d.]+)\s+(?P<map>[\d.]+)"
+)
+# "      Epoch    GPU_mem   box_loss   obj_loss   cls_loss  Instances       Size"
+HEADER_PATTERN = re.compile(r"^\s*Epoch\s+gpu_mem\s+(?P<names>.+)$", re.IGNORECASE)
+# "50 epochs completed in 1.234 hours."
+COMPLETED_PATTERN = re.compile(r"epochs completed in")
+
+DEFAULT_LOSS_NAMES = {
+    3: ["box_loss", "obj_loss", "cls_loss"],
+    4: ["box_loss", "obj_loss", "cls_loss", "total_loss"],
+}
+METRIC_COLUMNS = ["precision", "recall", "map50", "map50_95"]
+
+
+def _seconds(value):
+    """Converts a tqdm time ("01:23" or "1:02:03") to seconds, None for "?"."""
+    if not value or "?" in value:
+        return None
+    seconds = 0
+    for part in value.split(":"):
+        seconds = seconds * 60 + int(part)
+    return seconds
+
+
+def _gigabytes(value):
+    units = {"K": 1e-6, "M": 1e-3, "G": 1.0}
+    if value[-1] in units:
+        return float(value[:-1]) * units[value[-1]]
+    return float(value)
+
+
+class TrainingMetricsParser:
+    """
+    Turns YOLOv5/YOLOv7 trainer output into typed records.
+
+    Progress bar redraws update the live state of the current epoch; the last state
+    of every epoch and its validation summary (P, R, mAP) are stored as one row of a
+    compact columnar time series, which is written to data/metrics/<job_id>.json
+    whenever an epoch gets its validation results.
+    """
+
+    def __init__(self, job_id, batch_size=None):
+        self.job_id = job_id
+        self.batch_size = int(batch_size) if batch_size else None
+        self.lock = threading.Lock()
+        self.loss_names = None
+        self.series = {"epoch": [], "time": []}
+        self.current = None
+        self.live = {}
+        self.final = None
+        self.completed = False
+        self.path = os.path.join(METRICS_DIR, f"{job_id}.json")
+
+    def feed(self, text):
+        """Parses a chunk of cleaned trainer output (one or more lines)."""
+        for line in text.splitlines():
+            with self.lock:
+                self._parse_line(line)
+
+    def _parse_line(self, line):
+        header = HEADER_PATTERN.match(line)
+        if header:
+            names = header.group("names").split()
+            # Drop the trailing "Instances/labels" and "Size/img_size" columns
+            self.loss_names = [n.lower() if n.lower().endswith("loss") else f"{n.lower()}_loss" for n in names[:-2]]
+            return
+
+        progress = PROGRESS_PATTERN.match(line)
+        if progress:
+            self._on_progress(progress)
+            return
+
+        validation = VALIDATION_PATTERN.match(line)
+        if validation:
+            self._on_validation(validation)
+            return
+
+        if COMPLETED_PATTERN.search(line):
+            self.completed = True
+            self._commit()
+
+    def _on_progress(self, match):
+        values = match.group("values").split()
+        losses = [float(v) for v in values[:-2]]
+        names = self.loss_names if self.loss_names and len(self.loss_names) == len(losses) else \
+            DEFAULT_LOSS_NAMES.get(len(losses), [f"loss_{i}" for i in range(len(losses))])
+
+        rate = float(match.group("rate")) if match.group("rate") else None
+        if rate and match.group("unit") == "s/it":
+            rate = 1.0 / rate if rate else None
+
+        epoch = int(match.group("epoch"))
+        if self.current is not None and self.current["epoch"] != epoch:
+            self._commit()
+
+        self.live = {
+            "epoch": epoch,
+            "epochs": int(match.group("last")) + 1,
+            "batch": int(match.group("batch")),
+            "batches": int(match.group("batches")),
+            "percent": int(match.group("percent")),
+            "gpu_mem": round(_gigabytes(match.group("mem")), 3),
+            "losses": dict(zip(names, losses)),
+            "instances": int(values[-2]),
+            "img_size": int(values[-1]),
+            "it_per_s": round(rate, 3) if rate else None,
+            "images_per_s": round(rate * self.batch_size, 2) if rate and self.batch_size else None,
+            "elapsed": _seconds(match.group("elapsed")),
+            "eta": _seconds(match.group("eta")),
+        }
+        self.current = {
+            "epoch": epoch,
+            "time": time.time(),
+            "gpu_mem": self.live["gpu_mem"],
+            "it_per_s": self.live["it_per_s"],
+            "images_per_s": self.live["images_per_s"],
+            **self.live["losses"],
+        }
+
+    def _on_validation(self, match):
+        metrics = {
+            "precision": float(match.group("p")),
+            "recall": float(match.group("r")),
+            "map50": float(match.group("map50")),
+            "map50_95": float(match.group("map")),
+        }
+        if self.completed:
+            # Evaluation of the final/best weights after the last epoch
+            self.final = metrics
+            self._save()
+            return
+        if self.current is not None:
+            self.current.update(metrics)
+            self._commit()
+
+    def _commit(self):
+        if self.current is None:
+            return
+        row = self.current
+        self.current = None
+        if self.series["epoch"] and self.series["epoch"][-1] == row["epoch"]:
+            # The epoch was already stored (e.g. validation after its last batch)
+            for column, values in self.series.items():
+                if column in row:
+                    values[-1] = row[column]
+        else:
+            length = len(self.series["epoch"])
+            for column in row:
+                self.series.setdefault(column, [None] * length)
+            for column, values in self.series.items():
+                values.append(row.get(column))
+        self._save()
+
+    def _save(self):
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"job_id": self.job_id, "series": self.series, "final": self.final},
+                      f, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "job_id": self.job_id,
+                "live": dict(self.live),
+                "series": {column: list(values) for column, values in self.series.items()},
+                "final": self.final,
+            }
+
+
+_parsers = OrderedDict()
+_parsers_lock = threading.Lock()
+
+
+def create_parser(job_id, batch_size=None, previous_job_id=None):
+    """
+    Creates the metrics parser of a training job. The series of a resumed job continues
+    the series of the job it was resumed from (previous_job_id).
+    """
+    parser = TrainingMetricsParser(job_id, batch_size)
+    if previous_job_id:
+        try:
+            parser.series = get_training_metrics(previous_job_id)["series"]
+        except Exception as e:
+            print(f"No metrics of job {previous_job_id} to continue: {e}")
+    with _parsers_lock:
+        _parsers[job_id] = parser
+        if len(_parsers) > MAX_PARSERS:
+            # Only parsers of finished jobs are dropped, a running training keeps feeding its parser
+            active = {job.id for job in scheduler.active_jobs()} | {job_id}
+            for finished in [key for key in _parsers if key not in active][:len(_parsers) - MAX_PARSERS]:
+                del _parsers[finished]
+    return parser
+
+
+def downsample(series, max_points):
+    """Keeps at most max_points evenly spaced rows of a columnar series (always including the last row)."""
+    length = len(series.get("epoch", []))
+    if not max_points or length <= max_points:
+        return series
+    if max_points == 1:
+        indexes = [length - 1]
+    else:
+        step = (length - 1) / (max_points - 1)
+        indexes = sorted({round(i * step) for i in range(max_points)})
+    return {column: [values[i] for i in indexes] for column, values in series.items()}
+
+
+def get_training_metrics(job_id=None, max_points=None):
+    """
+    Returns the parsed metrics of a training job.
+
+    Args:
+        job_id (str, optional): Training job id. Defaults to the newest training job.
+        max_points (int, optional): Downsample the per-epoch series to at most this many rows.
+
+    Returns:
+        dict: job_id, live progress of the current epoch, per-epoch series and final metrics.
+
+    Raises:
+        Exception: If there are no metrics for the job.
+    """
+    with _parsers_lock:
+        if job_id is None:
+            if not _parsers:
+                raise Exception("No training metrics available")
+            job_id = next(reversed(_parsers))
+        parser = _parsers.get(job_id)
+
+    if parser is not None:
+        data = parser.snapshot()
+    else:
+        path = os.path.join(METRICS_DIR, f"{job_id}.json")
+        if not os.path.exists(path):
+            raise Exception(f"No training metrics for job {job_id}")
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        data["live"] = {}
+
+    data["series"] = downsample(data["series"], max_points)
+    return data
+
+
+# results.csv columns of YOLOv5 (the header is padded with spaces)
+RESULTS_CSV_COLUMNS = {
+    "epoch": "epoch",
+    "metrics/precision": "precision",
+    "metrics/recall": "recall",
+    "metrics/mAP_0.5": "map50",
+    "metrics/mAP_0.5:0.95": "map50_95",
+}
+# Columns 8-11 of a YOLOv7 results.txt row: P, R, mAP@.5, mAP@.5:.95
+RESULTS_TXT_COLUMNS = {8: "precision", 9: "recall", 10: "map50", 11: "map50_95"}
+
+
+def read_results_file(run_dir):
+    """
+    Reads the per-epoch validation metrics a trainer wrote into its run folder
+    (results.csv of YOLOv5, results.txt of YOLOv7).
+
+    Returns:
+        dict | None: Columnar series with epoch, precision, recall, map50 and map50_95,
+                     None if the run has no results file yet.
+    """
+    csv_path = os.path.join(run_dir, "results.csv")
+    txt_path = os.path.join(run_dir, "results.txt")
+    series = {"epoch": [], **{column: [] for column in METRIC_COLUMNS}}
+    if os.path.exists(csv_path):
+        with open(csv_path, "r", encoding="utf-8") as f:
+            header = [name.strip() for name in f.readline().split(",")]
+            indexes = {RESULTS_CSV_COLUMNS[name]: i for i, name in enumerate(header) if name in RESULTS_CSV_COLUMNS}
+            for line in f:
+                values = line.split(",")
+                if len(values) < len(header):
+                    continue
+                for column, index in indexes.items():
+                    value = float(values[index])
+                    series[column].append(int(value) if column == "epoch" else value)
+    elif os.path.exists(txt_path):
+        with open(txt_path, "r", encoding="utf-8") as f:
+            for line in f:
+                values = line.split()
+                if len(values) < 12:
+                    continue
+                series["epoch"].append(int(values[0].split("/")[0]))
+                for index, column in RESULTS_TXT_COLUMNS.items():
+                    series[column].append(float(values[index]))
+    else:
+        return None
+    return series
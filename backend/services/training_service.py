@@ -1,64 +1,36 @@
 import os
-import re
-import json
 import yaml
 import subprocess
-import threading
 import datetime
-from queue import Queue
-
-# Pattern to remove ANSI escape sequences
-ANSI_ESCAPE_PATTERN = re.compile(r'\x1B\[[0-?]*[ -/]*[@-~]')
-
-# Global training process handle and log queue for streaming logs
-train_process = None
-log_queue = Queue()
+import threading
+import time
 
-MODEL_ENVIRONMENTS = {
-    "yolov5": "yolov5_env",
-    "yolov7": "yolov7_env"
-}
+from services.catalog_service import allocate_run, list_runs, reconcile, refresh_run
+from services.dataset_service import preflight_dataset, preflight_errors
+from services.environment_service import get_python_path
+from services.job_service import PAUSED, JobPaused, scheduler, submit_job
+from services.log_service import create_log, log_info
+from services.metrics_service import ProcessMeter
+from services.output_service import pump_output, run_log_path
+from services.training_metrics_service import create_parser, read_results_file
 
+# How often a pausing job checks whether the trainer wrote its next checkpoint
+CHECKPOINT_POLL_SECONDS = 2
 
-def get_python_path_for_env(env_name):
+def run_training_logic(data, kind="training", env=None):
     """
-    Retrieves the Python interpreter path for a given conda environment.
+    Starts (or queues) a training job.
 
     Args:
-        env_name (str): Name of the conda environment.
+        data (dict): Training parameters (imageSize, batchSize, epochs, weights, dataDir, valDir,
+                     classList, model, priority). Optional: name of the run folder (the next free
+                     expN folder by default), workers of the data loader, skipPreflight.
+        kind (str): Job kind, sweep trials run as "sweep" jobs with their own concurrency limit.
+        env (dict, optional): Extra environment variables of the trainer (e.g., thread limits).
 
     Returns:
-        str: The absolute path to the Python interpreter in the specified environment.
-
-    Raises:
-        Exception: If the conda environment list fails or the environment cannot be found.
+        dict: message, job_id, state of the job and name of the run folder.
     """
-    result = subprocess.run(["conda", "env", "list", "--json"],
-                            capture_output=True, text=True)
-    if result.returncode != 0:
-        raise Exception("Failed to run conda env list: " + result.stderr)
-
-    try:
-        env_list, _ = json.JSONDecoder().raw_decode(result.stdout)
-    except json.JSONDecodeError as e:
-        print("Error parsing JSON:", e)
-        raise
-
-    # Find the environment path matching the provided environment name
-    env_path = next((env for env in env_list["envs"]
-                     if os.path.basename(env) == env_name), None)
-    if env_path is None:
-        raise Exception(f"Environment '{env_name}' not found.")
-
-    # Build path to python env
-    python_path = os.path.join(env_path, "python.exe" if os.name == "nt" else "bin/python")
-    if not os.path.exists(python_path):
-        raise Exception(f"Python not found in environment '{env_name}': {python_path}")
-
-    return python_path
-
-
-def run_training_logic(data):
     image_size = data.get("imageSize", 640)
     batch_size = data.get("batchSize", 16)
     epochs = data.get("epochs", 50)
@@ -69,13 +41,18 @@ def run_training_logic(data):
     model = data.get("model", "yolov5")
 
     results_dir = os.path.join(model, "runs", "train")
-    conda_env = MODEL_ENVIRONMENTS.get(model, "yolov_base_env")
     try:
-        python_path = get_python_path_for_env(conda_env)
+        python_path = get_python_path(model, strict=True)
     except Exception as e:
-        print(f"Error obtaining Python path for environment '{conda_env}': {e}")
+        print(f"Error obtaining Python path for model '{model}': {e}")
         return
 
+    # Broken datasets fail here in seconds instead of minutes later inside the trainer
+    if not data.get("skipPreflight"):
+        preflight = preflight_dataset(data_dir, val_dir, class_list)
+        if not preflight["ok"]:
+            raise Exception(f"Dataset preflight failed: {preflight_errors(preflight)}")
+
     yaml_file = create_unique_yaml(data_dir, val_dir, class_list)
     model_lower = model.lower()
     valid_models = ["yolov5", "yolov6", "yolov7", "yolov8"]
@@ -96,51 +73,242 @@ def run_training_logic(data):
         "--data", yaml_file,
         "--project", results_dir
     ]
+    # Without a name the run folder is reserved here, the trainer's own numbering could
+    # give two trainings started at the same time the same folder
+    name = data.get("name") or allocate_run(model, "train")
+    cmd += ["--name", name, "--exist-ok"]
+    if data.get("workers") is not None:
+        cmd += ["--workers", str(data["workers"])]
+
+    params = {"model": model, "imageSize": image_size, "batchSize": batch_size, "epochs": epochs,
+              "weights": weights, "dataDir": data_dir, "valDir": val_dir, "name": name,
+              "command": " ".join(cmd)}
+    if env:
+        # Kept for resume_training_logic, the continued trainer gets the same environment
+        params["env"] = env
+    run_dir = os.path.abspath(os.path.join(results_dir, name))
+    job = _submit_training(kind, cmd, params, batch_size, data.get("priority", 0), env, run_dir)
+    message = "Training initiated" if job.state == "running" else "Training queued"
+    return {"message": message, "job_id": job.id, "state": job.state, "name": name}
+
+
+def _submit_training(kind, cmd, params, batch_size, priority=0, env=None, run_dir=None, previous_job_id=None):
+    """
+    Submits a job that runs a trainer command and follows its output.
+
+    The job can be paused: the trainer is terminated once it wrote the checkpoint of the
+    running epoch (weights/last.pt), and the job ends in the paused state with the run
+    folder and checkpoint in its result, from where resume_training_logic continues it.
 
+    Args:
+        run_dir (str, optional): Run folder of the trainer; found by its opt.yaml when not known.
+        previous_job_id (str, optional): Paused job this job resumes, its metrics are continued.
+    """
+    model = params["model"]
+    results_dir = os.path.join(model, "runs", "train")
     print("Run command:", " ".join(cmd))
 
-    def run_training():
-        global train_process
-        train_process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            encoding="utf-8",
-            errors="replace"
-        )
-        for line in train_process.stdout:
-            cleaned_line = clean_line(line)
-            log_queue.put(cleaned_line)  # Uložíme vyčištěný log do fronty
-            print(cleaned_line, end="", flush=True)
-        train_process.stdout.close()
-        train_process.wait()
-        log_queue.put("Training completed.\n")
-
-    threading.Thread(target=run_training).start()
-    return {"message": "Training initiated"}
-
-def clean_line(line):
-    line = line.replace('\r', '\n')
-    line = ANSI_ESCAPE_PATTERN.sub('', line)
-    return line
-
-def stop_training_logic():
-    global train_process
-    if train_process is not None:
-        train_process.terminate()  #todo nebo train_process.kill() dle potřeby
-        train_process = None
-        return {"message": "Training stopped"}
-    else:
-        raise Exception("No training process to stop")
+    def run_training(job):
+        # The broadcast archives the output into the run folder, a resumed run appends to it
+        log = create_log(job.id, "training", run_log_path(run_dir))
+        metrics = create_parser(job.id, batch_size, previous_job_id)
+        job.result["metrics_job"] = job.id
+        stopped = threading.Event()
+        started_at = time.time()
+
+        def find_run_dir():
+            return run_dir or find_new_run_dir(results_dir, started_at)
+
+        try:
+            meter = ProcessMeter(job.kind)
+            train_process = subprocess.Popen(
+                cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                env=dict(os.environ, **env) if env else None
+            )
+            job.attach_process(train_process)
+            job.pause_handler = lambda immediate: threading.Thread(
+                target=stop_at_checkpoint, args=(train_process, find_run_dir, stopped, immediate),
+                daemon=True, name=f"pause-{job.id}").start()
+
+            def forward(text):
+                log.append(text)  # Vyčištěný log pošleme všem odběratelům
+                metrics.feed(text)
+                if metrics.live:
+                    job.result["progress"] = {"epoch": metrics.live["epoch"], "epochs": metrics.live["epochs"],
+                                              "percent": metrics.live["percent"]}
+
+            pump_output(train_process, meter, forward)
+            # The run's row was created when its folder was reserved, bring it up to date (best.pt)
+            folder = find_run_dir()
+            if folder:
+                refresh_run(model, "train", os.path.basename(folder))
+            reconcile(model, "train", force=True)
+            if stopped.is_set():
+                log.append("Training paused.\n")
+            else:
+                log.append("Training completed.\n")
+        finally:
+            log.close()
+            job.result["log"] = log_info(log)
+
+        job.result.pop("pausing", None)
+        if stopped.is_set() and not job.cancel_requested:
+            folder = find_run_dir()
+            checkpoint = checkpoint_path(folder) if folder else None
+            if not checkpoint or not os.path.exists(checkpoint):
+                raise Exception("Training was stopped before it wrote its first checkpoint and can not be resumed")
+            results = read_results_file(folder)
+            job.result.update(run_dir=folder, checkpoint=checkpoint,
+                              completed_epochs=len(results["epoch"]) if results else None)
+            raise JobPaused()
+        if train_process.returncode != 0:
+            raise Exception(f"Training exited with code {train_process.returncode}")
+        if job.kind == "training":
+            # Imported here, export_service uses this module
+            from services.export_service import export_finished_training
+            export_finished_training(model, find_run_dir())
+
+    return submit_job(kind, params, run_training, priority=priority)
+
+
+def checkpoint_path(run_dir):
+    """Checkpoint the trainers write after every epoch and resume from."""
+    return os.path.join(run_dir, "weights", "last.pt")
+
+
+def find_new_run_dir(results_dir, since):
+    """Returns the newest run folder whose opt.yaml was written after since (the trainer writes it at startup)."""
+    newest = None
+    try:
+        with os.scandir(results_dir) as it:
+            for entry in it:
+                try:
+                    mtime = os.stat(os.path.join(entry.path, "opt.yaml")).st_mtime
+                except OSError:
+                    continue
+                if mtime >= since - 1 and (newest is None or mtime > newest[0]):
+                    newest = (mtime, os.path.abspath(entry.path))
+    except FileNotFoundError:
+        return None
+    return newest[1] if newest else None
+
+
+def _file_state(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
 
 
-def get_training_runs_logic(model):
+def stop_at_checkpoint(process, find_run_dir, stopped, immediate=False):
+    """
+    Terminates a trainer at an epoch boundary: waits until weights/last.pt was replaced
+    (and stopped growing) after the pause request, then terminates the process. With
+    immediate the trainer is terminated right away and the current epoch is lost.
+    """
+    if not immediate:
+        run_dir = find_run_dir()
+        initial = _file_state(checkpoint_path(run_dir)) if run_dir else None
+        previous = None
+        while process.poll() is None and not stopped.is_set():
+            time.sleep(CHECKPOINT_POLL_SECONDS)
+            run_dir = run_dir or find_run_dir()
+            if run_dir is None:
+                continue
+            current = _file_state(checkpoint_path(run_dir))
+            if current is not None and current != initial and current == previous:
+                break
+            previous = current
+    if process.poll() is None:
+        stopped.set()
+        process.terminate()
+
+
+def _active_training_job_id(job_id, action):
+    if job_id is not None:
+        return job_id
+    active = scheduler.active_jobs("training")
+    if not active:
+        raise Exception(f"No training process to {action}")
+    return active[0].id
+
+
+def stop_training_logic(job_id=None):
+    """
+    Stops a training job. Without a job id the most recently submitted active
+    training job is stopped (running or still queued).
+
+    Raises:
+        Exception: If there is no training job to stop.
+    """
+    job = scheduler.cancel(_active_training_job_id(job_id, "stop"))
+    return {"message": "Training stopped", "job_id": job["id"]}
+
+
+def pause_training_logic(job_id=None, immediate=False):
+    """
+    Pauses a running training job at the end of its current epoch (once last.pt is written),
+    or right away with immediate. Without a job id the newest active training job is paused.
+
+    Raises:
+        Exception: If the job is not running.
+    """
+    job = scheduler.pause(_active_training_job_id(job_id, "pause"), immediate)
+    return {"message": "Training pausing", "job_id": job["id"], "state": job["state"], "progress": job["result"].get("progress")}
+
+
+def resume_training_logic(job_id, priority=None):
+    """
+    Continues a paused training job from its last.pt with the trainer's --resume option,
+    which restores the original options from the opt.yaml of the run. The run is continued
+    by a new job (queued like any other training job) in the same run folder.
+
+    Args:
+        job_id (str): The paused job.
+        priority (int, optional): Priority of the new job, defaults to the one of the paused job.
+
+    Returns:
+        dict: message, job_id and state of the new job.
+
+    Raises:
+        Exception: If the job is not paused, was already resumed or its checkpoint is missing.
+    """
+    paused = scheduler.get(job_id)
+    if paused is None:
+        raise Exception(f"Job {job_id} not found")
+    if paused["state"] != PAUSED:
+        raise Exception(f"Job {job_id} is not paused (state {paused['state']})")
+    resumed = scheduler.find_job(paused["kind"], resumedFrom=job_id)
+    if resumed is not None and resumed["state"] not in ("failed", "cancelled"):
+        raise Exception(f"Job {job_id} was already resumed by job {resumed['id']}")
+    checkpoint = paused["result"].get("checkpoint")
+    if not checkpoint or not os.path.exists(checkpoint):
+        raise Exception(f"Checkpoint of job {job_id} not found: {checkpoint}")
+
+    params = dict(paused["params"])
+    model = params.get("model", "yolov5")
+    python_path = get_python_path(model, strict=True)
+    train_script = os.path.join(model.lower(), "train.py").replace("\\", "/")
+    cmd = [python_path, train_script, "--resume", checkpoint]
+    params.update(resumedFrom=job_id, command=" ".join(cmd))
+    job = _submit_training(paused["kind"], cmd, params, params.get("batchSize"),
+                           paused["priority"] if priority is None else priority, params.get("env"),
+                           run_dir=paused["result"].get("run_dir"), previous_job_id=job_id)
+    message = "Training resumed" if job.state == "running" else "Training resume queued"
+    return {"message": message, "job_id": job.id, "state": job.state, "resumed_from": job_id}
+
+
+def get_training_runs_logic(model, **list_options):
     """
-    Retrieves a list of completed training runs for the specified model.
+    Retrieves a list of completed training runs for the specified model from the run catalog.
 
     Args:
         model (str): The model name.
+        **list_options: Paging (page, page_size), sorting (sort, order) and filtering (q)
+                        options of catalog_service.list_runs.
 
     Returns:
         list: List of dictionaries representing training runs, each containing:
@@ -148,25 +316,9 @@ def get_training_runs_logic(model):
               - name: Run name.
               - timestamp: Creation time in ISO format.
               - path: Full filesystem path to the run directory.
+              When a page is requested, a dict with items, total, page and page_size.
     """
-    base_dir = os.path.join(os.getcwd(), model, "runs", "train")
-    runs = []
-    if os.path.exists(base_dir):
-        for run_dir in os.listdir(base_dir):
-            full_run_path = os.path.join(base_dir, run_dir)
-            if os.path.isdir(full_run_path):
-                weight_file = os.path.join(full_run_path, "weights", "best.pt")
-                if os.path.exists(weight_file):
-                    creation_time = os.path.getctime(full_run_path)
-                    creation_time_iso = datetime.datetime.fromtimestamp(creation_time).isoformat() + "Z"
-                    runs.append({
-                        "id": run_dir,
-                        "name": run_dir,
-                        "timestamp": creation_time_iso,
-                        "path": full_run_path
-                    })
-        runs.sort(key=lambda x: x["timestamp"], reverse=True)
-    return runs
+    return list_runs(model, "train", require_weights=True, **list_options)
 
 
 def create_unique_yaml(data_dir, val_dir, class_list, yaml_folder="yaml"):
@@ -1,11 +1,18 @@
-import json
 import os
 import subprocess
-import threading
 from datetime import datetime
 
 import yaml
 
+from services.catalog_service import allocate_run, list_runs, refresh_run
+from services.environment_service import get_python_path
+from services.event_service import bus, experiment_topic
+from services.export_service import backend_weights, resolve_backend
+from services.job_service import submit_job
+from services.metrics_service import ProcessMeter
+from services.output_service import pump_output, run_log_path
+from services.prediction_store_service import store_predictions
+
 YOLO_DIR = os.path.join(os.getcwd(), "yolov5")
 YAML_DIR = os.path.join(os.getcwd(), "yaml")
 RUNS_DIR = os.path.join(os.getcwd(), "runs", "val")
@@ -61,10 +68,10 @@ def create_yaml_for_validation(source, train_run, model):
 
     return yaml_file
 
-def start_validation(source, train_run, img_size, conf, iou, model):
+def start_validation(source, train_run, img_size, conf, iou, model, priority=0, backend="pytorch"):
     """
     Starts the validation script (e.g., val.py or test.py) with the given parameters
-    in a new thread.
+    as a validation job.
 
     Args:
         source (str): Path to the folder with validation images and labels.
@@ -73,9 +80,12 @@ def start_validation(source, train_run, img_size, conf, iou, model):
         conf (float): Confidence threshold.
         iou (float): IoU threshold.
         model (str): Name of the model folder (e.g., "yolov5" or "yolov7").
+        priority (int, optional): Job priority, higher runs first. Defaults to 0.
+        backend (str, optional): "pytorch" validates best.pt, "onnx" the run's ONNX export and
+                                 "int8" its published quantized model.
 
     Returns:
-        str: A unique experiment identifier for the validation results.
+        tuple: A unique experiment identifier for the validation results and the job id.
     """
     # Create a YAML configuration file for validation with updated data path
     data_yaml = create_yaml_for_validation(source, train_run, model)
@@ -83,108 +93,80 @@ def start_validation(source, train_run, img_size, conf, iou, model):
     model = model.lower()
     val_script = os.path.join(model,VAL_SCRIPTS[model])
     train_weights = os.path.join(model, "runs", "train", train_run, "weights", "best.pt")
+    backend = resolve_backend(backend)
+    if backend != "pytorch":
+        train_weights = backend_weights(model, train_run, backend)
     result_dir = os.path.join(os.getcwd(), model, "runs", "val")
+    experiment = allocate_run(model, "val")
 
     # Construct the command for running the validation script
     cmd = [
-        "python", val_script,
+        get_python_path(model), val_script,
         "--weights", train_weights,
         "--data", data_yaml,
         "--img", str(img_size),
         "--conf", str(conf),
         "--iou", str(iou),
-        "--project", result_dir
+        "--project", result_dir,
+        "--name", experiment,
+        "--exist-ok",
+        # Predictions with confidences for the evaluator
+        "--save-txt", "--save-conf"
     ]
 
-    def run_validation():
+    def run_validation(job):
+        meter = ProcessMeter("validation")
         process = subprocess.Popen(
             cmd,
             stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            encoding="utf-8",
-            errors="replace"
+            stderr=subprocess.STDOUT
         )
-        # Read process output and print logs
-        for line in process.stdout:
-            cleaned_line = line.strip()
-            # log_queue.put(cleaned_line)
-            print(cleaned_line, flush=True)
-        process.stdout.close()
-        process.wait()
+        job.attach_process(process)
+        # Output is printed and kept in the run folder (output.log.gz)
+        pump_output(process, meter, log_path=run_log_path(os.path.join(result_dir, experiment)))
+        store_predictions(os.path.join(result_dir, experiment), {"conf": float(conf), "iou": float(iou)})
+        refresh_run(model, "val", experiment)
         # log_queue.put("Validace ukončena.")
+        if process.returncode != 0:
+            raise Exception(f"{VAL_SCRIPTS[model]} exited with code {process.returncode}")
 
-    # Spuštění validačního skriptu v novém vlákně
-    threading.Thread(target=run_validation).start()
+    params = {"model": model, "trainingRun": train_run, "source": source, "imgSize": img_size,
+              "conf": conf, "iou": iou, "experiment": experiment, "backend": backend, "command": " ".join(cmd)}
+    # Spuštění validačního skriptu jako úlohy plánovače
+    job = submit_job("validation", params, run_validation, priority=priority,
+                     topic=experiment_topic("val", model, experiment))
 
-    return get_experimental_folder(model)
+    return experiment, job.id
 
 
-def list_validation_runs():
+def list_validation_runs(model="", **list_options):
     """
-    Prochází adresář RUNS_DIR a vrací seznam experimentů (validací).
-    Pokud je v každém experimentu uložen soubor results.json, načte i metriky a datum poslední úpravy.
+    Vrací seznam experimentů (validací) z katalogu běhů, včetně metrik z results.json
+    a data poslední úpravy. Bez modelu se použije adresář runs/val v aktuální složce.
     """
-    base_dir = RUNS_DIR  # Experimenty jsou přímo ve složce runs/val
-    runs = []
-    if not os.path.exists(base_dir):
-        return runs
-    for exp in os.listdir(base_dir):
-        exp_path = os.path.join(base_dir, exp)
-        if os.path.isdir(exp_path):
-            results_file = os.path.join(exp_path, "results.json")
-            metrics = {}
-            if os.path.exists(results_file):
-                try:
-                    with open(results_file, "r") as f:
-                        metrics = json.load(f)
-                except Exception:
-                    metrics = {}
-            timestamp = datetime.fromtimestamp(os.path.getmtime(exp_path)).strftime("%Y-%m-%d %H:%M:%S")
-            runs.append({
-                "id": exp,
-                "name": exp,
-                "timestamp": timestamp,
-                "metrics": metrics,
-            })
-    # Sort experiments with the latest ones first
-    runs = sorted(runs, key=lambda x: x["timestamp"], reverse=True)
-    return runs
+    list_options.setdefault("sort", "modified")
+    return list_runs(model, "val", timestamp_format="%Y-%m-%d %H:%M:%S", **list_options)
 
 
 def get_latest_validation_images(model, experiment):
     """
-    Vrací seznam posledních validovaných obrázků pro daný experiment.
-    Předpokládá se, že obrázky jsou uloženy v podsložce 'images' v adresáři experimentu.
+    Vrací seznam posledních validovaných obrázků pro daný experiment (nejnovější první).
+    Seznam se bere z událostí experimentu, adresář se prochází jen jednou po dokončení validace.
     """
     images_dir = os.path.join(os.getcwd(), model, "runs", "val", experiment)
-    if not os.path.exists(images_dir):
-        return {"images": []}
-
-    images = []
-    for filename in os.listdir(images_dir):
-        if filename.lower().endswith(('.png', '.jpg', '.jpeg')):
-            images.append(filename)
+    images = bus.result_files(experiment_topic("val", model, experiment), images_dir)
     return {"images": images}
 
 
-def get_validation_runs(model):
-    base_dir = os.path.join(os.getcwd(), model, "runs", "val")
-    runs = []
-    if os.path.exists(base_dir):
-        for run_dir in os.listdir(base_dir):
-            full_run_path = os.path.join(base_dir, run_dir)
-            if os.path.isdir(full_run_path):
-                creation_time = os.path.getctime(full_run_path)
-                creation_time_iso = datetime.fromtimestamp(creation_time).isoformat() + "Z"
-                runs.append({
-                    "id": run_dir,
-                    "name": run_dir,
-                    "timestamp": creation_time_iso,
-                    "path": full_run_path
-                })
-        runs.sort(key=lambda x: x["timestamp"], reverse=True)
-    return runs
+def get_validation_runs(model, **list_options):
+    """
+    Returns validation runs of a model from the run catalog.
+
+    Args:
+        model (str): Model name.
+        **list_options: Paging, sorting and filtering options of catalog_service.list_runs.
+    """
+    return list_runs(model, "val", **list_options)
 
 
 def get_validation_details(experiment, host_url, model):
@@ -197,21 +179,9 @@ def get_validation_details(experiment, host_url, model):
         return {"error": "Experiment not found"}
 
     return {
+        "metrics_url": f"{host_url}/api/validation/metrics?model={model}&experiment={experiment}",
         "confusion_matrix_url": f"{host_url}/api/validation/file/{model}/{experiment}/confusion_matrix.png",
         "pr_curve_url": f"{host_url}/api/validation/file/{model}/{experiment}/PR_curve.png",
         "r_curve_url": f"{host_url}/api/validation/file/{model}/{experiment}/R_curve.png",
         "f1_curve_url": f"{host_url}/api/validation/file/{model}/{experiment}/F1_curve.png"
     }
-
-def get_experimental_folder(model):
-    base_detect_dir = os.path.join(os.getcwd(), model, "runs", "val")
-    if not os.path.exists(base_detect_dir):
-        os.makedirs(base_detect_dir, exist_ok=True)
-    exp_dirs = [d for d in os.listdir(base_detect_dir)
-                if os.path.isdir(os.path.join(base_detect_dir, d)) and d.startswith("exp")]
-    if exp_dirs:
-        max_num = max([int(d[3:]) for d in exp_dirs if d[3:].isdigit()] or [0])
-    else:
-        max_num = 0
-    new_experiment = "exp" + str(max_num + 1)
-    return new_experiment
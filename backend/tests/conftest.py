@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+
+# The services keep their state in APP_DATA_DIR, which is read when they are imported
+os.environ.setdefault("APP_DATA_DIR", tempfile.mkdtemp(prefix="backend-tests-"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "workers"))
@@ -0,0 +1,86 @@
+import io
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+from services import artifact_service
+from services.artifact_service import ARCHIVE_ERRORS_FILE, stream_tar, stream_zip
+
+
+@pytest.fixture
+def files(tmp_path):
+    contents = {"results.csv": b"epoch,map\n" * 100, "weights/best.pt": os.urandom(5000), "empty.txt": b""}
+    entries = []
+    for relative, data in contents.items():
+        path = tmp_path / relative
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+        entries.append((relative, str(path), os.stat(path)))
+    return entries, contents
+
+
+def failing_reads(monkeypatch, name, after):
+    """Makes reading the file name fail after `after` chunks."""
+    read_chunks = artifact_service._read_chunks
+    monkeypatch.setattr(artifact_service, "CHUNK_SIZE", 1000)
+
+    def chunks(f, size=None):
+        for number, chunk in enumerate(read_chunks(f, size)):
+            if f.name.endswith(name) and number == after:
+                raise OSError("read error")
+            yield chunk
+
+    monkeypatch.setattr(artifact_service, "_read_chunks", chunks)
+
+
+def test_zip_stream(files):
+    entries, contents = files
+    archive = zipfile.ZipFile(io.BytesIO(b"".join(stream_zip(entries, "run"))))
+    assert archive.testzip() is None
+    assert {name: archive.read(name) for name in archive.namelist()} == \
+        {f"run/{relative}": data for relative, data in contents.items()}
+
+
+def test_tar_stream(files):
+    entries, contents = files
+    data = b"".join(stream_tar(entries, "run"))
+    assert len(data) % tarfile.RECORDSIZE == 0
+    archive = tarfile.open(fileobj=io.BytesIO(data))
+    assert {m.name: archive.extractfile(m).read() for m in archive.getmembers()} == \
+        {f"run/{relative}": data for relative, data in contents.items()}
+
+
+def test_tar_pads_only_the_unread_rest(files, monkeypatch):
+    entries, contents = files
+    failing_reads(monkeypatch, "best.pt", after=2)
+    archive = tarfile.open(fileobj=io.BytesIO(b"".join(stream_tar(entries, "run"))))
+    best = archive.extractfile("run/weights/best.pt").read()
+    assert best == contents["weights/best.pt"][:2000] + b"\0" * 3000
+    assert archive.extractfile("run/empty.txt").read() == b""
+    assert b"best.pt" in archive.extractfile(f"run/{ARCHIVE_ERRORS_FILE}").read()
+
+
+def test_zip_lists_truncated_and_missing_files(files, tmp_path, monkeypatch):
+    entries, contents = files
+    entries.append(("gone.txt", str(tmp_path / "gone.txt"), entries[0][2]))
+    failing_reads(monkeypatch, "best.pt", after=2)
+    archive = zipfile.ZipFile(io.BytesIO(b"".join(stream_zip(entries, "run"))))
+    assert archive.testzip() is None
+    assert "run/gone.txt" not in archive.namelist()
+    assert archive.read("run/weights/best.pt") == contents["weights/best.pt"][:2000]
+    errors = archive.read(f"run/{ARCHIVE_ERRORS_FILE}").decode()
+    assert "best.pt: truncated after 2000 of 5000 bytes" in errors
+    assert "gone.txt: left out" in errors
+
+
+def test_walk_skips_symlinks(tmp_path):
+    run_dir = tmp_path / "exp"
+    (run_dir / "weights").mkdir(parents=True)
+    (run_dir / "weights" / "best.pt").write_bytes(b"weights")
+    (tmp_path / "secret.txt").write_bytes(b"outside the run")
+    (tmp_path / "other").mkdir()
+    os.symlink(tmp_path / "secret.txt", run_dir / "secret.txt")
+    os.symlink(tmp_path / "other", run_dir / "other")
+    assert [relative for relative, _, _ in artifact_service._walk(str(run_dir))] == ["weights/best.pt"]
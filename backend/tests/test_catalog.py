@@ -0,0 +1,38 @@
+import os
+import threading
+
+from services.catalog_service import allocate_run, list_runs
+
+
+def test_allocate_run_numbers_after_existing_runs(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(tmp_path / "yolov5" / "runs" / "detect" / "exp")
+    os.makedirs(tmp_path / "yolov5" / "runs" / "detect" / "exp4")
+    assert allocate_run("yolov5", "detect") == "exp5"
+    assert allocate_run("yolov5", "detect") == "exp6"
+    assert os.path.isdir(tmp_path / "yolov5" / "runs" / "detect" / "exp6")
+
+
+def test_allocate_run_registers_the_run(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    name = allocate_run("yolov5", "val")
+    assert [run["name"] for run in list_runs("yolov5", "val")] == [name]
+
+
+def test_allocate_run_never_hands_out_a_name_twice(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    names = []
+    barrier = threading.Barrier(8)
+
+    def allocate():
+        barrier.wait()
+        for _ in range(5):
+            names.append(allocate_run("yolov5", "train"))
+
+    threads = [threading.Thread(target=allocate) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(names) == 40
+    assert len(set(names)) == 40
@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+from services import detection_cache_service
+from services.detection_cache_service import cached_inference
+
+
+@pytest.fixture
+def model_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    weights = tmp_path / "yolov5" / "runs" / "train" / "exp" / "weights"
+    os.makedirs(weights)
+    # The cache database is shared by all tests, unique weights keep their entries apart
+    (weights / "best.pt").write_bytes(str(tmp_path).encode())
+    images = tmp_path / "yolov5" / "images"
+    os.makedirs(images)
+    (images / "a.jpg").write_bytes(b"image a")
+    (images / "b.jpg").write_bytes(b"image b")
+    # Same content as a.jpg under another name
+    (images / "c.jpg").write_bytes(b"image a")
+    return tmp_path / "yolov5"
+
+
+@pytest.fixture
+def worker(monkeypatch):
+    """Stands in for the inference worker and records the images it was asked to detect."""
+    calls = []
+
+    def run_inference(model, training_run, source, img_size, conf, iou, **options):
+        calls.append([os.path.basename(path) for path in source])
+        yield {"event": "batch", "images": [
+            {"path": path, "name": os.path.basename(path),
+             "detections": [{"class": "x", "class_id": 0, "conf": 0.9, "xyxy": [0, 0, 1, 1]}]}
+            for path in source]}
+        yield {"done": True, "count": len(source), "timings": {"inference": 1.0, "render": 0.0}}
+
+    monkeypatch.setattr(detection_cache_service, "run_inference", run_inference)
+    return calls
+
+
+def detect(source, conf=0.25):
+    messages = list(cached_inference("yolov5", "exp", source, 640, conf, 0.45, render=False))
+    images = {item["name"]: item for message in messages for item in message.get("images", [])}
+    return images, messages[-1]
+
+
+def test_duplicate_images_are_detected_once(model_dir, worker):
+    images, summary = detect("images")
+    assert worker == [["a.jpg", "b.jpg"]]
+    assert sorted(images) == ["a.jpg", "b.jpg", "c.jpg"]
+    assert images["c.jpg"]["cached"] and images["c.jpg"]["detections"] == images["a.jpg"]["detections"]
+    assert summary["count"] == 3 and summary["cached"] == 1
+
+
+def test_only_missing_images_go_to_the_worker(model_dir, worker):
+    detect("images")
+    (model_dir / "images" / "d.jpg").write_bytes(b"image d")
+    images, summary = detect("images")
+    assert worker[1:] == [["d.jpg"]]
+    assert sorted(images) == ["a.jpg", "b.jpg", "c.jpg", "d.jpg"]
+    assert all(images[name].get("cached") for name in ("a.jpg", "b.jpg", "c.jpg"))
+    assert summary["count"] == 4 and summary["cached"] == 3
+
+
+def test_full_hit_skips_the_worker(model_dir, worker):
+    detect("images")
+    images, summary = detect("images")
+    assert len(worker) == 1
+    assert summary["cached"] == 3
+    assert summary["timings"] == {"inference": 0.0, "render": 0.0}
+
+
+def test_changed_image_or_parameters_miss(model_dir, worker):
+    detect("images")
+    (model_dir / "images" / "b.jpg").write_bytes(b"image b, edited")
+    detect("images")
+    assert worker[1] == ["b.jpg"]
+    detect("images", conf=0.5)
+    assert worker[2] == ["a.jpg", "b.jpg"]
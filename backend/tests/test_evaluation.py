@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from services.evaluation_service import Evaluator, greedy_match
+
+TARGET = np.array([[0, 0.5, 0.5, 0.2, 0.2]])
+
+
+def evaluate(predictions, targets=TARGET, num_classes=1):
+    evaluator = Evaluator(num_classes)
+    evaluator.add(np.array(predictions, dtype=np.float64).reshape(-1, 6), targets)
+    return evaluator.compute()
+
+
+def test_perfect_prediction():
+    result = evaluate([[0, 0.5, 0.5, 0.2, 0.2, 0.9]])
+    assert result["summary"]["map50"] == pytest.approx(0.995)
+    assert result["summary"]["map50_95"] == pytest.approx(0.995)
+    assert result["summary"]["recall"] == 1.0
+
+
+def test_ap_counts_only_thresholds_below_the_iou():
+    # Shifted by 0.025: IoU 0.78, a true positive at 0.5 ... 0.75 only
+    result = evaluate([[0, 0.525, 0.5, 0.2, 0.2, 0.9]])
+    ap = result["per_class"][0]["ap"]
+    assert ap == [0.995] * 6 + [0.0] * 4
+    assert result["summary"]["map50_95"] == pytest.approx(0.995 * 0.6, abs=1e-4)
+
+
+def test_duplicate_prediction_is_a_false_positive():
+    result = evaluate([[0, 0.5, 0.5, 0.2, 0.2, 0.9], [0, 0.5, 0.5, 0.2, 0.2, 0.8]])
+    assert result["summary"]["map50"] == pytest.approx(0.995)
+    matrix = result["confusion_matrix"]["matrix"]
+    # One match, the second box is predicted on background
+    assert matrix == [[1, 1], [0, 0]]
+
+
+def test_wrong_class_does_not_match():
+    result = evaluate([[1, 0.5, 0.5, 0.2, 0.2, 0.9]], num_classes=2)
+    assert result["summary"]["map50_95"] == 0.0
+    assert result["confusion_matrix"]["matrix"][1][0] == 1
+
+
+def test_images_are_evaluated_together():
+    evaluator = Evaluator(1)
+    evaluator.add(np.array([[0, 0.5, 0.5, 0.2, 0.2, 0.9]]), TARGET)
+    evaluator.add(np.zeros((0, 6)), TARGET)
+    result = evaluator.compute()
+    assert result["images"] == 2
+    assert result["instances"] == 2
+    assert result["per_class"][0]["recall"] == pytest.approx(0.5, abs=1e-3)
+
+
+def test_greedy_match_is_one_to_one_by_descending_iou():
+    gt = np.array([0, 0, 1, 1])
+    pred = np.array([0, 1, 0, 1])
+    iou = np.array([0.9, 0.8, 0.95, 0.6])
+    matched_gt, matched_pred = greedy_match(gt, pred, iou)
+    # Prediction 0 goes to gt 1 (0.95), gt 0 takes prediction 1
+    assert sorted(zip(matched_gt.tolist(), matched_pred.tolist())) == [(0, 1), (1, 0)]
@@ -0,0 +1,163 @@
+import threading
+import time
+
+import pytest
+
+from services.job_service import CANCELLED, PAUSED, QUEUED, RUNNING, SUCCEEDED, JobCancelled, JobPaused, \
+    JobScheduler
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "condition not reached in time"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def scheduler():
+    return JobScheduler(limits={"training": 2, "detection": 1})
+
+
+def blocking_target(release, started):
+    def target(job):
+        started.append(job.id)
+        release.wait(5)
+        job.check_cancelled()
+        return {"done": True}
+    return target
+
+
+def test_running_jobs_stay_within_the_limit_of_their_kind(scheduler):
+    release, started = threading.Event(), []
+    jobs = [scheduler.submit("training", {}, blocking_target(release, started)) for _ in range(5)]
+    wait_for(lambda: len(started) == 2)
+    time.sleep(0.05)
+    assert [job.state for job in jobs] == [RUNNING, RUNNING, QUEUED, QUEUED, QUEUED]
+    assert scheduler.stats()["training"] == {"limit": 2, "running": 2, "queued": 3}
+
+    release.set()
+    wait_for(lambda: all(job.state == SUCCEEDED for job in jobs))
+    assert len(started) == 5
+    assert scheduler.stats()["training"]["running"] == 0
+    assert scheduler.get(jobs[-1].id)["result"] == {"done": True}
+
+
+def test_kinds_have_separate_slots(scheduler):
+    release, started = threading.Event(), []
+    scheduler.submit("training", {}, blocking_target(release, started))
+    scheduler.submit("training", {}, blocking_target(release, started))
+    detection = scheduler.submit("detection", {}, blocking_target(release, started))
+    wait_for(lambda: len(started) == 3)
+    assert detection.state == RUNNING
+    release.set()
+
+
+def test_higher_priority_jobs_start_first(scheduler):
+    release, started = threading.Event(), []
+    first = scheduler.submit("detection", {}, blocking_target(release, started))
+    low = scheduler.submit("detection", {}, blocking_target(release, started), priority=0)
+    high = scheduler.submit("detection", {}, blocking_target(release, started), priority=5)
+    release.set()
+    wait_for(lambda: len(started) == 3)
+    assert started == [first.id, high.id, low.id]
+
+
+def test_cancelled_queued_job_never_runs(scheduler):
+    release, started = threading.Event(), []
+    running = scheduler.submit("detection", {}, blocking_target(release, started))
+    queued = scheduler.submit("detection", {}, blocking_target(release, started))
+    wait_for(lambda: started == [running.id])
+
+    assert scheduler.cancel(queued.id)["state"] == CANCELLED
+    assert scheduler.get(queued.id)["state"] == CANCELLED
+    release.set()
+    wait_for(lambda: running.state == SUCCEEDED)
+    time.sleep(0.05)
+    assert started == [running.id]
+    assert scheduler.stats()["detection"] == {"limit": 1, "running": 0, "queued": 0}
+
+
+def test_cancelling_a_running_job_starts_the_next_one(scheduler):
+    release, started = threading.Event(), []
+
+    def cancellable(job):
+        started.append(job.id)
+        while not job.cancel_requested:
+            time.sleep(0.01)
+        raise JobCancelled()
+
+    running = scheduler.submit("detection", {}, cancellable)
+    queued = scheduler.submit("detection", {}, blocking_target(release, started))
+    wait_for(lambda: started == [running.id])
+
+    scheduler.cancel(running.id)
+    wait_for(lambda: running.state == CANCELLED)
+    wait_for(lambda: queued.state == RUNNING)
+    release.set()
+    wait_for(lambda: queued.state == SUCCEEDED)
+
+
+def test_cancelling_a_finished_job_fails(scheduler):
+    job = scheduler.submit("detection", {}, lambda job: None)
+    wait_for(lambda: job.state == SUCCEEDED)
+    with pytest.raises(Exception):
+        scheduler.cancel(job.id)
+
+
+def pausable_target(requests, started):
+    def target(job):
+        stop = threading.Event()
+        job.pause_handler = lambda immediate: (requests.append(immediate), stop.set())
+        started.append(job.id)
+        stop.wait(5)
+        raise JobPaused()
+    return target
+
+
+def test_paused_job_frees_its_slot(scheduler):
+    requests, started = [], []
+    release = threading.Event()
+    job = scheduler.submit("detection", {}, pausable_target(requests, started))
+    queued = scheduler.submit("detection", {}, blocking_target(release, started))
+    wait_for(lambda: started == [job.id])
+
+    assert scheduler.pause(job.id)["result"] == {"pausing": True}
+    wait_for(lambda: job.state == PAUSED)
+    assert requests == [False]
+    wait_for(lambda: queued.state == RUNNING)
+    release.set()
+    assert scheduler.get(job.id)["state"] == PAUSED
+
+
+def test_repeated_pause_only_escalates_to_immediate(scheduler):
+    requests, started = [], []
+    job = scheduler.submit("detection", {}, pausable_target(requests, started))
+    wait_for(lambda: started == [job.id])
+    stop = job.pause_handler
+    job.pause_handler = lambda immediate: requests.append(immediate)
+    scheduler.pause(job.id)
+    scheduler.pause(job.id)
+    scheduler.pause(job.id, immediate=True)
+    assert requests == [False, True]
+    stop(True)
+    wait_for(lambda: job.state == PAUSED)
+
+
+def test_cancel_while_pausing_ends_cancelled(scheduler):
+    requests, started = [], []
+    job = scheduler.submit("detection", {}, pausable_target(requests, started))
+    wait_for(lambda: started == [job.id])
+    scheduler.cancel(job.id)
+    scheduler.pause(job.id)
+    wait_for(lambda: job.state == CANCELLED)
+
+
+def test_jobs_without_checkpoints_can_not_be_paused(scheduler):
+    release, started = threading.Event(), []
+    job = scheduler.submit("detection", {}, blocking_target(release, started))
+    wait_for(lambda: started == [job.id])
+    with pytest.raises(Exception):
+        scheduler.pause(job.id)
+    release.set()
+    wait_for(lambda: job.state == SUCCEEDED)
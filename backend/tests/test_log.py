@@ -0,0 +1,64 @@
+import pytest
+
+from services import log_service
+from services.log_service import LogBroadcast, archived_log, create_log, follow_log, log_info
+
+
+@pytest.fixture
+def small_buffer(monkeypatch):
+    monkeypatch.setattr(log_service, "MAX_BUFFERED_LINES", 10)
+    monkeypatch.setattr(log_service, "SPILL_BATCH", 4)
+
+
+def data_lines(messages):
+    return [message for message in messages if message.startswith("id: ")]
+
+
+def test_spilled_lines_are_read_back_from_the_archive(tmp_path, small_buffer):
+    broadcast = LogBroadcast("job", "training", str(tmp_path / "job.log.gz"))
+    broadcast.append("\n".join(f"line {i}" for i in range(25)))
+    assert len(broadcast.buffer) <= 10
+    assert broadcast.read(0, timeout=0) == [(i, f"line {i}") for i in range(25)]
+    assert broadcast.read(20, timeout=0) == [(i, f"line {i}") for i in range(20, 25)]
+    broadcast.close()
+    assert broadcast.read(25, timeout=0) == []
+
+
+def test_every_subscriber_gets_the_whole_log(tmp_path):
+    broadcast = create_log("job-subscribers", "training", str(tmp_path / "job.log.gz"))
+    broadcast.append("first\nsecond\n")
+    broadcast.append("third")
+    broadcast.close()
+    streams = [data_lines(follow_log("training", "job-subscribers", heartbeat=0.01)) for _ in range(2)]
+    assert streams[0] == streams[1] == [
+        "id: job-subscribers:0\ndata: first\n\n",
+        "id: job-subscribers:1\ndata: second\n\n",
+        "id: job-subscribers:2\ndata: third\n\n",
+    ]
+
+
+def test_reconnect_continues_after_last_event_id(tmp_path, small_buffer):
+    broadcast = create_log("job-resume", "training", str(tmp_path / "job.log.gz"))
+    broadcast.append("\n".join(f"line {i}" for i in range(30)))
+    broadcast.close()
+    messages = data_lines(follow_log("training", "job-resume", last_event_id="job-resume:4", heartbeat=0.01))
+    assert messages[0] == "id: job-resume:5\ndata: line 5\n\n"
+    assert len(messages) == 25
+
+
+def test_archived_log_replays_its_part_of_a_shared_archive(tmp_path, monkeypatch):
+    path = str(tmp_path / "output.log.gz")
+    first = LogBroadcast("job-first", "training", path)
+    first.append("a\nb")
+    first.close()
+    second = LogBroadcast("job-second", "training", path)
+    assert second.first_line == 2
+    second.append("c\nd\ne")
+    second.close()
+    assert log_info(second) == {"path": path, "first_line": 2, "lines": 3}
+
+    monkeypatch.setattr(log_service.scheduler, "get",
+                        lambda job_id: {"state": "succeeded", "result": {"log": log_info(second)}})
+    replay = archived_log("job-second", "training")
+    assert replay.finished
+    assert replay.read(0, timeout=0) == [(0, "c"), (1, "d"), (2, "e")]
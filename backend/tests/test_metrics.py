@@ -0,0 +1,37 @@
+import pytest
+from flask import Flask
+
+from services import metrics_service
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics_service, "PROFILING_ENABLED", True)
+    monkeypatch.setattr(metrics_service, "PROFILE_DIR", str(tmp_path))
+    app = Flask(__name__)
+    metrics_service.init_app(app)
+    app.add_url_rule("/ok", "ok", lambda: "ok")
+
+    def fail():
+        raise RuntimeError("failed")
+
+    app.add_url_rule("/fail", "fail", fail)
+    return app.test_client()
+
+
+def test_profiled_request_writes_a_dump(client, tmp_path):
+    response = client.get("/ok", headers={"X-Profile": "1"})
+    assert (tmp_path / response.headers["X-Profile-File"]).exists()
+    assert not metrics_service._profile_lock.locked()
+
+
+def test_request_is_not_profiled_while_another_one_is(client):
+    with metrics_service._profile_lock:
+        response = client.get("/ok", headers={"X-Profile": "1"})
+    assert response.status_code == 200
+    assert "X-Profile-File" not in response.headers
+
+
+def test_failed_request_releases_the_profiler(client):
+    assert client.get("/fail", headers={"X-Profile": "1"}).status_code == 500
+    assert not metrics_service._profile_lock.locked()
@@ -0,0 +1,73 @@
+import gzip
+import io
+
+from services.output_service import OutputPump, collapse
+
+
+class Pipe(io.BytesIO):
+    """Subprocess output that arrives in small pieces."""
+
+    def __init__(self, data, size):
+        super().__init__(data)
+        self.size = size
+
+    def read1(self, size=-1):
+        return self.read(self.size)
+
+
+def pump(data, size=4096, log_path=None):
+    forwarded = []
+    lines = OutputPump(Pipe(data, size), on_output=forwarded.append, log_path=log_path, interval=0,
+                       echo=False).run()
+    return "".join(forwarded), lines
+
+
+def test_collapse_keeps_the_last_redraw():
+    assert collapse("10%\r50%\r100%") == "100%"
+    assert collapse("100%\r") == "100%"
+    assert collapse("plain") == "plain"
+
+
+def test_redraws_of_a_finished_line_are_collapsed(tmp_path):
+    log_path = str(tmp_path / "output.log.gz")
+    output, lines = pump(b"start\n 10%\r 50%\r100%\nend\n", log_path=log_path)
+    assert output == "start\n100%\nend\n"
+    assert lines == 3
+    with gzip.open(log_path, "rt") as f:
+        assert f.read() == "start\n100%\nend\n"
+
+
+def test_progress_state_is_forwarded_once():
+    # Read in pieces, the unfinished line is forwarded while it is drawn
+    output, _ = pump(b"x\r50%\r100%\nlast\r 99%", size=5)
+    assert output.splitlines() == ["50%", "100%", " 99%"]
+
+
+def test_trailing_unterminated_line_is_kept(tmp_path):
+    log_path = str(tmp_path / "output.log.gz")
+    output, lines = pump(b"one\ntwo", log_path=log_path)
+    assert output == "one\ntwo\n"
+    assert lines == 2
+    with gzip.open(log_path, "rt") as f:
+        assert f.read() == "one\ntwo\n"
+
+
+def test_line_split_between_reads_is_forwarded_once():
+    output, _ = pump(b"Epoch 1/10 started\n", size=4)
+    assert output == "Epoch 1/10 started\n"
+
+
+def test_ansi_escapes_and_split_utf8_are_handled():
+    output, _ = pump("\x1b[32mgrün\x1b[0m\n".encode("utf-8"), size=3)
+    assert output == "grün\n"
+    output, _ = pump("\r\x1b[32m50%\x1b[0m\r\x1b[32m100%\x1b[0m\n".encode("utf-8"), size=3)
+    assert "\x1b" not in output
+    assert output.splitlines()[-1] == "100%"
+
+
+def test_log_is_appended_to(tmp_path):
+    log_path = str(tmp_path / "output.log.gz")
+    pump(b"first run\n", log_path=log_path)
+    pump(b"resumed\n", log_path=log_path)
+    with gzip.open(log_path, "rt") as f:
+        assert f.read() == "first run\nresumed\n"
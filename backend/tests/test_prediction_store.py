@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from services import prediction_store_service
+from services.evaluation_service import box_iou, xywh_to_xyxy
+from services.prediction_store_service import _image_positions, batched_nms
+
+
+def greedy_nms(boxes, scores, groups, threshold):
+    keep = []
+    for group in np.unique(groups):
+        indexes = np.nonzero(groups == group)[0]
+        indexes = indexes[np.argsort(-scores[indexes], kind="stable")]
+        xyxy = xywh_to_xyxy(boxes[indexes])
+        alive = np.ones(len(indexes), dtype=bool)
+        for i in range(len(indexes)):
+            if alive[i]:
+                keep.append(indexes[i])
+                alive &= ~(box_iou(xyxy[i:i + 1], xyxy)[0] > threshold)
+    return np.sort(keep)
+
+
+@pytest.fixture
+def random_boxes():
+    rng = np.random.default_rng(0)
+    n = 2000
+    boxes = np.column_stack((rng.uniform(0.1, 0.9, n), rng.uniform(0.1, 0.9, n),
+                             rng.uniform(0.02, 0.2, n), rng.uniform(0.02, 0.2, n)))
+    return boxes, rng.random(n), rng.integers(0, 30, n)
+
+
+@pytest.mark.parametrize("pair_chunk", [10 ** 9, 500, 1])
+def test_batched_nms_matches_greedy_nms(random_boxes, monkeypatch, pair_chunk):
+    monkeypatch.setattr(prediction_store_service, "NMS_PAIR_CHUNK", pair_chunk)
+    boxes, scores, groups = random_boxes
+    assert np.array_equal(batched_nms(boxes, scores, groups, 0.5), greedy_nms(boxes, scores, groups, 0.5))
+
+
+def test_batched_nms_keeps_groups_apart():
+    boxes = np.array([[0.5, 0.5, 0.2, 0.2]] * 3)
+    scores = np.array([0.9, 0.8, 0.7])
+    assert batched_nms(boxes, scores, np.array([0, 0, 1]), 0.5).tolist() == [0, 2]
+
+
+def test_batched_nms_suppression_chain():
+    # 1 is suppressed by 0, so 2 (overlapping only 1) is kept
+    boxes = np.array([[0.30, 0.5, 0.2, 0.2], [0.40, 0.5, 0.2, 0.2], [0.50, 0.5, 0.2, 0.2]])
+    scores = np.array([0.9, 0.8, 0.7])
+    assert batched_nms(boxes, scores, np.zeros(3, dtype=np.int64), 0.3).tolist() == [0, 2]
+
+
+def test_batched_nms_empty():
+    assert len(batched_nms(np.zeros((0, 4)), np.zeros(0), np.zeros(0, dtype=np.int64), 0.5)) == 0
+
+
+def test_images_are_matched_by_relative_path_then_unique_stem():
+    store = {"meta": {"images": ["a/img", "other", "dup"]}}
+    images = ["/data/a/img.jpg", "/data/b/img.jpg", "/data/c/other.jpg", "/data/d/dup.jpg", "/data/e/dup.jpg"]
+    assert _image_positions(store, images) == [0, None, 1, None, None]
@@ -0,0 +1,96 @@
+import pytest
+
+from services import sweep_service
+from services.sweep_service import Sweep, create_sweep, expand_space
+
+
+@pytest.fixture
+def jobs(monkeypatch):
+    """Replaces the trainer: trials get fake job ids, their states are set by the test."""
+    states = {}
+
+    def run_training_logic(data, kind, env):
+        if data.get("fail") and len(states) == 1:
+            raise Exception("trainer not available")
+        job_id = f"job{len(states)}"
+        states[job_id] = "running"
+        return {"job_id": job_id, "state": "running"}
+
+    monkeypatch.setattr(sweep_service, "run_training_logic", run_training_logic)
+    monkeypatch.setattr(sweep_service.scheduler, "get", lambda job_id: {"state": states[job_id]})
+    monkeypatch.setattr(sweep_service.scheduler, "cancel", lambda job_id: states.__setitem__(job_id, "cancelled"))
+    monkeypatch.setattr(sweep_service, "get_training_metrics", lambda job_id: {"series": {}})
+    sweep_service._ensure_loaded()
+    return states
+
+
+def make_sweep(trials=4, parallel=2, stopping=None, base=None):
+    config = {"base": base or {"dataDir": "/data"}, "metric": "map50_95", "cores_per_trial": 1,
+              "parallel": parallel, "median_stopping": stopping}
+    return Sweep(config, [{"index": i, "name": f"trial{i}", "params": {"epochs": i + 1}, "job_id": None,
+                           "state": "queued"} for i in range(trials)])
+
+
+def test_expand_grid_and_random():
+    assert expand_space({"epochs": [1, 2], "batchSize": [8, 16]}) == [
+        {"epochs": 1, "batchSize": 8}, {"epochs": 1, "batchSize": 16},
+        {"epochs": 2, "batchSize": 8}, {"epochs": 2, "batchSize": 16}]
+    trials = expand_space({"imageSize": {"min": 320, "max": 640}}, "random", trials=5, seed=1)
+    assert len(trials) == 5 and all(320 <= t["imageSize"] <= 640 for t in trials)
+    with pytest.raises(ValueError):
+        expand_space({"lr": [0.1]})
+
+
+def test_trials_are_submitted_within_the_parallelism_of_the_sweep(jobs, monkeypatch):
+    monkeypatch.setattr(Sweep, "_monitor", lambda self: None)
+    sweep = make_sweep(trials=4, parallel=2)
+    sweep.start()
+    assert [t["job_id"] for t in sweep.trials] == ["job0", "job1", None, None]
+
+    jobs["job0"] = "succeeded"
+    sweep._update()
+    assert [t["job_id"] for t in sweep.trials] == ["job0", "job1", "job2", None]
+    assert sweep.state == "running"
+
+    for job_id in list(jobs):
+        jobs[job_id] = "succeeded"
+    sweep._update()
+    jobs["job3"] = "succeeded"
+    sweep._update()
+    assert sweep.state == "finished"
+
+
+def test_failed_start_cancels_the_queued_trials(jobs):
+    sweep = make_sweep(trials=3, parallel=3, base={"dataDir": "/data", "fail": True})
+    with pytest.raises(Exception, match="trainer not available"):
+        sweep.start()
+    assert jobs == {"job0": "cancelled"}
+
+
+def test_median_stopping_skips_trials_without_epochs(jobs):
+    # Without any grace period the rule applies before the first epoch finished
+    sweep = make_sweep(trials=2, parallel=2, stopping={"grace_epochs": 0, "min_trials": 1})
+    with sweep.lock:
+        sweep._fill()
+    # Neither trial finished an epoch yet; the sweep keeps running instead of failing every poll
+    sweep._update()
+    assert all(t["state"] == "running" and not t.get("stopped_early") for t in sweep.trials)
+
+
+def test_median_stopping_stops_the_worse_trial(jobs, monkeypatch):
+    curves = {"job0": [0.1, 0.2, 0.3], "job1": [0.1, 0.1, 0.1]}
+    monkeypatch.setattr(sweep_service, "get_training_metrics",
+                        lambda job_id: {"series": {"map50_95": curves[job_id]}})
+    sweep = make_sweep(trials=2, parallel=2, stopping={"grace_epochs": 2, "min_trials": 1})
+    with sweep.lock:
+        sweep._fill()
+    sweep._update()
+    assert sweep.trials[1]["stopped_early"]["epoch"] == 2
+    assert jobs["job1"] == "cancelled"
+    assert not sweep.trials[0].get("stopped_early")
+
+
+@pytest.mark.parametrize("stopping", [{"grace_epochs": 0}, {"min_trials": 0}])
+def test_invalid_median_stopping_is_rejected(stopping):
+    with pytest.raises(ValueError):
+        create_sweep({"base": {"dataDir": "/data"}, "space": {"epochs": [1, 2]}, "median_stopping": stopping})
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from tiling import merge_detections, tile_windows
+
+
+def test_tile_windows_cover_the_image():
+    windows = tile_windows(1000, 700, 400, 0.2)
+    covered = np.zeros((700, 1000), dtype=bool)
+    for x0, y0, x1, y1 in windows:
+        assert x1 - x0 == 400 and y1 - y0 == 400
+        covered[y0:y1, x0:x1] = True
+    assert covered.all()
+    # The last column and row end at the border instead of running past it
+    assert max(x1 for _, _, x1, _ in windows) == 1000
+    assert max(y1 for _, _, _, y1 in windows) == 700
+
+
+def test_tile_windows_overlap():
+    xs = sorted({x0 for x0, _, _, _ in tile_windows(2000, 400, 500, 0.2)})
+    assert xs[:3] == [0, 400, 800]
+
+
+def test_small_image_is_one_window():
+    assert tile_windows(300, 200, 640, 0.2) == [(0, 0, 300, 200)]
+
+
+def test_nms_merge_keeps_most_confident_box_per_class():
+    detections = np.array([[0, 0, 100, 100, 0.6, 0], [2, 2, 100, 100, 0.9, 0], [0, 0, 100, 100, 0.5, 1]],
+                          dtype=np.float32)
+    merged = merge_detections(detections, "nms", 0.5, "iou")
+    assert merged[:, 4].tolist() == pytest.approx([0.9, 0.5])
+    assert merged[:, 5].tolist() == [0, 1]
+
+
+def test_ios_matches_box_cut_by_a_tile_border():
+    # The right half of an object seen by one tile, the whole object by the full image
+    detections = np.array([[0, 0, 100, 100, 0.9, 0], [50, 0, 100, 100, 0.8, 0]], dtype=np.float32)
+    assert len(merge_detections(detections, "nms", 0.5, "iou")) == 2
+    assert len(merge_detections(detections, "nms", 0.5, "ios")) == 1
+
+
+def test_wbf_by_ios_keeps_the_extent_of_the_group():
+    detections = np.array([[0, 0, 100, 100, 0.9, 0], [50, 0, 100, 100, 0.8, 0], [0, 0, 40, 100, 0.7, 0]],
+                          dtype=np.float32)
+    merged = merge_detections(detections, "wbf", 0.5, "ios")
+    assert merged.tolist() == [pytest.approx([0, 0, 100, 100, 0.9, 0])]
+
+
+def test_wbf_by_iou_averages_weighted_by_confidence():
+    detections = np.array([[0, 0, 100, 100, 0.75, 0], [10, 0, 110, 100, 0.25, 0]], dtype=np.float32)
+    merged = merge_detections(detections, "wbf", 0.5, "iou")
+    assert merged[0].tolist() == pytest.approx([2.5, 0, 102.5, 100, 0.75, 0])
+
+
+def test_merge_rejects_unknown_options():
+    with pytest.raises(ValueError):
+        merge_detections(np.zeros((0, 6)), "mean")
+    with pytest.raises(ValueError):
+        merge_detections(np.zeros((0, 6)), "nms", metric="giou")
@@ -0,0 +1,14 @@
+from types import SimpleNamespace
+
+from services import training_metrics_service
+from services.training_metrics_service import create_parser
+
+
+def test_parsers_of_running_jobs_are_not_evicted(monkeypatch):
+    monkeypatch.setattr(training_metrics_service, "MAX_PARSERS", 3)
+    monkeypatch.setattr(training_metrics_service, "_parsers", training_metrics_service.OrderedDict())
+    monkeypatch.setattr(training_metrics_service.scheduler, "active_jobs",
+                        lambda kind=None: [SimpleNamespace(id="running-0"), SimpleNamespace(id="running-1")])
+    for job_id in ("running-0", "finished-0", "running-1", "finished-1", "finished-2"):
+        create_parser(job_id)
+    assert list(training_metrics_service._parsers) == ["running-0", "running-1", "finished-2"]
@@ -0,0 +1,454 @@
+"""
+Long-lived inference worker.
+
+The worker is started by services/inference_service.py with the Python interpreter
+of the model's conda environment and with the model repository (e.g. "yolov5") as
+its working directory. It keeps loaded models in an LRU cache and answers requests
+sent as JSON lines on stdin. Responses are written as JSON lines to the original
+stdout; everything the model code prints is redirected to stderr so it can never
+corrupt the protocol stream.
+
+Every request carries an "id" and an "op". A request produces zero or more
+intermediate messages followed by exactly one message with "done": true.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+
+IMAGE_EXTENSIONS = ('.bmp', '.jpg', '.jpeg', '.png', '.tif', '.tiff', '.webp')
+
+
+class ModelCache:
+    """
+    LRU cache of loaded models keyed by (model family, training run, img_size, weights file)
+    and the mtime and size of the weights file, so retrained or re-exported weights are
+    loaded again instead of being served from the cache.
+
+    The cache is bounded both by the number of entries and by the approximate memory
+    taken by the parameters and buffers of the cached models. The least recently used
+    models are evicted first.
+    """
+
+    def __init__(self, family, max_models, max_bytes):
+        self.family = family
+        self.max_models = max_models
+        self.max_bytes = max_bytes
+        self.models = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, training_run, weights, img_size):
+        # The weights tell the PyTorch model and the ONNX export of a run apart
+        key = (self.family, training_run, int(img_size), weights, weights_version(weights))
+        entry = self.models.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.models.move_to_end(key)
+            return entry["model"]
+
+        # Entries of older versions of the same weights file are never hit again
+        for stale in [k for k in self.models if k[:4] == key[:4]]:
+            del self.models[stale]
+            self.evictions += 1
+
+        started = time.perf_counter()
+        model = load_model(weights)
+        warmup(model, int(img_size))
+        self.misses += 1
+        entry = {
+            "model": model,
+            "weights": weights,
+            "bytes": model_size_bytes(model, weights),
+            "load_seconds": round(time.perf_counter() - started, 3),
+        }
+        self.models[key] = entry
+        self._evict(keep=key)
+        return model
+
+    def _evict(self, keep):
+        while len(self.models) > 1 and (len(self.models) > self.max_models or self.total_bytes() > self.max_bytes):
+            key = next(iter(self.models))
+            if key == keep:
+                break
+            del self.models[key]
+            self.evictions += 1
+            release_memory()
+
+    def clear(self):
+        self.models.clear()
+        release_memory()
+
+    def total_bytes(self):
+        return sum(entry["bytes"] for entry in self.models.values())
+
+    def stats(self):
+        return {
+            "family": self.family,
+            "max_models": self.max_models,
+            "max_bytes": self.max_bytes,
+            "total_bytes": self.total_bytes(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "models": [
+                {
+                    "training_run": key[1],
+                    "img_size": key[2],
+                    "weights": entry["weights"],
+                    "bytes": entry["bytes"],
+                    "load_seconds": entry["load_seconds"],
+                }
+                for key, entry in self.models.items()
+            ],
+        }
+
+
+def weights_version(weights):
+    """Returns (mtime in ns, size) of a weights file, None if it does not exist."""
+    try:
+        stat = os.stat(weights)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def load_model(weights):
+    """Loads a trained checkpoint through the repository's own hubconf (AutoShape wrapper)."""
+    import torch
+
+    if not os.path.exists(weights):
+        raise FileNotFoundError(f"Weight file not found: {weights}")
+    model = torch.hub.load(os.getcwd(), "custom", weights, source="local")
+    model.eval()
+    return model
+
+
+def warmup(model, img_size):
+    import numpy as np
+
+    model(np.zeros((img_size, img_size, 3), dtype=np.uint8), size=img_size)
+
+
+def model_size_bytes(model, weights=None):
+    """Approximate memory of a loaded model: its parameters and buffers."""
+    size = 0
+    for tensor in list(model.parameters()) + list(model.buffers()):
+        size += tensor.numel() * tensor.element_size()
+    if weights and not weights.endswith((".pt", ".pth")) and os.path.exists(weights):
+        # ONNX Runtime keeps the weights in its session, outside the module; the file holds them all
+        size = max(size, os.path.getsize(weights))
+    return size
+
+
+def release_memory():
+    import gc
+
+    import torch
+
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def list_images(source):
+    """Expands a source (directory, glob, single file or list of files) into image paths."""
+    if isinstance(source, (list, tuple)):
+        return [p for p in source if p.lower().endswith(IMAGE_EXTENSIONS)]
+    if os.path.isdir(source):
+        files = sorted(glob.glob(os.path.join(source, "*.*")))
+    elif "*" in source:
+        files = sorted(glob.glob(source, recursive=True))
+    elif os.path.isfile(source):
+        files = [source]
+    else:
+        raise FileNotFoundError(f"Source not found: {source}")
+    return [p for p in files if p.lower().endswith(IMAGE_EXTENSIONS)]
+
+
+def class_names(results):
+    names = results.names
+    return names if isinstance(names, dict) else dict(enumerate(names))
+
+
+def rendered_images(results):
+    # YOLOv5 keeps the images in "ims", YOLOv7 in "imgs"
+    return getattr(results, "ims", None) or getattr(results, "imgs")
+
+
+def filter_results(results, conf):
+    """Drops detections below conf from a Detections object (in place, before rendering)."""
+    keeps = [pred[:, 4] >= conf for pred in results.pred]
+    # YOLOv5 shares the pred list as xyxy, every list may only be filtered once
+    lists = {}
+    for attribute in ("pred", "xyxy", "xywh", "xyxyn", "xywhn"):
+        values = getattr(results, attribute, None)
+        if values is not None:
+            lists[id(values)] = values
+    for values in lists.values():
+        for i, keep in enumerate(keeps):
+            values[i] = values[i][keep]
+
+
+def save_image(array, path):
+    from PIL import Image
+
+    Image.fromarray(array).save(path)
+
+
+def handle_detect(cache, request, emit):
+    """
+    Runs detection on all images of request["source"] and optionally saves annotated
+    images into request["save_dir"] (the same layout detect.py produces).
+    """
+    img_size = int(request.get("img_size", 640))
+    batch_size = max(1, int(request.get("batch_size", 8)))
+    save_dir = request.get("save_dir")
+    render = request.get("render", True) and bool(save_dir)
+
+    # Predictions in the YOLO text format of detect.py --save-txt --save-conf, used by the evaluator
+    save_txt = request.get("save_txt", False) and bool(save_dir)
+    conf = float(request.get("conf", 0.25))
+    # With store_conf the saved predictions go down to that confidence (for the prediction store),
+    # the returned and rendered detections are still cut at conf
+    store_conf = request.get("store_conf")
+    model_conf = min(conf, float(store_conf)) if save_txt and store_conf is not None else conf
+
+    model = cache.get(request["training_run"], request["weights"], img_size)
+    model.conf = model_conf
+    model.iou = float(request.get("iou", 0.45))
+
+    images = list_images(request["source"])
+    if save_dir:
+        os.makedirs(save_dir, exist_ok=True)
+    if save_txt:
+        os.makedirs(os.path.join(save_dir, "labels"), exist_ok=True)
+
+    timings = {"inference": 0.0, "render": 0.0}
+    for start in range(0, len(images), batch_size):
+        batch = images[start:start + batch_size]
+        started = time.perf_counter()
+        results = model(batch, size=img_size)
+        timings["inference"] += time.perf_counter() - started
+
+        if save_txt:
+            for path, boxes in zip(batch, results.xywhn):
+                stem = os.path.splitext(os.path.basename(path))[0]
+                with open(os.path.join(save_dir, "labels", f"{stem}.txt"), "w") as f:
+                    for x, y, w, h, score, cls in boxes.tolist():
+                        f.write(f"{int(cls)} {x:.6g} {y:.6g} {w:.6g} {h:.6g} {score:.6g}\n")
+            if model_conf < conf:
+                filter_results(results, conf)
+
+        names = class_names(results)
+        items = []
+        for path, boxes in zip(batch, results.xyxy):
+            items.append({
+                "path": path,
+                "name": os.path.basename(path),
+                "detections": [
+                    {
+                        "class_id": int(row[5]),
+                        "class": names.get(int(row[5]), str(int(row[5]))),
+                        "conf": round(float(row[4]), 5),
+                        "xyxy": [round(float(v), 2) for v in row[:4]],
+                    }
+                    for row in boxes.tolist()
+                ],
+            })
+
+        if render:
+            started = time.perf_counter()
+            results.render()
+            for item, array in zip(items, rendered_images(results)):
+                item["output"] = os.path.join(save_dir, item["name"])
+                save_image(array, item["output"])
+            timings["render"] += time.perf_counter() - started
+
+        emit({"event": "batch", "images": items})
+
+    emit({
+        "done": True,
+        "count": len(images),
+        "timings": {k: round(v, 4) for k, v in timings.items()},
+    })
+
+
+def handle_tiled(cache, request, emit):
+    """
+    Runs tiled detection (see tiling.py) on all images of request["source"]. Takes the
+    same options as handle_detect plus tile_size, overlap, workers, merge, merge_iou,
+    match and full_image; batch_size counts tiles. One message is emitted per image.
+    """
+    from tiling import TiledDetector
+
+    tile_size = int(request.get("tile_size", 640))
+    save_dir = request.get("save_dir")
+    render = request.get("render", True) and bool(save_dir)
+    save_txt = request.get("save_txt", False) and bool(save_dir)
+    conf = float(request.get("conf", 0.25))
+    store_conf = request.get("store_conf")
+    model_conf = min(conf, float(store_conf)) if save_txt and store_conf is not None else conf
+
+    model = cache.get(request["training_run"], request["weights"], tile_size)
+    model.conf = model_conf
+    model.iou = float(request.get("iou", 0.45))
+    names = model.names if isinstance(model.names, dict) else dict(enumerate(model.names))
+
+    detector = TiledDetector(
+        model,
+        tile_size=tile_size,
+        overlap=float(request.get("overlap", 0.2)),
+        batch_size=int(request.get("batch_size", 8)),
+        workers=int(request.get("workers", 2)),
+        merge=request.get("merge", "nms"),
+        merge_threshold=float(request.get("merge_iou", 0.5)),
+        match=request.get("match", "ios"),
+        full_image=request.get("full_image", True),
+    )
+
+    images = list_images(request["source"])
+    if save_dir:
+        os.makedirs(save_dir, exist_ok=True)
+    if save_txt:
+        os.makedirs(os.path.join(save_dir, "labels"), exist_ok=True)
+
+    timings = {"render": 0.0}
+    started_all = time.perf_counter()
+    for path, image, detections, tiles in detector.run(images):
+        height, width = image.shape[:2]
+        name = os.path.basename(path)
+        if save_txt:
+            with open(os.path.join(save_dir, "labels", f"{os.path.splitext(name)[0]}.txt"), "w") as f:
+                for x1, y1, x2, y2, score, cls in detections.tolist():
+                    f.write(f"{int(cls)} {(x1 + x2) / 2 / width:.6g} {(y1 + y2) / 2 / height:.6g} "
+                            f"{(x2 - x1) / width:.6g} {(y2 - y1) / height:.6g} {score:.6g}\n")
+        detections = detections[detections[:, 4] >= conf]
+
+        item = {
+            "path": path,
+            "name": name,
+            "width": width,
+            "height": height,
+            "tiles": tiles,
+            "detections": [
+                {
+                    "class_id": int(row[5]),
+                    "class": names.get(int(row[5]), str(int(row[5]))),
+                    "conf": round(float(row[4]), 5),
+                    "xyxy": [round(float(v), 2) for v in row[:4]],
+                }
+                for row in detections.tolist()
+            ],
+        }
+        if render:
+            import cv2
+            from video_pipeline import _draw
+
+            started = time.perf_counter()
+            item["output"] = os.path.join(save_dir, name)
+            save_image(_draw(cv2, image.copy(), item["detections"]), item["output"])
+            timings["render"] += time.perf_counter() - started
+        emit({"event": "batch", "images": [item]})
+
+    timings.update(detector.timings)
+    emit({
+        "done": True,
+        "count": len(images),
+        "tiles": detector.tiles,
+        "timings": {k: round(v, 4) for k, v in timings.items()},
+        "seconds": round(time.perf_counter() - started_all, 4),
+    })
+
+
+def handle_video(cache, request, emit):
+    """
+    Runs the pipelined decode/infer/encode detection over a video file or a folder of
+    frames (see video_pipeline.py) and reports progress with per-stage fps.
+
+    If request["cancel_file"] appears on disk, the run stops at the next progress report.
+    """
+    from video_pipeline import run_video
+
+    img_size = int(request.get("img_size", 640))
+    model = cache.get(request["training_run"], request["weights"], img_size)
+    model.conf = float(request.get("conf", 0.25))
+    model.iou = float(request.get("iou", 0.45))
+    cancel_file = request.get("cancel_file")
+
+    def progress(stats):
+        if cancel_file and os.path.exists(cancel_file):
+            raise InterruptedError("Video detection cancelled")
+        emit({"event": "progress", **stats})
+
+    result = run_video(
+        model,
+        request["source"],
+        img_size,
+        request["save_dir"],
+        batch_size=max(1, int(request.get("batch_size", 8))),
+        stride=int(request.get("stride", 1)),
+        render=request.get("render", True),
+        queue_size=int(request.get("queue_size", 32)),
+        progress=progress,
+        progress_every=int(request.get("progress_every", 50)),
+    )
+    emit({"done": True, **result})
+
+
+def handle_stats(cache, request, emit):
+    emit({"done": True, "cache": cache.stats()})
+
+
+def handle_clear(cache, request, emit):
+    cache.clear()
+    emit({"done": True, "cache": cache.stats()})
+
+
+HANDLERS = {
+    "detect": handle_detect,
+    "tiled": handle_tiled,
+    "video": handle_video,
+    "stats": handle_stats,
+    "clear": handle_clear,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--family", required=True)
+    parser.add_argument("--max-models", type=int, default=3)
+    parser.add_argument("--max-bytes", type=int, default=2 * 1024 ** 3)
+    args = parser.parse_args()
+
+    # Keep the real stdout for the protocol, everything else goes to stderr
+    protocol = sys.stdout
+    sys.stdout = sys.stderr
+    cache = ModelCache(args.family, args.max_models, args.max_bytes)
+
+    for raw in sys.stdin:
+        if not raw.strip():
+            continue
+        request = json.loads(raw)
+        request_id = request.get("id")
+
+        def emit(message):
+            message["id"] = request_id
+            protocol.write(json.dumps(message) + "\n")
+            protocol.flush()
+
+        try:
+            handler = HANDLERS.get(request.get("op"))
+            if handler is None:
+                raise ValueError(f"Unknown operation: {request.get('op')}")
+            handler(cache, request, emit)
+        except Exception as e:
+            emit({"done": True, "error": f"{type(e).__name__}: {e}"})
+
+
+if __name__ == "__main__":
+    main()
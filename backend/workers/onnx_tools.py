@@ -0,0 +1,283 @@
+"""
+ONNX helpers used by services/export_service.py.
+
+The script runs with the Python interpreter of the model's conda environment and
+with the model repository (e.g. "yolov5") as its working directory, whose models/
+and utils/ packages it uses:
+
+    python onnx_tools.py optimize --input raw.onnx --output model.onnx
+    python onnx_tools.py parity --weights best.pt --onnx model.onnx --img 640 [--images DIR] [--samples 8]
+    python onnx_tools.py quantize --input model.onnx --output model.int8.onnx --method static --images DIR
+
+Every command prints its result as one JSON line, the last line of stdout.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+IMAGE_EXTENSIONS = ('.bmp', '.jpg', '.jpeg', '.png', '.tif', '.tiff', '.webp')
+
+
+def use_repository():
+    """Makes the model repository (working directory) importable and installs the ONNX runtime if missing."""
+    sys.path.insert(0, os.getcwd())
+    from utils.general import check_requirements
+
+    check_requirements(("onnx", "onnxruntime"))
+
+
+def optimize(args):
+    """
+    Applies the ONNX Runtime graph optimizations (constant folding, redundant node
+    elimination, Conv/BatchNorm/activation fusion) once and saves the result, so
+    sessions created later start from the optimized graph. The extended level is the
+    highest whose output does not depend on the machine it was created on.
+    """
+    import onnx
+    import onnxruntime as ort
+
+    started = time.perf_counter()
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+    options.optimized_model_filepath = args.output
+    ort.InferenceSession(args.input, options, providers=["CPUExecutionProvider"])
+    return {
+        "level": "extended",
+        "nodes_before": len(onnx.load(args.input).graph.node),
+        "nodes_after": len(onnx.load(args.output).graph.node),
+        "seconds": round(time.perf_counter() - started, 3),
+        "onnxruntime": ort.__version__,
+    }
+
+
+def sample_images(folder, samples):
+    """Evenly spaced sample of the images of a folder (recursively)."""
+    if not folder or not os.path.isdir(folder):
+        return []
+    files = sorted(p for p in glob.glob(os.path.join(folder, "**", "*.*"), recursive=True)
+                   if p.lower().endswith(IMAGE_EXTENSIONS))
+    if len(files) <= samples:
+        return files
+    step = len(files) / samples
+    return [files[int(i * step)] for i in range(samples)]
+
+
+def load_inputs(paths, img_size, samples, stride):
+    """Letterboxed input tensors of the sampled images, random images if there are none."""
+    import cv2
+    import numpy as np
+    import torch
+    from utils.augmentations import letterbox
+
+    arrays = []
+    for path in paths:
+        image = cv2.imread(path)
+        if image is not None:
+            arrays.append(letterbox(image, img_size, stride=stride, auto=False)[0])
+    if not arrays:
+        generator = np.random.default_rng(0)
+        arrays = [generator.integers(0, 256, (img_size, img_size, 3), dtype=np.uint8) for _ in range(samples)]
+    for array in arrays:
+        array = np.ascontiguousarray(array.transpose((2, 0, 1))[::-1])  # HWC BGR -> CHW RGB
+        yield torch.from_numpy(array).float()[None] / 255
+
+
+def first_output(prediction):
+    return prediction[0] if isinstance(prediction, (list, tuple)) else prediction
+
+
+def box_agreement(reference, candidate, min_iou=0.9):
+    """Share of detections with a same-class counterpart of IoU >= min_iou (relative to the larger set)."""
+    from utils.metrics import box_iou
+
+    if len(reference) == 0 and len(candidate) == 0:
+        return 1.0
+    if len(reference) == 0 or len(candidate) == 0:
+        return 0.0
+    iou = box_iou(reference[:, :4], candidate[:, :4])
+    iou[reference[:, 5:6] != candidate[:, 5].unsqueeze(0)] = 0
+    matched = int((iou.max(dim=1).values >= min_iou).sum())
+    return matched / max(len(reference), len(candidate))
+
+
+def timed(model, tensor):
+    started = time.perf_counter()
+    output = first_output(model(tensor))
+    return output, time.perf_counter() - started
+
+
+def parity(args):
+    """
+    Runs the PyTorch and the ONNX model on the same inputs and compares the raw outputs
+    and the detections after NMS. Also measures the latency of both on the CPU.
+    """
+    import torch
+    from models.common import DetectMultiBackend
+    from utils.general import non_max_suppression
+
+    device = torch.device("cpu")
+    reference = DetectMultiBackend(args.weights, device=device)
+    candidate = DetectMultiBackend(args.onnx, device=device)
+    inputs = list(load_inputs(sample_images(args.images, args.samples), args.img, args.samples, reference.stride))
+
+    # The first call of both includes one-time initialization, it is not measured
+    with torch.no_grad():
+        first_output(reference(inputs[0]))
+        first_output(candidate(inputs[0]))
+
+    max_diff, mean_diffs, agreements, reference_seconds, candidate_seconds = 0.0, [], [], 0.0, 0.0
+    with torch.no_grad():
+        for tensor in inputs:
+            expected, seconds = timed(reference, tensor)
+            reference_seconds += seconds
+            actual, seconds = timed(candidate, tensor)
+            candidate_seconds += seconds
+            diff = (expected.float() - actual.float()).abs()
+            max_diff = max(max_diff, float(diff.max()))
+            mean_diffs.append(float(diff.mean()))
+            agreements.append(box_agreement(non_max_suppression(expected, args.conf, args.iou)[0],
+                                            non_max_suppression(actual, args.conf, args.iou)[0]))
+
+    return {
+        "samples": len(inputs),
+        "real_images": bool(sample_images(args.images, args.samples)),
+        "max_abs_diff": round(max_diff, 6),
+        "mean_abs_diff": round(sum(mean_diffs) / len(mean_diffs), 6),
+        "box_agreement": round(sum(agreements) / len(agreements), 4),
+        "pytorch_ms": round(reference_seconds / len(inputs) * 1000, 2),
+        "onnx_ms": round(candidate_seconds / len(inputs) * 1000, 2),
+        "speedup": round(reference_seconds / candidate_seconds, 2) if candidate_seconds else None,
+    }
+
+
+def head_nodes(path):
+    """
+    Nodes of the Detect head from its first Reshape on: the box decoding (sigmoid, grid
+    and anchor arithmetic in pixels) loses most accuracy when quantized, so it stays FP32.
+    """
+    import onnx
+
+    nodes = onnx.load(path).graph.node
+    first = next((i for i, node in enumerate(nodes) if node.op_type == "Reshape"), None)
+    return [node.name for node in nodes[first:]] if first is not None else []
+
+
+def calibration_reader(input_name, tensors):
+    """Feeds the calibration images to the ONNX Runtime calibrator."""
+    from onnxruntime.quantization import CalibrationDataReader
+
+    class Reader(CalibrationDataReader):
+        def __init__(self):
+            self.items = iter([{input_name: tensor.numpy()} for tensor in tensors])
+
+        def get_next(self):
+            return next(self.items, None)
+
+    return Reader()
+
+
+def session_latency(path, tensors, repeats=3):
+    """Mean latency in ms per image of an ONNX Runtime CPU session."""
+    import onnxruntime as ort
+
+    session = ort.InferenceSession(path, providers=["CPUExecutionProvider"])
+    input_name = session.get_inputs()[0].name
+    session.run(None, {input_name: tensors[0].numpy()})
+    started = time.perf_counter()
+    for _ in range(repeats):
+        for tensor in tensors:
+            session.run(None, {input_name: tensor.numpy()})
+    return (time.perf_counter() - started) / (repeats * len(tensors)) * 1000
+
+
+def quantize(args):
+    """
+    Quantizes an ONNX model to INT8.
+
+    static: weights and activations in INT8 (QDQ format, per-channel weights), activation
+    ranges calibrated (MinMax) on the sampled images; the fastest on CPUs with VNNI/AVX512.
+    dynamic: INT8 weights, activation ranges computed at run time; needs no calibration.
+    """
+    import onnxruntime as ort
+    from onnxruntime.quantization import CalibrationMethod, QuantFormat, QuantType, quantize_dynamic, \
+        quantize_static
+
+    started = time.perf_counter()
+    images = sample_images(args.images, args.samples)
+    tensors = list(load_inputs(images, args.img, args.samples, 32))
+    if args.method == "dynamic":
+        excluded = head_nodes(args.input) if args.keep_head_fp32 else []
+        quantize_dynamic(args.input, args.output, weight_type=QuantType.QUInt8, nodes_to_exclude=excluded)
+    else:
+        source = args.input
+        try:
+            # Shape inference and graph cleanup improve the calibration, not all versions have it
+            from onnxruntime.quantization.shape_inference import quant_pre_process
+
+            source = args.output + ".pre.onnx"
+            quant_pre_process(args.input, source)
+        except Exception as e:
+            print(f"Quantization pre-processing skipped: {e}")
+            source = args.input
+        excluded = head_nodes(source) if args.keep_head_fp32 else []
+        input_name = ort.InferenceSession(source, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+        quantize_static(source, args.output, calibration_reader(input_name, tensors),
+                        quant_format=QuantFormat.QDQ, per_channel=True, activation_type=QuantType.QUInt8,
+                        weight_type=QuantType.QInt8, calibrate_method=CalibrationMethod.MinMax,
+                        nodes_to_exclude=excluded)
+        if source != args.input:
+            os.remove(source)
+    quantize_seconds = time.perf_counter() - started
+
+    fp32_ms = session_latency(args.input, tensors[:4])
+    int8_ms = session_latency(args.output, tensors[:4])
+    return {
+        "method": args.method,
+        "calibration_images": len(images) if args.method == "static" else 0,
+        "excluded_nodes": len(excluded),
+        "bytes_fp32": os.path.getsize(args.input),
+        "bytes_int8": os.path.getsize(args.output),
+        "fp32_ms": round(fp32_ms, 2),
+        "int8_ms": round(int8_ms, 2),
+        "speedup": round(fp32_ms / int8_ms, 2) if int8_ms else None,
+        "seconds": round(quantize_seconds, 3),
+    }
+
+
+COMMANDS = {
+    "optimize": optimize,
+    "parity": parity,
+    "quantize": quantize,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=sorted(COMMANDS))
+    parser.add_argument("--input")
+    parser.add_argument("--output")
+    parser.add_argument("--weights")
+    parser.add_argument("--onnx")
+    parser.add_argument("--img", type=int, default=640)
+    parser.add_argument("--images")
+    parser.add_argument("--samples", type=int, default=8)
+    parser.add_argument("--conf", type=float, default=0.25)
+    parser.add_argument("--iou", type=float, default=0.45)
+    parser.add_argument("--method", choices=("static", "dynamic"), default="static")
+    parser.add_argument("--keep-head-fp32", type=int, default=1)
+    args = parser.parse_args()
+
+    # Keep stdout for the result, the model code prints to stderr
+    result_stream = sys.stdout
+    sys.stdout = sys.stderr
+    use_repository()
+    result = COMMANDS[args.command](args)
+    result_stream.write(json.dumps(result) + "\n")
+    result_stream.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""
+Tiled (sliced) detection of large images used by inference_worker.py.
+
+Resizing an 8000px aerial image to the model's img_size shrinks small objects to a
+few pixels. In tiled mode every image is cut into overlapping tiles of tile_size
+pixels, the tiles are passed to the model in batches at their native resolution,
+the boxes are shifted back to image coordinates and the duplicates found in the
+overlaps are merged per class with NMS or weighted box fusion (WBF):
+
+    decode (pool) --> crop tiles (pool) --> batched inference --> merge --> render/save
+
+Decoding of the next image and cropping of the next batch run in a thread pool
+while the model works on the current batch. Every stage is timed.
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+MERGE_METHODS = ("nms", "wbf")
+MATCH_METRICS = ("ios", "iou")
+# Largest image (in pixels) tiled mode decodes; Pillow's default is far below aerial imagery,
+# but without any limit a crafted file could still exhaust the worker's memory
+MAX_IMAGE_PIXELS = int(os.environ.get("TILED_MAX_IMAGE_PIXELS", 1_000_000_000))
+
+
+def tile_windows(width, height, tile_size, overlap):
+    """
+    Returns the (x0, y0, x1, y1) windows covering an image.
+
+    Neighbouring tiles share overlap * tile_size pixels; the last row and column are
+    aligned with the image border instead of running past it. Images not larger than
+    a tile give one window.
+    """
+    step = max(1, int(round(tile_size * (1 - overlap))))
+
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        positions = list(range(0, length - tile_size, step))
+        positions.append(length - tile_size)
+        return positions
+
+    return [(x, y, min(x + tile_size, width), min(y + tile_size, height))
+            for y in starts(height) for x in starts(width)]
+
+
+def _pairwise_overlap(box, boxes, metric):
+    """IoU or intersection over the smaller box (IoS) of one box against many (xyxy rows)."""
+    x1 = np.maximum(box[0], boxes[:, 0])
+    y1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[2], boxes[:, 2])
+    y2 = np.minimum(box[3], boxes[:, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    if metric == "ios":
+        denominator = np.minimum(area, areas)
+    else:
+        denominator = area + areas - intersection
+    return intersection / np.maximum(denominator, 1e-9)
+
+
+def merge_detections(detections, method="nms", threshold=0.5, metric="ios"):
+    """
+    Merges duplicate boxes of the same class.
+
+    Args:
+        detections (np.ndarray): Rows of x1, y1, x2, y2, conf, class in image coordinates.
+        method (str): "nms" keeps the most confident box of every group, "wbf" replaces
+                      the group by the confidence-weighted mean box with the best confidence
+                      (matched by ios: by the extent of the whole group, see below).
+        threshold (float): Overlap above which two boxes are duplicates.
+        metric (str): "ios" (intersection over the smaller box) also matches the partial
+                      box of an object cut by a tile border; "iou" is the usual NMS overlap.
+
+    Returns:
+        np.ndarray: The merged rows, most confident first.
+    """
+    if method not in MERGE_METHODS:
+        raise ValueError(f"Unknown merge method '{method}', expected one of {', '.join(MERGE_METHODS)}")
+    if metric not in MATCH_METRICS:
+        raise ValueError(f"Unknown match metric '{metric}', expected one of {', '.join(MATCH_METRICS)}")
+    if len(detections) == 0:
+        return detections.reshape(0, 6)
+
+    merged = []
+    for cls in np.unique(detections[:, 5]):
+        rows = detections[detections[:, 5] == cls]
+        rows = rows[np.argsort(-rows[:, 4], kind="stable")]
+        remaining = np.ones(len(rows), dtype=bool)
+        for i in range(len(rows)):
+            if not remaining[i]:
+                continue
+            overlap = _pairwise_overlap(rows[i], rows, metric)
+            group = remaining & (overlap > threshold)
+            group[i] = True
+            remaining &= ~group
+            if method == "nms":
+                merged.append(rows[i])
+                continue
+            members = rows[group]
+            if metric == "ios":
+                # The group holds partial boxes of an object cut by tile borders, their mean
+                # would shrink the box; the group's extent covers the whole object
+                box = np.concatenate([members[:, :2].min(axis=0), members[:, 2:4].max(axis=0)])
+            else:
+                weights = members[:, 4:5]
+                box = (members[:, :4] * weights).sum(axis=0) / weights.sum()
+            merged.append(np.concatenate([box, [rows[i, 4], cls]]))
+
+    merged = np.array(merged, dtype=np.float32)
+    return merged[np.argsort(-merged[:, 4], kind="stable")]
+
+
+def _load_image(path):
+    from PIL import Image
+
+    # Aerial and satellite images easily exceed Pillow's default decompression bomb limit
+    Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+    with Image.open(path) as image:
+        return np.asarray(image.convert("RGB"))
+
+
+def _crop(image, windows):
+    return [np.ascontiguousarray(image[y0:y1, x0:x1]) for x0, y0, x1, y1 in windows]
+
+
+class TiledDetector:
+    """
+    Runs tiled detection with a loaded AutoShape model (conf/iou already set).
+
+    Args:
+        model: Loaded AutoShape model.
+        tile_size (int): Tile edge in pixels, also the inference size of the tiles.
+        overlap (float): Fraction of a tile shared with its neighbour (0 to 0.9).
+        batch_size (int): Tiles passed to the model at once.
+        workers (int): Threads decoding images and cropping tiles ahead of the model.
+        merge (str): "nms" or "wbf" (see merge_detections).
+        merge_threshold (float): Overlap of duplicates.
+        match (str): "ios" or "iou".
+        full_image (bool): Also detect on the whole image resized to tile_size, which finds
+                           objects larger than a tile.
+    """
+
+    def __init__(self, model, tile_size=640, overlap=0.2, batch_size=8, workers=2, merge="nms",
+                 merge_threshold=0.5, match="ios", full_image=True):
+        if tile_size < 32:
+            raise ValueError("tile_size must be at least 32 pixels")
+        if not 0 <= overlap < 0.9:
+            raise ValueError("overlap must be between 0 and 0.9")
+        if merge not in MERGE_METHODS:
+            raise ValueError(f"Unknown merge method '{merge}', expected one of {', '.join(MERGE_METHODS)}")
+        if match not in MATCH_METRICS:
+            raise ValueError(f"Unknown match metric '{match}', expected one of {', '.join(MATCH_METRICS)}")
+        self.model = model
+        self.tile_size = int(tile_size)
+        self.overlap = float(overlap)
+        self.batch_size = max(1, int(batch_size))
+        self.workers = max(1, int(workers))
+        self.merge = merge
+        self.merge_threshold = float(merge_threshold)
+        self.match = match
+        self.full_image = full_image
+        self.timings = {"decode": 0.0, "tiling": 0.0, "inference": 0.0, "merge": 0.0}
+        self.tiles = 0
+
+    def _infer(self, arrays):
+        started = time.perf_counter()
+        results = self.model(arrays, size=self.tile_size)
+        self.timings["inference"] += time.perf_counter() - started
+        return results
+
+    def _timed(self, stage, function, *args):
+        started = time.perf_counter()
+        result = function(*args)
+        return result, stage, time.perf_counter() - started
+
+    def _wait(self, future):
+        result, stage, seconds = future.result()
+        self.timings[stage] += seconds
+        return result
+
+    def run(self, paths):
+        """
+        Yields (path, image, detections, tile count) for every image; detections are rows of
+        x1, y1, x2, y2, conf, class in image coordinates and image is the RGB array.
+        """
+        if not paths:
+            return
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            next_image = pool.submit(self._timed, "decode", _load_image, paths[0])
+            for index, path in enumerate(paths):
+                image = self._wait(next_image)
+                if index + 1 < len(paths):
+                    next_image = pool.submit(self._timed, "decode", _load_image, paths[index + 1])
+
+                height, width = image.shape[:2]
+                windows = tile_windows(width, height, self.tile_size, self.overlap)
+                batches = [windows[i:i + self.batch_size] for i in range(0, len(windows), self.batch_size)]
+                found = []
+                next_crops = pool.submit(self._timed, "tiling", _crop, image, batches[0])
+                for number, batch in enumerate(batches):
+                    crops = self._wait(next_crops)
+                    if number + 1 < len(batches):
+                        next_crops = pool.submit(self._timed, "tiling", _crop, image, batches[number + 1])
+                    results = self._infer(crops)
+                    for (x0, y0, _, _), boxes in zip(batch, results.xyxy):
+                        boxes = boxes.cpu().numpy() if hasattr(boxes, "cpu") else np.asarray(boxes)
+                        if len(boxes):
+                            found.append(boxes + np.array([x0, y0, x0, y0, 0, 0], dtype=boxes.dtype))
+                self.tiles += len(windows)
+
+                if self.full_image and len(windows) > 1:
+                    boxes = self._infer([image]).xyxy[0]
+                    boxes = boxes.cpu().numpy() if hasattr(boxes, "cpu") else np.asarray(boxes)
+                    if len(boxes):
+                        found.append(boxes)
+
+                started = time.perf_counter()
+                detections = np.concatenate(found).astype(np.float32) if found else np.zeros((0, 6), np.float32)
+                detections = merge_detections(detections, self.merge, self.merge_threshold, self.match)
+                self.timings["merge"] += time.perf_counter() - started
+                yield path, image, detections, len(windows)
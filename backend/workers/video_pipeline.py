@@ -0,0 +1,257 @@
+"""
+Pipelined video and frame-sequence detection used by inference_worker.py.
+
+Decoding, batched inference and annotation/encoding run as three stages joined by
+bounded queues, so the decoder and the encoder work while the model is busy:
+
+    decode thread --(frames)--> inference (caller thread) --(detections)--> encode thread
+
+Every stage counts the frames it handled and the time it was busy, which gives the
+per-stage fps reported back to the backend.
+"""
+import glob
+import json
+import os
+import queue
+import threading
+import time
+
+FRAME_EXTENSIONS = ('.bmp', '.jpg', '.jpeg', '.png', '.tif', '.tiff', '.webp')
+_END = object()
+
+
+class StageStats:
+    def __init__(self):
+        self.frames = 0
+        self.busy = 0.0
+
+    def add(self, frames, seconds):
+        self.frames += frames
+        self.busy += seconds
+
+    def to_dict(self):
+        return {
+            "frames": self.frames,
+            "busy_seconds": round(self.busy, 3),
+            "fps": round(self.frames / self.busy, 2) if self.busy else None,
+        }
+
+
+class FrameSource:
+    """Reads every stride-th frame of a video file or of a folder with frame images (BGR arrays)."""
+
+    def __init__(self, source, stride):
+        import cv2
+
+        self.cv2 = cv2
+        self.stride = max(1, int(stride))
+        if os.path.isdir(source):
+            self.frames = sorted(p for p in glob.glob(os.path.join(source, "*.*"))
+                                 if p.lower().endswith(FRAME_EXTENSIONS))
+            self.capture = None
+            self.fps = 25.0
+        else:
+            self.frames = None
+            self.capture = cv2.VideoCapture(source)
+            if not self.capture.isOpened():
+                raise FileNotFoundError(f"Cannot open video: {source}")
+            self.fps = self.capture.get(cv2.CAP_PROP_FPS) or 25.0
+
+    def __iter__(self):
+        if self.frames is not None:
+            for index in range(0, len(self.frames), self.stride):
+                frame = self.cv2.imread(self.frames[index])
+                if frame is not None:
+                    yield index, frame
+            return
+
+        index = 0
+        try:
+            while True:
+                # Skipped frames are only grabbed, not decoded into an image
+                if index % self.stride and not self.capture.grab():
+                    break
+                if index % self.stride == 0:
+                    ok, frame = self.capture.read()
+                    if not ok:
+                        break
+                    yield index, frame
+                index += 1
+        finally:
+            self.capture.release()
+
+
+def _put(q, item, stop):
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q, stop):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.5)
+        except queue.Empty:
+            continue
+    return _END
+
+
+def _draw(cv2, frame, detections):
+    for det in detections:
+        x1, y1, x2, y2 = (int(v) for v in det["xyxy"])
+        color = ((det["class_id"] * 67) % 256, (det["class_id"] * 151) % 256, (det["class_id"] * 29 + 128) % 256)
+        cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+        cv2.putText(frame, f"{det['class']} {det['conf']:.2f}", (x1, max(0, y1 - 4)),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1, cv2.LINE_AA)
+    return frame
+
+
+def run_video(model, source, img_size, save_dir, batch_size=8, stride=1, render=True, queue_size=32,
+              progress=None, progress_every=50):
+    """
+    Runs the decode/infer/encode pipeline over a video or frame folder.
+
+    Writes per-frame detections to <save_dir>/frames.ndjson and, with render, the
+    annotated video to <save_dir>/<source name>.mp4.
+
+    Args:
+        model: Loaded AutoShape model (conf/iou already set).
+        source (str): Video file or folder with frame images.
+        img_size (int): Inference size.
+        save_dir (str): Output folder.
+        batch_size (int): Frames per inference batch.
+        stride (int): Only every stride-th frame is processed.
+        render (bool): Write the annotated video.
+        queue_size (int): Capacity of the queues between the stages.
+        progress (callable, optional): Called with a stats dict every progress_every frames.
+
+    Returns:
+        dict: Frame counts, output file names and per-stage statistics.
+    """
+    import cv2
+
+    os.makedirs(save_dir, exist_ok=True)
+    frame_source = FrameSource(source, stride)
+    decoded = queue.Queue(maxsize=queue_size)
+    inferred = queue.Queue(maxsize=max(2, queue_size // max(1, batch_size)))
+    stop = threading.Event()
+    errors = []
+    stats = {"decode": StageStats(), "inference": StageStats(), "encode": StageStats()}
+    started = time.perf_counter()
+
+    def decode():
+        try:
+            iterator = iter(frame_source)
+            while not stop.is_set():
+                t = time.perf_counter()
+                item = next(iterator, _END)
+                if item is _END:
+                    break
+                stats["decode"].add(1, time.perf_counter() - t)
+                if not _put(decoded, item, stop):
+                    break
+        except Exception as e:
+            errors.append(e)
+        finally:
+            _put(decoded, _END, stop)
+
+    name = os.path.splitext(os.path.basename(os.path.normpath(source)))[0] or "video"
+    video_path = os.path.join(save_dir, f"{name}.mp4")
+    results_path = os.path.join(save_dir, "frames.ndjson")
+
+    def encode():
+        writer = None
+        try:
+            with open(results_path, "w", encoding="utf-8") as results_file:
+                while True:
+                    item = inferred.get()
+                    if item is _END:
+                        break
+                    t = time.perf_counter()
+                    for index, frame, detections in item:
+                        results_file.write(json.dumps({"frame": index, "detections": detections}) + "\n")
+                        if render:
+                            if writer is None:
+                                height, width = frame.shape[:2]
+                                writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*"mp4v"),
+                                                         frame_source.fps / frame_source.stride, (width, height))
+                            writer.write(_draw(cv2, frame, detections))
+                    stats["encode"].add(len(item), time.perf_counter() - t)
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            if writer is not None:
+                writer.release()
+
+    threads = [threading.Thread(target=decode, daemon=True), threading.Thread(target=encode, daemon=True)]
+    for thread in threads:
+        thread.start()
+
+    def snapshot():
+        elapsed = time.perf_counter() - started
+        done = stats["inference"].frames
+        return {
+            "frames": done,
+            "elapsed": round(elapsed, 3),
+            "fps": round(done / elapsed, 2) if elapsed else None,
+            "stages": {stage: s.to_dict() for stage, s in stats.items()},
+        }
+
+    try:
+        finished = False
+        next_progress = progress_every
+        while not finished and not stop.is_set():
+            batch = []
+            while len(batch) < batch_size:
+                item = _get(decoded, stop)
+                if item is _END:
+                    finished = True
+                    break
+                batch.append(item)
+            if not batch:
+                break
+
+            t = time.perf_counter()
+            # The decoder yields BGR frames, AutoShape expects RGB arrays
+            results = model([frame[..., ::-1] for _, frame in batch], size=img_size)
+            names = results.names if isinstance(results.names, dict) else dict(enumerate(results.names))
+            output = []
+            for (index, frame), boxes in zip(batch, results.xyxy):
+                detections = [
+                    {
+                        "class_id": int(row[5]),
+                        "class": names.get(int(row[5]), str(int(row[5]))),
+                        "conf": round(float(row[4]), 5),
+                        "xyxy": [round(float(v), 2) for v in row[:4]],
+                    }
+                    for row in boxes.tolist()
+                ]
+                output.append((index, frame, detections))
+            stats["inference"].add(len(batch), time.perf_counter() - t)
+
+            if not _put(inferred, output, stop):
+                break
+            if progress and stats["inference"].frames >= next_progress:
+                next_progress += progress_every
+                progress(snapshot())
+    finally:
+        if not stop.is_set():
+            # The encoder is still running, let it write everything it got and finish
+            inferred.put(_END)
+        # Releases the decoder if it still waits on a full queue
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0]
+
+    result = snapshot()
+    result["results_file"] = os.path.basename(results_path)
+    result["video_file"] = os.path.basename(video_path) if render and result["frames"] else None
+    return result